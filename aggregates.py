@@ -0,0 +1,57 @@
+import argparse
+import configparser
+from sql_queries import analytics_queries, aggregate_queries, aggregate_watermark_select
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+
+def aggregates_current(cur):
+    """Tells whether the aggregate tables count every play in songplays."""
+    cur.execute(aggregate_watermark_select)
+    counted, latest = cur.fetchone()
+    return latest is None or (counted is not None and counted >= latest)
+
+
+def route(cur, name, check=True):
+    """Returns the query answering the analytics question `name`.
+
+    The aggregate tables answer it when they are current; otherwise (e.g. right
+    after songplays was changed by hand) the query falls back to songplays.
+    """
+    if name not in analytics_queries:
+        raise ValueError(f"Unknown analytics query {name}, known: {sorted(analytics_queries)}")
+    if check and not aggregates_current(cur):
+        logger.warning(f"Aggregates are behind songplays, answering {name} from songplays")
+        return analytics_queries[name]
+    return aggregate_queries[name]
+
+
+def answer(cur, name, check=True):
+    """Runs the routed query for `name` and returns its rows."""
+    cur.execute(route(cur, name, check))
+    return cur.fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a README analytics question from the aggregate tables.")
+    parser.add_argument("name", choices=sorted(analytics_queries))
+    args = parser.parse_args()
+
+    from db_session import Session
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    session = Session.from_config(config)
+    try:
+        with session.connection() as conn:
+            for row in answer(conn.cursor(), args.name):
+                print(*row, sep="\t")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import argparse
+import configparser
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dialect import translate
+from aggregates import aggregates_current
+from sql_queries import (top_songs_limit_select, most_active_users_limit_select, plays_by_hour_agg_select,
+                         plays_by_hour_level_select, plays_by_weekday_agg_select, plays_by_weekday_level_select,
+                         plays_by_level_agg_select, last_load_select, top_songs_songplays_limit_select,
+                         most_active_users_songplays_limit_select, plays_by_hour_select, plays_by_weekday_select,
+                         plays_by_level_select)
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+
+class ResultCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=128, ttl=24 * 3600, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self.clock() - entry[0] > self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (self.clock(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class Analytics:
+    """The README analytics queries as parameterized methods with a result cache.
+
+    Results are cached per query, parameters and last load (the latest
+    pipeline_state update), so a repeated question only costs the watermark
+    lookup until the next ETL run. With `cache_dir` the results are also kept
+    as Parquet files and survive a restart.
+    """
+
+    def __init__(self, session, cache=None, cache_dir=None, dialect="redshift"):
+        self.session = session
+        self.cache = cache or ResultCache()
+        self.cache_dir = cache_dir
+        self.dialect = dialect
+
+    @classmethod
+    def from_config(cls, session, config):
+        """Creates the API with the [ANALYTICS] cache settings and the SQL dialect of the [ETL] BACKEND."""
+        return cls(session,
+                   ResultCache(maxsize=config.getint('ANALYTICS', 'CACHE_SIZE', fallback=128),
+                               ttl=config.getint('ANALYTICS', 'CACHE_TTL_SECONDS', fallback=24 * 3600)),
+                   cache_dir=config.get('ANALYTICS', 'CACHE_DIR', fallback='') or None,
+                   dialect=config.get('ETL', 'BACKEND', fallback='redshift'))
+
+    def last_load(self, cur):
+        cur.execute(last_load_select)
+        row = cur.fetchone()
+        return row[0].isoformat() if row and row[0] is not None else None
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.parquet")
+
+    def _read_parquet(self, key):
+        import pyarrow.parquet as pq
+
+        path = self._path(key)
+        if not os.path.exists(path) or time.time() - os.path.getmtime(path) > self.cache.ttl:
+            return None
+        table = pq.read_table(path)
+        return [tuple(row.values()) for row in table.to_pylist()]
+
+    def _write_parquet(self, key, columns, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        table = pa.Table.from_pylist([dict(zip(columns, row)) for row in rows],
+                                     schema=None if rows else pa.schema([(name, pa.null()) for name in columns]))
+        # Write next to the target and rename, so readers never see half a file
+        path = self._path(key)
+        pq.write_table(table, path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    def query(self, name, sql, params=None, fallback=None):
+        """Returns the rows of `sql`, from the cache when nothing was loaded since.
+
+        Like aggregates.route, a query on the aggregate tables runs `fallback` on
+        songplays instead while the aggregates are behind.
+        """
+        with self.session.connection() as conn:
+            cur = conn.cursor()
+            key = (name, tuple(sorted((params or {}).items())), self.last_load(cur))
+            rows = self.cache.get(key)
+            if rows is None and self.cache_dir:
+                rows = self._read_parquet(key)
+                if rows is not None:
+                    self.cache.put(key, rows)
+            if rows is not None:
+                return rows
+
+            if fallback and not aggregates_current(cur):
+                logger.warning(f"Aggregates are behind songplays, answering {name} from songplays")
+                sql = fallback
+            start = time.perf_counter()
+            cur.execute(translate(sql, self.dialect), params)
+            rows = cur.fetchall()
+            conn.commit()
+            logger.info(f"{name}{params or ''}: {len(rows)} rows in {time.perf_counter() - start:.3f}s")
+            self.cache.put(key, rows)
+            if self.cache_dir:
+                self._write_parquet(key, [column[0] for column in cur.description], rows)
+            return rows
+
+    def top_songs(self, n=10):
+        """The `n` most played songs as (title, artist, play_count)."""
+        return self.query("top_songs", top_songs_limit_select, {"n": int(n)},
+                          fallback=top_songs_songplays_limit_select)
+
+    def most_active_users(self, n=10):
+        """The `n` users with the most plays as (user_id, first_name, last_name, song_count)."""
+        return self.query("most_active_users", most_active_users_limit_select, {"n": int(n)},
+                          fallback=most_active_users_songplays_limit_select)
+
+    def plays_by_hour(self, level=None):
+        """Plays per hour of day as (hour, play_count), optionally for one level ('free'/'paid')."""
+        if level is None:
+            return self.query("plays_by_hour", plays_by_hour_agg_select, fallback=plays_by_hour_select)
+        return self.query("plays_by_hour", plays_by_hour_level_select, {"level": level})
+
+    def plays_by_weekday(self, level=None):
+        """Plays per weekday as (day_of_week, play_count), optionally for one level."""
+        if level is None:
+            return self.query("plays_by_weekday", plays_by_weekday_agg_select, fallback=plays_by_weekday_select)
+        return self.query("plays_by_weekday", plays_by_weekday_level_select, {"level": level})
+
+    def plays_by_level(self):
+        """Users and plays per level as (level, user_count, play_count)."""
+        return self.query("plays_by_level", plays_by_level_agg_select, fallback=plays_by_level_select)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a README analytics query through the result cache.")
+    parser.add_argument("name", choices=["top_songs", "most_active_users", "plays_by_hour", "plays_by_weekday",
+                                         "plays_by_level"])
+    parser.add_argument("-n", type=int, default=10, help="number of rows for top_songs/most_active_users")
+    parser.add_argument("--level", choices=["free", "paid"], default=None)
+    args = parser.parse_args()
+
+    from db_session import open_session
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    session = open_session(config)
+    try:
+        analytics = Analytics.from_config(session, config)
+        if args.name in ("top_songs", "most_active_users"):
+            rows = getattr(analytics, args.name)(args.n)
+        elif args.name in ("plays_by_hour", "plays_by_weekday"):
+            rows = getattr(analytics, args.name)(args.level)
+        else:
+            rows = analytics.plays_by_level()
+        for row in rows:
+            print(*row, sep="\t")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
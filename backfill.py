@@ -0,0 +1,240 @@
+import argparse
+import configparser
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+import psycopg2
+from psycopg2.extras import execute_values
+import sql_queries
+from sql_queries import (staging_events_clear, staging_songs_clear, staging_events_temp_create,
+                         staging_events_manifest_copy, staging_songs_manifest_copy, pipeline_state_upsert,
+                         pipeline_loaded_files_insert, pipeline_partitions_select, pipeline_partitions_upsert)
+from incremental import WATERMARK, get_watermark, new_keys
+from manifest import write_manifest
+from instrumentation import execute
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+SONGS = "songs"
+UNDATED = "undated"
+# log_data/2018/11/2018-11-01-events.json -> 2018, 11, 01
+_KEY_DATE = re.compile(r"(\d{4})/(\d{2})/(?:\d{4}-\d{2}-(\d{2}))?")
+
+
+def partition_key(url, by="day"):
+    """Returns the partition of a log object from its year/month/day key layout, e.g. '2018-11-01'."""
+    match = _KEY_DATE.search(url)
+    if not match:
+        return UNDATED
+    year, month, day = match.groups()
+    if by == "month" or day is None:
+        return f"{year}-{month}"
+    return f"{year}-{month}-{day}"
+
+
+def plan_partitions(urls, by="day"):
+    """Groups log object URLs into partitions, ordered by date."""
+    partitions = {}
+    for url in urls:
+        partitions.setdefault(partition_key(url, by), []).append(url)
+    return dict(sorted(partitions.items()))
+
+
+class MergeOrder:
+    """Lets partitions merge one at a time in partition order; stops the waiting ones after a failure.
+
+    Merging in order keeps the latest-state users table correct and makes the
+    committed partitions a prefix, so a rerun resumes at the first incomplete one.
+    """
+
+    def __init__(self):
+        self._turn = 0
+        self._failed_at = None
+        self._condition = threading.Condition()
+
+    def stopped(self, index):
+        """Tells whether an earlier partition failed, so partition `index` must not load any more."""
+        with self._condition:
+            return self._failed_at is not None and self._failed_at < index
+
+    def check(self, index):
+        """Raises if partition `index` is stopped."""
+        with self._condition:
+            if self.stopped(index):
+                raise RuntimeError(f"Stopped after partition {self._failed_at + 1} failed")
+
+    def wait(self, index):
+        with self._condition:
+            self._condition.wait_for(lambda: self.stopped(index) or self._turn == index)
+            self.check(index)
+
+    def done(self, index):
+        with self._condition:
+            self._turn = index + 1
+            self._condition.notify_all()
+
+    def fail(self, index):
+        with self._condition:
+            if self._failed_at is None or index < self._failed_at:
+                self._failed_at = index
+            self._condition.notify_all()
+
+
+class Backfill:
+    """Loads the not yet loaded S3 objects partition by partition with parallel workers.
+
+    Every worker holds its own connection with a temporary staging_events table,
+    so the COPYs run side by side. The merge, the loaded keys, the watermark and
+    the partition checkpoint are committed together per partition.
+    """
+
+    def __init__(self, params, config, s3, recorder=None, by="day"):
+        self.params = params
+        self.s3 = s3
+        self.recorder = recorder
+        self.by = by
+        self.log_data, self.song_data = config.get('S3', 'LOG_DATA'), config.get('S3', 'SONG_DATA')
+        self.manifest_prefix = config.get('S3', 'MANIFEST_PREFIX').strip("'\"").rstrip("/")
+        self.role, self.region = config.get('IAM_ROLE', 'ARN'), config.get('CLUSTER', 'REGION')
+        self.jsonpath = config.get('S3', 'LOG_JSONPATH').strip("'\"")
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or conn.closed:
+            conn = psycopg2.connect(**self.params)
+            conn.cursor().execute(staging_events_temp_create)
+            conn.commit()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _checkpoint(self, cur, key, urls):
+        now = datetime.utcnow()
+        execute_values(cur, pipeline_loaded_files_insert, [(url, now) for url in urls])
+        cur.execute(pipeline_partitions_upsert, {"partition_key": key, "files": len(urls), "completed_at": now})
+        if key == SONGS:
+            return
+        cur.execute("SELECT MAX(ts) FROM staging_events;")
+        staged_max = cur.fetchone()[0]
+        watermark = get_watermark(cur)
+        if staged_max is not None and (watermark is None or staged_max > watermark):
+            cur.execute(pipeline_state_upsert, {"name": WATERMARK, "value": str(staged_max), "updated_at": now})
+
+    def load_songs(self, urls):
+        """Stages and merges the new song files; the event partitions match against them."""
+        conn = self._connection()
+        cur = conn.cursor()
+        try:
+            manifest = write_manifest(self.s3, f"{self.manifest_prefix}/backfill/{SONGS}.manifest", urls)
+            cur.execute(staging_songs_clear)
+            execute(cur, staging_songs_manifest_copy.format(manifest=manifest, role=self.role, region=self.region,
+                                                            compression=""), self.recorder)
+            for query in sql_queries.song_merge_queries:
+                execute(cur, query, self.recorder)
+            self._checkpoint(cur, SONGS, urls)
+            conn.commit()
+            logger.info(f"Loaded {len(urls)} song files")
+        except Exception:
+            conn.rollback()
+            raise
+
+    def load_partition(self, index, key, urls, order):
+        """Stages one partition, then merges and checkpoints it once the previous one is committed."""
+        conn = self._connection()
+        cur = conn.cursor()
+        try:
+            # Queued partitions behind a failed one would only stage rows that are never merged
+            order.check(index)
+            manifest = write_manifest(self.s3, f"{self.manifest_prefix}/backfill/{key}-events.manifest", urls)
+            cur.execute(staging_events_clear)
+            execute(cur, staging_events_manifest_copy.format(manifest=manifest, role=self.role,
+                                                             jsonpath=self.jsonpath, region=self.region,
+                                                             compression=""), self.recorder)
+            # The temporary table survives the commit; the merge starts a fresh transaction
+            # after the previous partition committed, so it cannot conflict with it
+            conn.commit()
+
+            order.wait(index)
+            for query in sql_queries.event_merge_queries:
+                execute(cur, query, self.recorder)
+            if sql_queries.TIME_BUILDER == 'calendar':
+                from time_dimension import build_time_dimension
+                build_time_dimension(cur)
+            self._checkpoint(cur, key, urls)
+            conn.commit()
+            order.done(index)
+            logger.info(f"Partition {key} committed ({len(urls)} files)")
+        except Exception as e:
+            conn.rollback()
+            order.fail(index)
+            logger.error(f"Partition {key} failed: {e}")
+            raise
+
+    def run(self, workers=4):
+        """Loads all pending partitions; returns the number of committed partitions."""
+        conn = self._connection()
+        cur = conn.cursor()
+        log_keys, song_keys = new_keys(cur, self.s3, self.log_data, self.song_data)
+        cur.execute(pipeline_partitions_select)
+        completed = {row[0] for row in cur.fetchall()}
+        conn.commit()
+
+        partitions = list(plan_partitions(log_keys, self.by).items())
+        logger.info(f"{len(completed)} partitions completed earlier, {len(partitions)} pending"
+                    + (f", resuming at {partitions[0][0]}" if partitions else ""))
+
+        try:
+            if song_keys:
+                self.load_songs(song_keys)
+
+            order = MergeOrder()
+            with ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+                futures = [pool.submit(self.load_partition, i, key, urls, order)
+                           for i, (key, urls) in enumerate(partitions)]
+                wait(futures)
+            failed = [future.exception() for future in futures if future.exception()]
+            committed = len(futures) - len(failed)
+            if failed:
+                raise failed[0]
+            return committed
+        finally:
+            self.close()
+
+    def close(self):
+        """Closes the worker connections, which drops their temporary tables."""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill the warehouse partition by partition.")
+    parser.add_argument("--by", choices=["day", "month"], default=None, help="partition size")
+    parser.add_argument("--workers", type=int, default=None, help="parallel workers")
+    args = parser.parse_args()
+
+    import boto3
+    from load_config import load_config
+    from db_session import connect_params
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+    KEY, SECRET, _ = load_config()
+    s3 = boto3.client('s3', aws_access_key_id=KEY, aws_secret_access_key=SECRET,
+                      region_name=config.get('CLUSTER', 'REGION'))
+
+    backfill = Backfill(connect_params(config), config, s3,
+                        by=args.by or config.get('ETL', 'BACKFILL_PARTITION', fallback='day'))
+    backfill.run(args.workers or config.getint('ETL', 'MAX_CONCURRENCY', fallback=4))
+
+
+if __name__ == "__main__":
+    main()
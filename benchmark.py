@@ -0,0 +1,137 @@
+import argparse
+import configparser
+import json
+import os
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import psycopg2
+from dialect import to_postgres
+from generate_data import generate
+from local_ingest import ingest_directory, load_jsonpaths, local_dsn
+import sql_queries
+from sql_queries import (create_table_queries, drop_table_queries, analytics_queries, aggregate_queries,
+                         staging_events_table_create, staging_songs_table_create)
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+
+class StageTimer:
+    """Measures wall time and peak Python memory of consecutive benchmark stages."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, name, func, *args):
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            seconds = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.stages[name] = {"seconds": round(seconds, 3), "peak_memory_mb": round(peak / 2 ** 20, 2)}
+            logger.info(f"{name}: {seconds:.2f}s, peak memory {peak / 2 ** 20:.1f} MB")
+
+
+def run_pipeline(cur, conn, data_dir, batch_size=10000):
+    """Runs create_tables, staging, insert_tables and the README queries; returns the stage metrics."""
+    timer = StageTimer()
+
+    def create():
+        for query in drop_table_queries + create_table_queries:
+            cur.execute(to_postgres(query))
+        conn.commit()
+
+    def stage():
+        jsonpaths = load_jsonpaths(os.path.join(data_dir, "log_json_path.json"))
+        ingest_directory(cur, os.path.join(data_dir, "log_data"), staging_events_table_create, jsonpaths, batch_size)
+        ingest_directory(cur, os.path.join(data_dir, "song_data"), staging_songs_table_create, None, batch_size)
+        conn.commit()
+
+    def insert():
+        for query in sql_queries.insert_table_queries:
+            cur.execute(to_postgres(query))
+        if sql_queries.time_table_insert not in sql_queries.insert_table_queries:
+            from time_dimension import build_time_dimension
+            build_time_dimension(cur, use_copy=True)
+        conn.commit()
+
+    def query(sql):
+        cur.execute(to_postgres(sql))
+        return cur.fetchall()
+
+    timer.run("create_tables", create)
+    timer.run("staging", stage)
+    timer.run("insert_tables", insert)
+    for name, sql in analytics_queries.items():
+        timer.run(f"query_{name}", query, sql)
+    # The same questions answered from the aggregate tables, for the before/after comparison
+    for name, sql in aggregate_queries.items():
+        timer.run(f"aggregate_{name}", query, sql)
+
+    cur.execute("SELECT COUNT(*) FROM songplays;")
+    return timer.stages, cur.fetchone()[0]
+
+
+def compare(result, baseline, tolerance):
+    """Returns the stages that got slower than the baseline by more than `tolerance` (e.g. 0.2 = 20%)."""
+    regressions = []
+    for stage, metrics in result["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if not before or before["seconds"] <= 0:
+            continue
+        change = metrics["seconds"] / before["seconds"] - 1
+        marker = "REGRESSION" if change > tolerance else "ok"
+        logger.info(f"{stage:28} {before['seconds']:>8.2f}s -> {metrics['seconds']:>8.2f}s ({change:+.0%}) {marker}")
+        if change > tolerance:
+            regressions.append(stage)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic data against local PostgreSQL.")
+    parser.add_argument("--scale", type=float, default=1, help="scale factor of the generated data (1, 10, 100)")
+    parser.add_argument("--data", default=None, help="data directory, generated if missing")
+    parser.add_argument("--baseline-dir", default="benchmarks")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown per stage")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    data_dir = args.data or os.path.join("data", "synthetic", f"{args.scale:g}x")
+    if not os.path.isdir(data_dir):
+        generate(data_dir, args.scale)
+
+    conn = psycopg2.connect(local_dsn(config))
+    try:
+        stages, songplays = run_pipeline(conn.cursor(), conn, data_dir,
+                                         config.getint('LOCAL', 'BATCH_SIZE', fallback=10000))
+    finally:
+        conn.close()
+
+    result = {"scale": args.scale, "run_at": datetime.now(timezone.utc).isoformat(),
+              "songplays": songplays, "stages": stages}
+    baseline_path = os.path.join(args.baseline_dir, f"baseline-{args.scale:g}x.json")
+
+    regressions = []
+    if os.path.exists(baseline_path) and not args.save_baseline:
+        with open(baseline_path) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+    if args.save_baseline or not os.path.exists(baseline_path):
+        os.makedirs(args.baseline_dir, exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump(result, f, indent=2)
+        logger.info(f"Baseline saved to {baseline_path}")
+
+    if regressions:
+        raise SystemExit(f"Slower than baseline: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import configparser
+import os
+import tempfile
+import time
+import psycopg2
+import pyarrow.parquet as pq
+from dialect import to_postgres
+from local_ingest import (copy_rows, ingest_directory, iter_json_files, load_jsonpaths,
+                          local_dsn, staging_rows)
+from parquet_staging import convert_events, convert_songs
+from sql_queries import (staging_events_table_create, staging_songs_table_create,
+                         staging_events_table_drop, staging_songs_table_drop)
+from ddl import parse_create_table
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+
+def directory_bytes(root, suffix):
+    """Sums the size of all files below `root` ending in `suffix`."""
+    total = 0
+    for dirpath, _, filenames in os.walk(root):
+        total += sum(os.path.getsize(os.path.join(dirpath, name)) for name in filenames if name.endswith(suffix))
+    return total
+
+
+def iter_parquet_rows(root, batch_size=10000):
+    """Streams rows from all Parquet files below `root`, dropping the partition columns."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith(".parquet"):
+                parquet = pq.ParquetFile(os.path.join(dirpath, filename))
+                for batch in parquet.iter_batches(batch_size=batch_size):
+                    yield from zip(*(column.to_pylist() for column in batch.columns))
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def benchmark(cur, conn, log_data, song_data, jsonpaths, workdir, batch_size=10000):
+    """Loads the same data once from JSON and once from Parquet and returns the measurements."""
+    events_dir, songs_dir = os.path.join(workdir, "log_data"), os.path.join(workdir, "song_data")
+    _, convert_seconds = _timed(lambda: (convert_events(log_data, events_dir, jsonpaths),
+                                         convert_songs(song_data, songs_dir)))
+
+    def reset():
+        for query in [staging_events_table_drop, staging_songs_table_drop,
+                      staging_events_table_create, staging_songs_table_create]:
+            cur.execute(to_postgres(query))
+        conn.commit()
+
+    def load_json():
+        ingest_directory(cur, log_data, staging_events_table_create, jsonpaths, batch_size)
+        ingest_directory(cur, song_data, staging_songs_table_create, None, batch_size)
+        conn.commit()
+
+    def load_parquet():
+        for create_query, root in [(staging_events_table_create, events_dir),
+                                   (staging_songs_table_create, songs_dir)]:
+            table, columns = parse_create_table(create_query)
+            names = [column["name"] for column in columns]
+            copy_rows(cur, table, names, iter_parquet_rows(root, batch_size), batch_size)
+        conn.commit()
+
+    def parse_json():
+        return sum(1 for _ in staging_rows(log_data, staging_events_table_create, jsonpaths)) + \
+            sum(1 for _ in staging_rows(song_data, staging_songs_table_create))
+
+    def parse_parquet():
+        return sum(1 for _ in iter_parquet_rows(events_dir, batch_size)) + \
+            sum(1 for _ in iter_parquet_rows(songs_dir, batch_size))
+
+    rows, json_parse = _timed(parse_json)
+    _, parquet_parse = _timed(parse_parquet)
+    reset()
+    _, json_load = _timed(load_json)
+    reset()
+    _, parquet_load = _timed(load_parquet)
+
+    json_files = list(iter_json_files(log_data)) + list(iter_json_files(song_data))
+    return {
+        "rows": rows,
+        "json": {"files": len(json_files), "bytes_read": sum(os.path.getsize(path) for path in json_files),
+                 "parse_seconds": round(json_parse, 3), "load_seconds": round(json_load, 3)},
+        "parquet": {"bytes_read": directory_bytes(workdir, ".parquet"), "convert_seconds": round(convert_seconds, 3),
+                    "parse_seconds": round(parquet_parse, 3), "load_seconds": round(parquet_load, 3)},
+    }
+
+
+def main():
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    conn = psycopg2.connect(local_dsn(config))
+    cur = conn.cursor()
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            result = benchmark(cur, conn, config.get('LOCAL', 'LOG_DATA'), config.get('LOCAL', 'SONG_DATA'),
+                               load_jsonpaths(config.get('LOCAL', 'LOG_JSONPATH')), workdir,
+                               config.getint('LOCAL', 'BATCH_SIZE', fallback=10000))
+    finally:
+        conn.close()
+
+    logger.info(f"Rows: {result['rows']}")
+    for fmt in ("json", "parquet"):
+        stats = result[fmt]
+        logger.info(f"{fmt:8} bytes read {stats['bytes_read']:>12,}  parse {stats['parse_seconds']:>7.2f}s  "
+                    f"load {stats['load_seconds']:>7.2f}s")
+    ratio = result["json"]["bytes_read"] / max(result["parquet"]["bytes_read"], 1)
+    logger.info(f"Parquet reads {ratio:.1f}x fewer bytes than JSON")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+import argparse
+import configparser
+import math
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+from manifest import NODE_SLICES, list_objects
+from provisioning import REGION, Timings, wait_until, ensure_role, attach_policy, update_config
+from logger import get_logger
+
+# Konfiguration des Loggers
+logger = get_logger(__name__)
+
+# On-Demand-Preis in USD pro Knoten und Stunde (us-west-2), Speicher pro Knoten
+# und größte Knotenzahl; RA3-Knoten speichern in Managed Storage
+NODE_TYPES = {
+    "dc2.large": {"price": 0.25, "storage_gb": 160, "max_nodes": 32},
+    "ra3.xlplus": {"price": 1.086, "storage_gb": 32000, "max_nodes": 16},
+    "ra3.4xlarge": {"price": 3.26, "storage_gb": 128000, "max_nodes": 32},
+    "dc2.8xlarge": {"price": 4.80, "storage_gb": 2560, "max_nodes": 128},
+    "ra3.16xlarge": {"price": 13.04, "storage_gb": 128000, "max_nodes": 128},
+}
+
+GB = 1024 ** 3
+
+
+def hourly_cost(node_type, nodes):
+    """Kosten des Clusters pro Stunde in USD, None bei unbekanntem Knotentyp."""
+    if node_type not in NODE_TYPES:
+        return None
+    return NODE_TYPES[node_type]["price"] * int(nodes)
+
+
+def estimate_load(s3, uris):
+    """Summiert Anzahl und Größe der JSON-Objekte unter den S3-Präfixen."""
+    objects, total = 0, 0
+    for uri in uris:
+        listed = list_objects(s3, uri)
+        size = sum(size for _, size in listed)
+        logger.info(f"{uri}: {len(listed)} Objekte, {size / GB:.2f} GB")
+        objects += len(listed)
+        total += size
+    return {"objects": objects, "bytes": total}
+
+
+def choose_size(total_bytes, bytes_per_slice=8 * GB, storage_factor=2.0, min_nodes=2, max_nodes=8):
+    """Wählt den günstigsten Knotentyp und die Knotenzahl für `total_bytes` Eingangsdaten.
+
+    Jeder Slice soll höchstens `bytes_per_slice` laden, und der Speicher muss
+    `storage_factor` mal die Eingangsdaten fassen (Staging, Sternschema, Reserve).
+    Reichen `max_nodes` Knoten nicht für genug Slices, gewinnt der Cluster mit
+    den meisten Slices.
+    """
+    slices_needed = max(1, math.ceil(total_bytes / bytes_per_slice))
+    storage_needed_gb = total_bytes * storage_factor / GB
+    candidates, too_small = [], []
+    for node_type, spec in NODE_TYPES.items():
+        limit = min(int(max_nodes), spec["max_nodes"])
+        storage_nodes = max(int(min_nodes), math.ceil(storage_needed_gb / spec["storage_gb"]))
+        if storage_nodes > limit:
+            continue
+        nodes = max(storage_nodes, math.ceil(slices_needed / NODE_SLICES[node_type]))
+        if nodes <= limit:
+            candidates.append((hourly_cost(node_type, nodes), nodes, node_type))
+        else:
+            too_small.append((-NODE_SLICES[node_type] * limit, hourly_cost(node_type, limit), limit, node_type))
+    if candidates:
+        cost, nodes, node_type = min(candidates)
+    elif too_small:
+        _, cost, nodes, node_type = min(too_small)
+        logger.warning(f"{slices_needed} Slices wären nötig, mit höchstens {max_nodes} Knoten "
+                       f"sind es {NODE_SLICES[node_type] * nodes}")
+    else:
+        raise ValueError(f"Kein Knotentyp speichert {total_bytes / GB:.1f} GB mit höchstens {max_nodes} Knoten")
+    plan = {"node_type": node_type, "nodes": nodes, "slices": NODE_SLICES[node_type] * nodes,
+            "hourly_cost": round(cost, 3)}
+    logger.info(f"Größenvorschlag für {total_bytes / GB:.2f} GB: {nodes}x {node_type} "
+                f"({plan['slices']} Slices, {cost:.2f} USD/h)")
+    return plan
+
+
+def plan_from_config(config, s3):
+    """Schätzt die Last der [S3]-Präfixe und wählt die Clustergröße nach [CAPACITY]."""
+    load = estimate_load(s3, [config.get('S3', 'LOG_DATA'), config.get('S3', 'SONG_DATA')])
+    return choose_size(load["bytes"],
+                       bytes_per_slice=config.getfloat('CAPACITY', 'BYTES_PER_SLICE_GB', fallback=8.0) * GB,
+                       storage_factor=config.getfloat('CAPACITY', 'STORAGE_FACTOR', fallback=2.0),
+                       min_nodes=config.getint('CAPACITY', 'MIN_NODES', fallback=2),
+                       max_nodes=config.getint('CAPACITY', 'MAX_NODES', fallback=8))
+
+
+def snapshot_identifier(cluster_identifier, label):
+    """Snapshot-Namen dürfen nur Kleinbuchstaben, Ziffern und Bindestriche enthalten."""
+    return f"{cluster_identifier.lower()}-{label}-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}"
+
+
+class CapacityManager:
+    """Pausiert, startet, skaliert, sichert und stellt einen Redshift-Cluster wieder her.
+
+    Jeder Schritt wird mit seiner Dauer in `timings` und den während des
+    Schritts angefallenen Clusterkosten in `costs` festgehalten.
+    """
+
+    def __init__(self, redshift, identifier, timings=None, timeout=3600, sleep=time.sleep):
+        self.redshift = redshift
+        self.identifier = identifier
+        self.timings = timings or Timings()
+        self.timeout = timeout
+        self.sleep = sleep
+        self.costs = {}
+
+    def describe(self):
+        """Beschreibung des Clusters oder None, wenn er nicht existiert."""
+        try:
+            return self.redshift.describe_clusters(ClusterIdentifier=self.identifier)['Clusters'][0]
+        except self.redshift.exceptions.ClusterNotFoundFault:
+            return None
+
+    def _wait_for(self, status, description, node_type=None, nodes=None):
+        """Wartet auf `status`, mit `node_type` und `nodes` auch auf diese Größe.
+
+        Direkt nach einem Resize meldet Redshift oft noch kurz 'available' mit der alten Größe.
+        """
+        def check():
+            cluster = self.describe()
+            if cluster is None:
+                return None
+            logger.info(f"Cluster-Status: {cluster['ClusterStatus']}, "
+                        f"{cluster['NumberOfNodes']}x {cluster['NodeType']}")
+            if cluster['ClusterStatus'] != status or (status == 'available' and not cluster.get('Endpoint')):
+                return None
+            if node_type is not None and (cluster['NodeType'], cluster['NumberOfNodes']) != (node_type, int(nodes)):
+                return None
+            return cluster
+
+        return wait_until(check, self.timeout, description, base=10, cap=60, sleep=self.sleep)
+
+    @contextmanager
+    def step(self, name, cluster):
+        """Misst einen Schritt und verbucht die Kosten des Clusters in seiner Größe zu Beginn."""
+        start = time.perf_counter()
+        with self.timings.measure(name):
+            yield
+        cost = hourly_cost(cluster['NodeType'], cluster['NumberOfNodes']) if cluster else None
+        if cost is not None:
+            seconds = time.perf_counter() - start
+            self.costs[name] = self.costs.get(name, 0.0) + cost * seconds / 3600
+            logger.info(f"{name}: {seconds:.0f}s mit {cluster['NumberOfNodes']}x {cluster['NodeType']} "
+                        f"({cost:.2f} USD/h), etwa {self.costs[name]:.2f} USD")
+
+    def resize(self, node_type, nodes):
+        """Elastic Resize auf `nodes` Knoten vom Typ `node_type`; ohne Änderung passiert nichts."""
+        cluster = self.describe()
+        if cluster is None:
+            raise RuntimeError(f"Cluster {self.identifier} existiert nicht, Resize nicht möglich")
+        if cluster['NodeType'] == node_type and cluster['NumberOfNodes'] == int(nodes):
+            logger.info(f"Cluster hat bereits {nodes}x {node_type}")
+            return cluster
+        logger.info(f"Elastic Resize: {cluster['NumberOfNodes']}x {cluster['NodeType']} -> {nodes}x {node_type}")
+        with self.step("Elastic Resize", cluster):
+            self.redshift.resize_cluster(ClusterIdentifier=self.identifier, NodeType=node_type,
+                                         NumberOfNodes=int(nodes),
+                                         ClusterType='multi-node' if int(nodes) > 1 else 'single-node',
+                                         Classic=False)
+            cluster = self._wait_for('available', "Elastic Resize", node_type, nodes)
+        return cluster
+
+    def pause(self):
+        """Pausiert den Cluster; bezahlt wird danach nur noch der Speicher."""
+        cluster = self.describe()
+        if cluster is None or cluster['ClusterStatus'] == 'paused':
+            return cluster
+        with self.step("Pausieren", cluster):
+            self.redshift.pause_cluster(ClusterIdentifier=self.identifier)
+            cluster = self._wait_for('paused', "Pausieren")
+        saved = hourly_cost(cluster['NodeType'], cluster['NumberOfNodes'])
+        logger.info(f"Cluster pausiert, spart etwa {saved or 0:.2f} USD/h")
+        return cluster
+
+    def resume(self):
+        """Startet einen pausierten Cluster und wartet, bis er verfügbar ist."""
+        cluster = self.describe()
+        if cluster is None:
+            raise RuntimeError(f"Cluster {self.identifier} existiert nicht, erst mit restore wiederherstellen")
+        if cluster['ClusterStatus'] != 'paused':
+            return cluster if cluster['ClusterStatus'] == 'available' else self._wait_for('available', "Start")
+        with self.step("Fortsetzen", None):
+            self.redshift.resume_cluster(ClusterIdentifier=self.identifier)
+            cluster = self._wait_for('available', "Fortsetzen")
+        return cluster
+
+    def snapshot(self, snapshot_id=None):
+        """Legt einen manuellen Snapshot an und wartet, bis er verfügbar ist."""
+        snapshot_id = snapshot_id or snapshot_identifier(self.identifier, "manual")
+        cluster = self.describe()
+
+        def check():
+            snapshot = self.redshift.describe_cluster_snapshots(SnapshotIdentifier=snapshot_id)['Snapshots'][0]
+            return snapshot if snapshot['Status'] == 'available' else None
+
+        with self.step("Snapshot", cluster):
+            self.redshift.create_cluster_snapshot(SnapshotIdentifier=snapshot_id, ClusterIdentifier=self.identifier)
+            wait_until(check, self.timeout, "Snapshot", base=10, cap=60, sleep=self.sleep)
+        logger.info(f"Snapshot {snapshot_id} ist verfügbar")
+        return snapshot_id
+
+    def latest_snapshot(self):
+        """Der jüngste manuelle Snapshot des Clusters oder None."""
+        snapshots = self.redshift.describe_cluster_snapshots(ClusterIdentifier=self.identifier,
+                                                             SnapshotType='manual')['Snapshots']
+        snapshots = [snapshot for snapshot in snapshots if snapshot['Status'] == 'available']
+        if not snapshots:
+            return None
+        return max(snapshots, key=lambda snapshot: snapshot['SnapshotCreateTime'])['SnapshotIdentifier']
+
+    def retire(self, snapshot_id=None):
+        """Löscht den Cluster mit einem abschließenden Snapshot statt ohne; gibt dessen Namen zurück."""
+        snapshot_id = snapshot_id or snapshot_identifier(self.identifier, "final")
+        with self.step("Löschen mit Snapshot", self.describe()):
+            self.redshift.delete_cluster(ClusterIdentifier=self.identifier, SkipFinalClusterSnapshot=False,
+                                         FinalClusterSnapshotIdentifier=snapshot_id)
+        logger.info(f"Cluster wird gelöscht, abschließender Snapshot: {snapshot_id}")
+        return snapshot_id
+
+    def restore(self, snapshot_id=None, node_type=None, nodes=None, iam_roles=None):
+        """Stellt den Cluster aus einem Snapshot (Standard: dem jüngsten) wieder her."""
+        snapshot_id = snapshot_id or self.latest_snapshot()
+        if snapshot_id is None:
+            raise RuntimeError(f"Kein Snapshot für {self.identifier} gefunden")
+        params = dict(ClusterIdentifier=self.identifier, SnapshotIdentifier=snapshot_id)
+        if node_type:
+            params.update(NodeType=node_type, NumberOfNodes=int(nodes))
+        if iam_roles:
+            params["IamRoles"] = list(iam_roles)
+        logger.info(f"Stelle {self.identifier} aus {snapshot_id} wieder her")
+        with self.step("Wiederherstellen", None):
+            self.redshift.restore_from_cluster_snapshot(**params)
+            cluster = self._wait_for('available', "Wiederherstellen")
+        return cluster
+
+    def ensure_available(self):
+        """Startet den Cluster bei Bedarf: pausiert wird er fortgesetzt, gelöscht aus dem Snapshot geholt.
+
+        Die Wiederherstellung hängt keine IAM-Rolle an; `restore_cluster` stellt sie vorher wieder her.
+        """
+        cluster = self.describe()
+        if cluster is None:
+            return self.restore()
+        if cluster['ClusterStatus'] == 'paused':
+            return self.resume()
+        if cluster['ClusterStatus'] != 'available':
+            return self._wait_for('available', "Start")
+        return cluster
+
+    def log(self):
+        self.timings.log("Zeitaufschlüsselung der Kapazitätsschritte:")
+        logger.info(f"  {'Kosten gesamt':28} {sum(self.costs.values()):8.2f} USD")
+
+
+def restore_cluster(manager, iam, config, snapshot_id=None, path='dwh.cfg'):
+    """Stellt den Cluster samt IAM-Rolle wieder her und trägt Endpoint und Rollen-ARN in `config` und `path` ein.
+
+    clean_up_cluster.py löscht auch die Rolle; COPY braucht sie wieder.
+    """
+    role_name = config.get('DWH', 'DWH_IAM_ROLE_NAME')
+    role_arn = ensure_role(iam, role_name)
+    attach_policy(iam, role_name)
+    cluster = manager.restore(snapshot_id, iam_roles=[role_arn])
+    update_config(cluster['Endpoint']['Address'], role_arn, path)
+    config.set('CLUSTER', 'HOST', cluster['Endpoint']['Address'])
+    config.set('IAM_ROLE', 'ARN', role_arn)
+    return cluster
+
+
+@contextmanager
+def managed_run(manager, config, s3=None, heavy=False, iam=None):
+    """Hält den Cluster für einen ETL-Lauf bereit.
+
+    Vor dem Lauf wird der Cluster bei Bedarf fortgesetzt oder, mit `iam`, samt
+    Rolle aus dem jüngsten Snapshot wiederhergestellt. Vor schweren Läufen
+    (`heavy`, z.B. Backfills) wird er auf die aus der S3-Last geschätzte Größe
+    vergrößert. Danach wird er nach [CAPACITY] wieder verkleinert und pausiert.
+    """
+    if iam is not None and manager.describe() is None:
+        restore_cluster(manager, iam, config)
+    cluster = manager.ensure_available()
+    original = (cluster['NodeType'], cluster['NumberOfNodes'])
+    resized = False
+    if heavy and s3 is not None:
+        plan = plan_from_config(config, s3)
+        if plan["hourly_cost"] > (hourly_cost(*original) or 0):
+            try:
+                cluster = manager.resize(plan["node_type"], plan["nodes"])
+                resized = True
+            except ClientError as e:
+                # Nicht jede Zielgröße ist per Elastic Resize erreichbar; geladen wird trotzdem
+                logger.warning(f"Elastic Resize nicht möglich, lade mit {original[1]}x {original[0]}: {e}")
+        else:
+            logger.info(f"Cluster mit {original[1]}x {original[0]} ist groß genug")
+    try:
+        with manager.step("ETL-Lauf", cluster):
+            yield cluster
+    finally:
+        if resized and config.getboolean('CAPACITY', 'RESIZE_BACK', fallback=True):
+            manager.resize(*original)
+        if config.getboolean('CAPACITY', 'PAUSE_AFTER_RUN', fallback=False):
+            manager.pause()
+        manager.log()
+
+
+def from_config(config):
+    """Erzeugt CapacityManager und S3-Client mit den Zugangsdaten aus .env und dwh.cfg."""
+    import boto3
+    from load_config import load_config
+
+    KEY, SECRET, dwh_params = load_config()
+    session = boto3.session.Session(aws_access_key_id=KEY, aws_secret_access_key=SECRET,
+                                    region_name=config.get('CLUSTER', 'REGION', fallback=REGION))
+    manager = CapacityManager(session.client('redshift'), dwh_params["DWH_CLUSTER_IDENTIFIER"],
+                              timeout=config.getint('CAPACITY', 'TIMEOUT', fallback=3600))
+    s3 = session.client('s3', endpoint_url=config.get('S3', 'ENDPOINT_URL', fallback=None) or None)
+    return manager, s3, session
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Größe, Pause und Snapshots des Redshift-Clusters verwalten.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("plan", help="Last aus den S3-Präfixen schätzen und eine Größe vorschlagen")
+    resize = commands.add_parser("resize", help="Elastic Resize (Standard: auf den Größenvorschlag)")
+    resize.add_argument("--node-type", choices=list(NODE_TYPES))
+    resize.add_argument("--nodes", type=int)
+    commands.add_parser("pause")
+    commands.add_parser("resume")
+    snapshot = commands.add_parser("snapshot")
+    snapshot.add_argument("--id", dest="snapshot_id")
+    restore = commands.add_parser("restore", help="Cluster aus einem Snapshot wiederherstellen")
+    restore.add_argument("--snapshot", help="Standard: der jüngste manuelle Snapshot")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+    manager, s3, session = from_config(config)
+
+    if args.command == "plan":
+        plan_from_config(config, s3)
+    elif args.command == "resize":
+        if args.node_type and args.nodes:
+            node_type, nodes = args.node_type, args.nodes
+        else:
+            plan = plan_from_config(config, s3)
+            node_type, nodes = plan["node_type"], plan["nodes"]
+        manager.resize(node_type, nodes)
+    elif args.command == "pause":
+        manager.pause()
+    elif args.command == "resume":
+        manager.resume()
+    elif args.command == "snapshot":
+        manager.snapshot(args.snapshot_id)
+    elif args.command == "restore":
+        restore_cluster(manager, session.client('iam'), config, args.snapshot)
+    manager.log()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,83 @@
-import boto3
+import configparser
 from logger import get_logger
-from load_config import load_config
 from botocore.exceptions import ClientError
 
 # Logger initialisieren
 logger = get_logger(__name__)
 
-# Laden der Konfiguration
-KEY, SECRET, dwh_params = load_config()
-
-# Clients initialisieren
-redshift = boto3.client('redshift', aws_access_key_id=KEY, aws_secret_access_key=SECRET, region_name='us-west-2')
-iam = boto3.client('iam', aws_access_key_id=KEY, aws_secret_access_key=SECRET, region_name='us-west-2')
-
-# Cluster löschen
-try:
-    logger.info("Prüfe, ob Redshift-Cluster existiert...")
-    cluster_info = redshift.describe_clusters(ClusterIdentifier=dwh_params["DWH_CLUSTER_IDENTIFIER"])
-    
-    if cluster_info and 'Clusters' in cluster_info:
-        logger.info("Redshift-Cluster wird gelöscht...")
-        redshift.delete_cluster(ClusterIdentifier=dwh_params["DWH_CLUSTER_IDENTIFIER"], SkipFinalClusterSnapshot=True)
-        logger.info("Cluster erfolgreich zum Löschen markiert.")
-    else:
-        logger.warning("Cluster nicht gefunden. Vielleicht wurde er bereits gelöscht?")
-except ClientError as e:
-    if "ClusterNotFound" in str(e):
-        logger.warning("Cluster ist bereits gelöscht oder existiert nicht.")
-    else:
-        logger.error(f"Fehler beim Löschen des Clusters: {e}")
-
-# IAM-Rolle und Policy löschen
-try:
-    logger.info("Trenne die IAM-Policy von der Rolle...")
-    iam.detach_role_policy(RoleName=dwh_params["DWH_IAM_ROLE_NAME"], PolicyArn="arn:aws:iam::aws:policy/AmazonS3ReadOnlyAccess")
-    logger.info("Policy erfolgreich entfernt.")
-
-    logger.info("Lösche IAM-Rolle...")
-    iam.delete_role(RoleName=dwh_params["DWH_IAM_ROLE_NAME"])
-    logger.info("IAM-Rolle erfolgreich gelöscht.")
-except ClientError as e:
-    if "NoSuchEntity" in str(e):
-        logger.warning("IAM-Rolle existiert bereits nicht.")
-    else:
-        logger.error(f"Fehler beim Löschen der IAM-Rolle: {e}")
-
-logger.info("Alle Ressourcen wurden erfolgreich bereinigt!")
+S3_READ_ONLY_POLICY = "arn:aws:iam::aws:policy/AmazonS3ReadOnlyAccess"
+
+
+def delete_cluster(redshift, identifier, snapshot=False):
+    """Löscht den Cluster, mit abschließendem Snapshot, wenn `snapshot` gesetzt ist."""
+    try:
+        logger.info("Prüfe, ob Redshift-Cluster existiert...")
+        cluster_info = redshift.describe_clusters(ClusterIdentifier=identifier)
+
+        if cluster_info and 'Clusters' in cluster_info:
+            if snapshot:
+                # Abschließender Snapshot statt Datenverlust; 'python capacity.py restore' holt den Cluster zurück
+                from capacity import CapacityManager
+
+                logger.info("Redshift-Cluster wird mit abschließendem Snapshot gelöscht...")
+                CapacityManager(redshift, identifier).retire()
+            else:
+                logger.info("Redshift-Cluster wird gelöscht...")
+                redshift.delete_cluster(ClusterIdentifier=identifier, SkipFinalClusterSnapshot=True)
+            logger.info("Cluster erfolgreich zum Löschen markiert.")
+        else:
+            logger.warning("Cluster nicht gefunden. Vielleicht wurde er bereits gelöscht?")
+    except ClientError as e:
+        if "ClusterNotFound" in str(e):
+            logger.warning("Cluster ist bereits gelöscht oder existiert nicht.")
+        else:
+            logger.error(f"Fehler beim Löschen des Clusters: {e}")
+
+
+def delete_role(iam, role_name):
+    """Trennt die Policy von der IAM-Rolle und löscht die Rolle."""
+    try:
+        logger.info("Trenne die IAM-Policy von der Rolle...")
+        iam.detach_role_policy(RoleName=role_name, PolicyArn=S3_READ_ONLY_POLICY)
+        logger.info("Policy erfolgreich entfernt.")
+
+        logger.info("Lösche IAM-Rolle...")
+        iam.delete_role(RoleName=role_name)
+        logger.info("IAM-Rolle erfolgreich gelöscht.")
+    except ClientError as e:
+        if "NoSuchEntity" in str(e):
+            logger.warning("IAM-Rolle existiert bereits nicht.")
+        else:
+            logger.error(f"Fehler beim Löschen der IAM-Rolle: {e}")
+
+
+def clean_up(redshift, iam, dwh_params, snapshot=False):
+    """Löscht Cluster, IAM-Rolle und Policy."""
+    delete_cluster(redshift, dwh_params["DWH_CLUSTER_IDENTIFIER"], snapshot)
+    delete_role(iam, dwh_params["DWH_IAM_ROLE_NAME"])
+    logger.info("Alle Ressourcen wurden erfolgreich bereinigt!")
+
+
+def clean_up_from_config(config):
+    """Bereinigt mit den Zugangsdaten aus .env und den Parametern aus der bereits gelesenen `config`."""
+    import boto3
+    from load_config import load_config
+    from provisioning import REGION
+
+    KEY, SECRET, dwh_params = load_config(config=config)
+
+    # Clients initialisieren
+    session = boto3.session.Session(aws_access_key_id=KEY, aws_secret_access_key=SECRET, region_name=REGION)
+    clean_up(session.client('redshift'), session.client('iam'), dwh_params,
+             snapshot=config.getboolean('CAPACITY', 'SNAPSHOT_ON_DELETE', fallback=False))
+
+
+def main():
+    # Laden der Konfiguration
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+    clean_up_from_config(config)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
+import argparse
 import configparser
-import psycopg2
-from sql_queries import create_table_queries, drop_table_queries
+from datetime import datetime
+from sql_queries import create_table_queries, drop_table_queries, schema_profile_table_create, schema_profile_insert
+from physical_design import profile_create_queries
+from migrations import migrate
+from db_session import open_session
 
 
 def drop_tables(cur, conn):
@@ -9,23 +13,48 @@ def drop_tables(cur, conn):
         conn.commit()
 
 
-def create_tables(cur, conn):
-    for query in create_table_queries:
+def create_tables(cur, conn, profile='none'):
+    for query in profile_create_queries(create_table_queries, profile):
         cur.execute(query)
         conn.commit()
 
+    # Record the active physical design for later comparison of benchmark runs
+    cur.execute(schema_profile_table_create)
+    cur.execute(schema_profile_insert, (profile, datetime.utcnow()))
+    conn.commit()
+
+
+def create_or_migrate(session, config, backend=None, reset=False):
+    """Migrates the tables on an open session, or drops and recreates them with `reset`."""
+    profile = config.get('SCHEMA', 'PROFILE', fallback='none')
+    backend = backend or config.get('ETL', 'BACKEND', fallback='redshift')
+    with session.connection() as conn:
+        cur = conn.cursor()
+
+        if reset:
+            drop_tables(cur, conn)
+            create_tables(cur, conn, profile)
+        else:
+            migrate(cur, conn, profile, dialect=backend)
+
 
 def main():
+    parser = argparse.ArgumentParser(description="Create or migrate the warehouse tables.")
+    parser.add_argument("--reset", action="store_true",
+                        help="drop and recreate all tables instead of migrating them (deletes all data)")
+    parser.add_argument("--backend", choices=["redshift", "duckdb"], default=None,
+                        help="database to create the tables in, default [ETL] BACKEND")
+    args = parser.parse_args()
+
     config = configparser.ConfigParser()
     config.read('dwh.cfg')
+    backend = args.backend or config.get('ETL', 'BACKEND', fallback='redshift')
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
-    cur = conn.cursor()
-
-    drop_tables(cur, conn)
-    create_tables(cur, conn)
-
-    conn.close()
+    session = open_session(config, backend)
+    try:
+        create_or_migrate(session, config, backend, args.reset)
+    finally:
+        session.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,213 @@
+import argparse
+import configparser
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from ddl import parse_create_table
+from dialect import translate
+import sql_queries
+from sql_queries import (songplay_table_create, user_table_create, song_table_create, artist_table_create,
+                         time_table_create)
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# What the staging tables say each star schema table should hold at least;
+# {time_key} is the staged time key at the configured TIME_GRAIN
+STAGED_COUNTS = {
+    "staging_events": {
+        "plays": "COUNT(CASE WHEN page = 'NextSong' THEN 1 END)",
+        "users": "COUNT(DISTINCT userId)",
+        "time_keys": "COUNT(DISTINCT CASE WHEN ts IS NOT NULL THEN {time_key} END)",
+    },
+    "staging_songs": {
+        "songs": "COUNT(DISTINCT song_id)",
+        "artists": "COUNT(DISTINCT artist_id)",
+    },
+}
+
+# Declarative checks per table: `expected` names the staged count its rows
+# (plus those of `counted_with`) must reach, `unique` the primary key and
+# `references` the columns whose values must exist in another table. NOT NULL
+# columns come from the DDL.
+CHECKS = {
+    "songplays": {"create": songplay_table_create, "expected": "plays", "counted_with": ["songplays_unmatched"],
+                  "references": {"song_id": ("songs", "song_id"), "artist_id": ("artists", "artist_id")}},
+    "users": {"create": user_table_create, "expected": "users", "unique": "user_id"},
+    "songs": {"create": song_table_create, "expected": "songs", "unique": "song_id"},
+    "artists": {"create": artist_table_create, "expected": "artists", "unique": "artist_id"},
+    "time": {"create": time_table_create, "expected": "time_keys", "unique": "start_time"},
+    "songplays_unmatched": {},
+}
+
+
+def not_null_columns(create_query):
+    """The NOT NULL and PRIMARY KEY columns of a CREATE TABLE statement."""
+    return [column["name"] for column in parse_create_table(create_query)[1]
+            if "NOT NULL" in column["attributes"].upper() or "PRIMARY KEY" in column["attributes"].upper()]
+
+
+def compile_table(table, spec):
+    """Compiles all checks of one table into a single aggregate query over it.
+
+    The query returns one row; its column names are the measures (row_count,
+    nulls_<column>, duplicate_keys, missing_<column>, present_<column>).
+    """
+    measures, joins = ["COUNT(*) AS row_count"], []
+    if spec.get("create"):
+        for column in not_null_columns(spec["create"]):
+            measures.append(f"SUM(CASE WHEN t.{column} IS NULL THEN 1 ELSE 0 END) AS nulls_{column}")
+    if spec.get("unique"):
+        measures.append(f"COUNT(t.{spec['unique']}) - COUNT(DISTINCT t.{spec['unique']}) AS duplicate_keys")
+    for i, (column, (other, key)) in enumerate(spec.get("references", {}).items()):
+        # DISTINCT keeps a duplicated key in the other table from multiplying rows
+        joins.append(f"LEFT JOIN (SELECT DISTINCT {key} FROM {other}) r{i} ON t.{column} = r{i}.{key}")
+        measures.append(f"SUM(CASE WHEN t.{column} IS NOT NULL AND r{i}.{key} IS NULL THEN 1 ELSE 0 END) "
+                        f"AS missing_{column}")
+        measures.append(f"COUNT(t.{column}) AS present_{column}")
+    return f"SELECT {', '.join(measures)}\nFROM {table} t\n" + "".join(join + "\n" for join in joins)
+
+
+def compile_queries():
+    """Returns {name: query}: one single-pass query per checked and per staging table."""
+    queries = {table: compile_table(table, spec) for table, spec in CHECKS.items()}
+    for table, counts in STAGED_COUNTS.items():
+        measures = (f"{sql.format(time_key=sql_queries.staged_time_key)} AS {name}" for name, sql in counts.items())
+        queries[table] = f"SELECT {', '.join(measures)}\nFROM {table}\n"
+    return queries
+
+
+class Thresholds:
+    """Fail thresholds of the checks, from the [QUALITY] section of dwh.cfg."""
+
+    def __init__(self, min_row_ratio=1.0, max_null_rate=0.0, max_duplicate_keys=0, min_reference_coverage=1.0):
+        self.min_row_ratio = min_row_ratio
+        self.max_null_rate = max_null_rate
+        self.max_duplicate_keys = max_duplicate_keys
+        self.min_reference_coverage = min_reference_coverage
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(min_row_ratio=config.getfloat('QUALITY', 'MIN_ROW_RATIO', fallback=1.0),
+                   max_null_rate=config.getfloat('QUALITY', 'MAX_NULL_RATE', fallback=0.0),
+                   max_duplicate_keys=config.getint('QUALITY', 'MAX_DUPLICATE_KEYS', fallback=0),
+                   min_reference_coverage=config.getfloat('QUALITY', 'MIN_REFERENCE_COVERAGE', fallback=1.0))
+
+
+def evaluate(measures, thresholds):
+    """Turns the measured values ({query name: {measure: value}}) into check results."""
+    results = []
+
+    def add(table, check, value, threshold, passed):
+        results.append({"table": table, "check": check, "value": value, "threshold": threshold, "passed": passed})
+
+    staged = {name: value for table in STAGED_COUNTS for name, value in measures[table].items()}
+    for table, spec in CHECKS.items():
+        values = measures[table]
+        rows = values["row_count"]
+        if spec.get("expected"):
+            total = rows + sum(measures[other]["row_count"] for other in spec.get("counted_with", []))
+            expected = staged[spec["expected"]]
+            ratio = round(total / expected, 4) if expected else 1.0
+            add(table, "row_count_vs_staging", ratio, thresholds.min_row_ratio, ratio >= thresholds.min_row_ratio)
+        for name, value in values.items():
+            if name.startswith("nulls_"):
+                rate = round(value / rows, 4) if rows else 0.0
+                add(table, f"null_rate {name[len('nulls_'):]}", rate, thresholds.max_null_rate,
+                    rate <= thresholds.max_null_rate)
+            elif name == "duplicate_keys":
+                add(table, f"unique {spec['unique']}", value, thresholds.max_duplicate_keys,
+                    value <= thresholds.max_duplicate_keys)
+            elif name.startswith("missing_"):
+                column = name[len("missing_"):]
+                present = values[f"present_{column}"]
+                coverage = round(1 - value / present, 4) if present else 1.0
+                add(table, f"reference_coverage {column}", coverage, thresholds.min_reference_coverage,
+                    coverage >= thresholds.min_reference_coverage)
+    return results
+
+
+def run_checks(session, thresholds, max_concurrency=4, dialect="redshift"):
+    """Runs the compiled queries concurrently on `session` and returns the check results."""
+    queries = compile_queries()
+
+    # Retried as a whole by call_with_retry below, so the connection is acquired without retries
+    def measure(sql):
+        with session.connection(retry=False) as conn:
+            cur = conn.cursor()
+            cur.execute(translate(sql, dialect))
+            row = cur.fetchone()
+            names = [column[0] for column in cur.description]
+            conn.commit()
+        return {name: int(value or 0) for name, value in zip(names, row)}
+
+    with ThreadPoolExecutor(max_workers=max(1, int(max_concurrency))) as pool:
+        futures = {name: pool.submit(session.call_with_retry, measure, sql) for name, sql in queries.items()}
+        measures = {name: future.result() for name, future in futures.items()}
+
+    results = evaluate(measures, thresholds)
+    for result in results:
+        log = logger.info if result["passed"] else logger.error
+        log(f"{result['table']} {result['check']}: {result['value']} "
+            f"(threshold {result['threshold']}) {'ok' if result['passed'] else 'FAILED'}")
+    return results
+
+
+def write_report(results, directory, run_id):
+    """Writes the check results to `<directory>/quality-<run_id>.json` and returns the path."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"quality-{run_id}.json")
+    with open(path, "w") as f:
+        json.dump({"run_id": run_id, "checked_at": datetime.now(timezone.utc).isoformat(),
+                   "passed": all(result["passed"] for result in results), "checks": results}, f, indent=2)
+    logger.info(f"Data quality report written to {path}")
+    return path
+
+
+def check_quality(session, config, run_id, dialect="redshift"):
+    """Runs the checks after a load when [QUALITY] ENABLED; raises when one fails and FAIL_RUN is set."""
+    if not config.getboolean('QUALITY', 'ENABLED', fallback=False):
+        return None
+    results = run_checks(session, Thresholds.from_config(config),
+                         config.getint('ETL', 'MAX_CONCURRENCY', fallback=4), dialect)
+    report_dir = config.get('ETL', 'REPORT_DIR', fallback='')
+    if report_dir:
+        write_report(results, report_dir, run_id)
+    failed = [f"{result['table']} {result['check']}" for result in results if not result["passed"]]
+    if failed and config.getboolean('QUALITY', 'FAIL_RUN', fallback=True):
+        raise RuntimeError(f"Data quality checks failed: {', '.join(failed)}")
+    return results
+
+
+def check(session, config, dialect="redshift"):
+    """Runs the checks on an open session and writes the report; returns the results."""
+    results = run_checks(session, Thresholds.from_config(config),
+                         config.getint('ETL', 'MAX_CONCURRENCY', fallback=4), dialect)
+    write_report(results, config.get('ETL', 'REPORT_DIR', fallback='reports'),
+                 datetime.utcnow().strftime("%Y%m%dT%H%M%S"))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the data quality checks on the loaded star schema.")
+    parser.add_argument("--backend", choices=["redshift", "duckdb"], default=None)
+    args = parser.parse_args()
+
+    from db_session import open_session
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    session = open_session(config, args.backend)
+    try:
+        results = check(session, config)
+    finally:
+        session.close()
+    if not all(result["passed"] for result in results):
+        raise SystemExit("Data quality checks failed")
+
+
+if __name__ == "__main__":
+    main()
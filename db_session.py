@@ -0,0 +1,215 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.extensions
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Errors after which a fresh connection may succeed; a cancelled statement is not retried
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+NON_TRANSIENT_ERRORS = (psycopg2.extensions.QueryCanceledError,)
+
+
+def connect_params(config, section='CLUSTER'):
+    """Builds psycopg2 connection arguments by key (not position) from a dwh.cfg section."""
+    params = config[section]
+    return {
+        "host": params['HOST'],
+        "dbname": params['DB_NAME'],
+        "user": params['DB_USER'],
+        "password": params['DB_PASSWORD'],
+        "port": params['DB_PORT'],
+        "connect_timeout": config.getint('SESSION', 'CONNECT_TIMEOUT', fallback=10),
+        # TCP keepalives keep idle pooled connections alive behind NAT/load balancers
+        "keepalives": 1,
+        "keepalives_idle": config.getint('SESSION', 'KEEPALIVES_IDLE', fallback=60),
+        "keepalives_interval": 10,
+        "keepalives_count": 5,
+    }
+
+
+def is_transient(error):
+    """Tells whether an error is worth retrying on a new connection."""
+    return isinstance(error, TRANSIENT_ERRORS) and not isinstance(error, NON_TRANSIENT_ERRORS)
+
+
+class PooledConnection:
+    """Wraps a pooled psycopg2 connection; close() hands it back to the pool instead of closing it."""
+
+    def __init__(self, session, conn):
+        self._session = session
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            self._session.release(self._conn)
+            self._conn = None
+
+
+class Session:
+    """Bounded, thread-safe connection pool with retries for transient errors.
+
+    `statement_timeout_ms` sets the server-side statement_timeout of every pooled
+    connection; `execute(..., timeout=...)` additionally cancels a single statement
+    from the client side.
+    """
+
+    def __init__(self, params, max_connections=4, retries=3, backoff=1.0, statement_timeout_ms=None):
+        self.params = params
+        self.retries = retries
+        self.backoff = backoff
+        self.statement_timeout_ms = statement_timeout_ms
+        # Connections are opened on demand and kept idle for reuse; the semaphore
+        # bounds how many exist and makes callers wait instead of failing
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._open = set()
+        # Connections (not their ids, which are recycled) that have the statement_timeout set
+        self._configured = set()
+
+    @classmethod
+    def from_config(cls, config, section='CLUSTER'):
+        """Creates a session for a dwh.cfg section using the [SESSION] settings."""
+        return cls(connect_params(config, section),
+                   max_connections=config.getint('SESSION', 'POOL_SIZE', fallback=4),
+                   retries=config.getint('SESSION', 'RETRIES', fallback=3),
+                   statement_timeout_ms=config.getint('SESSION', 'STATEMENT_TIMEOUT_MS', fallback=0) or None)
+
+    def _discard(self, conn):
+        with self._lock:
+            self._open.discard(conn)
+            self._configured.discard(conn)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _take(self):
+        """An idle connection in a usable state, or a new one."""
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = psycopg2.connect(**self.params)
+                with self._lock:
+                    self._open.add(conn)
+                return conn
+            if not conn.closed and conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                return conn
+            self._discard(conn)
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            conn = self._take()
+            if self.statement_timeout_ms and conn not in self._configured:
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute("SET statement_timeout TO %s;", (int(self.statement_timeout_ms),))
+                    conn.commit()
+                except Exception:
+                    self._discard(conn)
+                    raise
+                with self._lock:
+                    self._configured.add(conn)
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        """Returns a connection to the idle list, discarding it if it is broken."""
+        try:
+            broken = bool(conn.closed)
+            if not broken and conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except Exception:
+            broken = True
+        try:
+            if broken:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    def connect(self, retry=True):
+        """Returns a pooled connection to be closed by the caller.
+
+        Transient connect errors are retried unless `retry` is False, which callers
+        that already run inside call_with_retry pass so the attempts do not multiply.
+        """
+        return PooledConnection(self, self.call_with_retry(self._acquire) if retry else self._acquire())
+
+    @contextmanager
+    def connection(self, retry=True):
+        """Context manager around connect(); the connection goes back to the pool afterwards."""
+        conn = self.connect(retry)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def call_with_retry(self, func, *args, **kwargs):
+        """Calls `func`, retrying transient database errors with exponential backoff and jitter."""
+        for attempt in range(self.retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if not is_transient(e) or attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                delay = delay / 2 + random.uniform(0, delay / 2)
+                logger.warning(f"Transient database error, retry {attempt + 1}/{self.retries} in {delay:.1f}s: {e}")
+                time.sleep(delay)
+
+    def execute(self, query, params=None, timeout=None, fetch=False):
+        """Executes and commits one statement on a pooled connection, with retries.
+
+        `timeout` (seconds) cancels the statement from the client side; `fetch`
+        returns the result rows.
+        """
+        def attempt():
+            with self.connection(retry=False) as conn:
+                timer = threading.Timer(timeout, conn.cancel) if timeout else None
+                # An uncommitted transaction is rolled back when the connection is released
+                try:
+                    if timer:
+                        timer.start()
+                    cur = conn.cursor()
+                    cur.execute(query, params)
+                    rows = cur.fetchall() if fetch else None
+                    conn.commit()
+                    return rows
+                finally:
+                    if timer:
+                        timer.cancel()
+        return self.call_with_retry(attempt)
+
+    def close(self):
+        """Closes all pooled connections."""
+        with self._lock:
+            connections = list(self._open)
+            self._idle.clear()
+        for conn in connections:
+            self._discard(conn)
+
+
+def open_session(config, backend=None):
+    """Opens a session on the [ETL] BACKEND: the Redshift cluster or an in-process DuckDB database."""
+    backend = backend or config.get('ETL', 'BACKEND', fallback='redshift')
+    if backend == 'duckdb':
+        from duckdb_backend import DuckDBSession
+        return DuckDBSession.from_config(config)
+    if backend != 'redshift':
+        raise ValueError(f"Unknown backend: {backend}")
+    return Session.from_config(config)
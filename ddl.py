@@ -0,0 +1,83 @@
+import re
+
+# Column attributes that may follow the type in a CREATE TABLE column line
+_CONSTRAINT_WORDS = ("PRIMARY", "NOT", "NULL", "IDENTITY", "ENCODE", "DISTKEY", "SORTKEY", "DEFAULT", "REFERENCES")
+
+
+def parse_create_table(query):
+    """Parses a CREATE TABLE statement from sql_queries into (table, columns).
+
+    `columns` is a list of dicts with name, type (upper case, e.g. 'VARCHAR(256)')
+    and the remaining column attributes as a string. Only the simple
+    one-column-per-line layout used in sql_queries.py is supported.
+    """
+    match = re.search(r"CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s*\(", query, re.I)
+    if not match:
+        raise ValueError(f"Not a CREATE TABLE statement: {query[:60]!r}")
+    table = match.group(1)
+    body, _ = _split_body(query, match.end())
+
+    columns = []
+    for line in body.split("\n"):
+        line = line.strip().rstrip(",")
+        if not line:
+            continue
+        words = line.split()
+        name, rest = words[0], words[1:]
+        type_words = []
+        while rest and rest[0].upper().split("(")[0] not in _CONSTRAINT_WORDS:
+            type_words.append(rest.pop(0))
+        columns.append({
+            "name": name,
+            "type": " ".join(type_words).upper(),
+            "attributes": " ".join(rest),
+        })
+    return table, columns
+
+
+def _split_body(query, start):
+    """Returns the text inside the column parentheses opened before `start` and the rest."""
+    depth = 1
+    for i in range(start, len(query)):
+        if query[i] == "(":
+            depth += 1
+        elif query[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return query[start:i], query[i + 1:]
+    raise ValueError("Unbalanced parentheses in CREATE TABLE statement")
+
+
+def table_attributes(query):
+    """Returns the table attributes after the column list, e.g. 'DISTSTYLE ALL SORTKEY(user_id)'."""
+    match = re.search(r"CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?\w+\s*\(", query, re.I)
+    _, rest = _split_body(query, match.end())
+    return " ".join(rest.replace(";", " ").split())
+
+
+def column_names(query):
+    """Returns the column names of a CREATE TABLE statement in declaration order."""
+    return [column["name"] for column in parse_create_table(query)[1]]
+
+
+# Base types (see base_type) whose values are parsed as integers or floating point numbers
+INT_TYPES = {"INT", "INTEGER", "BIGINT", "SMALLINT"}
+FLOAT_TYPES = {"FLOAT", "FLOAT8", "FLOAT4", "REAL", "DOUBLE", "DECIMAL", "NUMERIC"}
+
+
+def base_type(column_type):
+    """Strips the length from a column type, e.g. 'VARCHAR(256)' -> 'VARCHAR'."""
+    return column_type.split("(")[0].strip().upper()
+
+
+def render_create_table(table, columns, table_attributes="", if_not_exists=False):
+    """Renders a CREATE TABLE statement in the layout used by sql_queries.py."""
+    lines = []
+    for column in columns:
+        line = f"    {column['name']} {column['type']}"
+        if column.get("attributes"):
+            line += f" {column['attributes']}"
+        lines.append(line)
+    exists = "IF NOT EXISTS " if if_not_exists else ""
+    suffix = f"\n{table_attributes}" if table_attributes else ""
+    return f"\nCREATE TABLE {exists}{table} (\n" + ",\n".join(lines) + f"\n){suffix};\n"
@@ -0,0 +1,114 @@
+import os
+import re
+
+# Physical design attributes have no PostgreSQL or DuckDB equivalent
+_PHYSICAL_DESIGN = [
+    (re.compile(r"\s+ENCODE\s+\w+", re.I), ""),
+    (re.compile(r"\s*\bDISTSTYLE\s+\w+", re.I), ""),
+    (re.compile(r"\s*\b(?:COMPOUND\s+|INTERLEAVED\s+)?(?:DISTKEY|SORTKEY)\s*\([^)]*\)", re.I), ""),
+]
+
+# Redshift-only syntax and its PostgreSQL equivalent, applied in order
+_POSTGRES_REWRITES = [
+    (re.compile(r"\bIDENTITY\s*\(\s*0\s*,\s*1\s*\)", re.I), "GENERATED BY DEFAULT AS IDENTITY (START WITH 0 MINVALUE 0)"),
+    (re.compile(r"\bEXTRACT\s*\(\s*weekday\b", re.I), "EXTRACT(dow"),
+    (re.compile(r"\bGETDATE\s*\(\s*\)", re.I), "now()"),
+] + _PHYSICAL_DESIGN
+
+# Redshift-only syntax and its DuckDB equivalent; IDENTITY and COPY are rewritten in to_duckdb
+_DUCKDB_REWRITES = [
+    # DuckDB's / always divides in floating point; Redshift truncates the epoch milliseconds
+    (re.compile(r"(TIMESTAMP\s+'epoch'\s*\+\s*\(\s*\w+\s*)/(\s*\d+\s*\))", re.I), r"\1//\2"),
+    (re.compile(r"\bEXTRACT\s*\(\s*weekday\b", re.I), "EXTRACT(dow"),
+    (re.compile(r"\bGETDATE\s*\(\s*\)", re.I), "CAST(now() AS TIMESTAMP)"),
+    # Redshift's FLOAT is 8 bytes; DuckDB's is a 4-byte REAL
+    (re.compile(r"\bFLOAT\b", re.I), "DOUBLE"),
+] + _PHYSICAL_DESIGN
+
+_IDENTITY = re.compile(r"(\w+)(\s+\w+\s+)IDENTITY\s*\(\s*(\d+)\s*,\s*(\d+)\s*\)", re.I)
+_CREATE_TABLE = re.compile(r"CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.I)
+# The [S3] values keep their quotes, so the sources may be quoted twice
+_JSON_COPY = re.compile(r"^\s*COPY\s+(\w+)\s+FROM\s+'+([^']+)'+.*?\bFORMAT\s+AS\s+JSON\s+'+([^']+)'+", re.I | re.S)
+
+
+def to_postgres(query):
+    """Translates a statement from sql_queries.py so it runs on plain PostgreSQL."""
+    for pattern, replacement in _POSTGRES_REWRITES:
+        query = pattern.sub(replacement, query)
+    return query
+
+
+def _duckdb_identity(query):
+    """Replaces IDENTITY(seed, step) by a column default drawn from a sequence created first."""
+    table = _CREATE_TABLE.search(query)
+    sequences = []
+
+    def replace(match):
+        name, seed, step = match.group(1), match.group(3), match.group(4)
+        sequence = f"{table.group(1)}_{name}_seq"
+        sequences.append(f"CREATE SEQUENCE IF NOT EXISTS {sequence} INCREMENT {step} MINVALUE {seed} START {seed};")
+        return f"{name}{match.group(2)}DEFAULT nextval('{sequence}')"
+
+    query = _IDENTITY.sub(replace, query)
+    return "\n".join(sequences + [query]) if sequences else query
+
+
+def _duckdb_json_copy(match, paths):
+    """Turns COPY ... FORMAT AS JSON into INSERT ... SELECT over read_json_objects of local files.
+
+    `paths` maps the S3 URIs of the statement (data and jsonpaths file) to local paths.
+    """
+    from ddl import INT_TYPES, FLOAT_TYPES, parse_create_table, base_type
+    from local_ingest import load_jsonpaths
+    from sql_queries import create_table_queries
+
+    table, source, jsonpaths = match.groups()
+    columns = next(parse_create_table(query)[1] for query in create_table_queries
+                   if parse_create_table(query)[0] == table)
+    local = paths.get(source.rstrip("/"))
+    if local is None:
+        raise ValueError(f"No local path for {source}; the DuckDB backend reads local JSON files")
+    if jsonpaths.lower() == "auto":
+        keys = [(column["name"],) for column in columns]
+    else:
+        keys = load_jsonpaths(paths.get(jsonpaths, jsonpaths))
+
+    values = []
+    for column, path in zip(columns, keys):
+        value = "json_extract_string(json, '$" + "".join(f'."{key}"' for key in path) + "')"
+        kind = base_type(column["type"])
+        if kind in INT_TYPES:
+            value = f"CAST(TRUNC(CAST(NULLIF({value}, '') AS DOUBLE)) AS {kind})"
+        elif kind in FLOAT_TYPES:
+            value = f"CAST(NULLIF({value}, '') AS DOUBLE)"
+        values.append(value)
+    files = os.path.join(local, "**", "*.json") if os.path.isdir(local) else local
+    return (f"INSERT INTO {table} ({', '.join(column['name'] for column in columns)})\n"
+            f"SELECT {', '.join(values)}\nFROM read_json_objects('{files}');")
+
+
+def to_duckdb(query, paths=None):
+    """Translates a statement from sql_queries.py so it runs on in-process DuckDB.
+
+    JSON COPYs read the local files `paths` maps their S3 URIs to; other COPY
+    variants (manifest, Parquet) are not supported.
+    """
+    copy = _JSON_COPY.match(query)
+    if copy:
+        return _duckdb_json_copy(copy, paths or {})
+    if query.lstrip().upper().startswith("COPY "):
+        raise ValueError("The DuckDB backend only translates COPY ... FORMAT AS JSON")
+    for pattern, replacement in _DUCKDB_REWRITES:
+        query = pattern.sub(replacement, query)
+    return _duckdb_identity(query)
+
+
+def translate(query, target):
+    """Translates a Redshift statement for the given target ('redshift', 'postgres' or 'duckdb')."""
+    if target == "redshift":
+        return query
+    if target == "postgres":
+        return to_postgres(query)
+    if target == "duckdb":
+        return to_duckdb(query)
+    raise ValueError(f"Unknown SQL dialect: {target}")
@@ -0,0 +1,237 @@
+import argparse
+import configparser
+import os
+import re
+import threading
+from contextlib import contextmanager
+from dialect import to_duckdb
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# psycopg2 placeholders and their DuckDB counterparts
+_NAMED_PARAM = re.compile(r"%\((\w+)\)s")
+_LIMIT = re.compile(r"\bLIMIT\s+\d+", re.I)
+# DuckDB answers INSERT/UPDATE/DELETE with one "Count" row holding the affected rows
+_DML = re.compile(r"^\s*(?:INSERT|UPDATE|DELETE)\b", re.I)
+
+
+def duckdb_params(query):
+    """Rewrites psycopg2's %s and %(name)s placeholders to DuckDB's ? and $name."""
+    return _NAMED_PARAM.sub(r"$\1", query).replace("%s", "?")
+
+
+class DuckDBCursor:
+    """psycopg2-style cursor that translates the Redshift statements of sql_queries.py for DuckDB."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rowcount = -1
+
+    def execute(self, query, params=None):
+        self.connection.begin()
+        statement = to_duckdb(query, self.connection.paths)
+        if params is not None:
+            statement = duckdb_params(statement)
+        result = self.connection.raw.execute(statement, params)
+        self.description = result.description
+        self.rowcount = -1
+        if _DML.match(statement) and [column[0] for column in self.description or []] == ["Count"]:
+            # Like psycopg2, the count of the last statement; there is no result set to fetch
+            self.rowcount = result.fetchone()[0]
+            self.description = None
+        return self
+
+    def executemany(self, query, rows):
+        self.connection.begin()
+        rows = list(rows)
+        self.connection.raw.executemany(duckdb_params(to_duckdb(query, self.connection.paths)), rows)
+        self.rowcount = len(rows)
+
+    def fetchone(self):
+        return self.connection.raw.fetchone()
+
+    def fetchmany(self, size=1):
+        return self.connection.raw.fetchmany(size)
+
+    def fetchall(self):
+        return self.connection.raw.fetchall()
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DuckDBConnection:
+    """psycopg2-style connection on a DuckDB connection: statements run in a transaction until commit."""
+
+    def __init__(self, raw, paths):
+        self.raw = raw
+        self.paths = paths
+        self.closed = False
+        self._in_transaction = False
+
+    def begin(self):
+        if not self._in_transaction:
+            self.raw.execute("BEGIN TRANSACTION;")
+            self._in_transaction = True
+
+    def cursor(self, name=None):
+        # DuckDB results are consumed in chunks already; named cursors need no server-side state
+        return DuckDBCursor(self)
+
+    def commit(self):
+        if self._in_transaction:
+            self._in_transaction = False
+            self.raw.execute("COMMIT;")
+
+    def rollback(self):
+        if self._in_transaction:
+            self._in_transaction = False
+            self.raw.execute("ROLLBACK;")
+
+    def close(self):
+        if not self.closed:
+            self.rollback()
+            self.raw.close()
+            self.closed = True
+
+
+class DuckDBSession:
+    """Session on an in-process DuckDB database with the interface of db_session.Session.
+
+    Every connection is a DuckDB cursor on the same database, so parallel steps
+    run side by side. COPY statements read the [LOCAL] JSON files.
+    """
+
+    params = None
+
+    def __init__(self, database=":memory:", paths=None, threads=None):
+        import duckdb
+
+        if database != ":memory:" and os.path.dirname(database):
+            os.makedirs(os.path.dirname(database), exist_ok=True)
+        self.database = database
+        self.paths = paths or {}
+        self._db = duckdb.connect(database)
+        if threads:
+            self._db.execute(f"SET threads TO {int(threads)};")
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Opens the [DUCKDB] database; the [S3] sources of the COPYs map to the [LOCAL] files."""
+        paths = {}
+        for s3_key, local_key in (('LOG_DATA', 'LOG_DATA'), ('SONG_DATA', 'SONG_DATA'),
+                                  ('LOG_JSONPATH', 'LOG_JSONPATH')):
+            source = config.get('S3', s3_key, fallback='').strip("'\"").rstrip("/")
+            if source:
+                paths[source] = config.get('LOCAL', local_key)
+        return cls(config.get('DUCKDB', 'DATABASE', fallback=':memory:'), paths,
+                   config.getint('DUCKDB', 'THREADS', fallback=0) or None)
+
+    def connect(self, retry=True):
+        with self._lock:
+            return DuckDBConnection(self._db.cursor(), self.paths)
+
+    @contextmanager
+    def connection(self, retry=True):
+        conn = self.connect(retry)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def call_with_retry(self, func, *args, **kwargs):
+        # In-process: no dropped connections to retry
+        return func(*args, **kwargs)
+
+    def execute(self, query, params=None, timeout=None, fetch=False):
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(query, params)
+            rows = cur.fetchall() if fetch else None
+            conn.commit()
+            return rows
+
+    def close(self):
+        self._db.close()
+
+
+def _normalize(rows):
+    return [tuple(round(value, 6) if isinstance(value, float) else value for value in row) for row in rows]
+
+
+def _same_but_ties(duck_rows, pg_rows):
+    """Tells whether two ORDER BY ... LIMIT results differ only in which rows tied at the cut made it.
+
+    The ordered counts in the last column must match, and so must all rows above the cut.
+    """
+    if [row[-1] for row in duck_rows] != [row[-1] for row in pg_rows]:
+        return False
+    cut = duck_rows[-1][-1] if duck_rows else None
+    return (sorted((row for row in duck_rows if row[-1] != cut), key=repr) ==
+            sorted((row for row in pg_rows if row[-1] != cut), key=repr))
+
+
+def compare_backends(duck_cur, pg_cur, queries):
+    """Runs `queries` ({name: sql}) on DuckDB and PostgreSQL; returns the names whose results differ.
+
+    All columns of all rows are compared, in any order. Only for LIMIT queries,
+    where either database may pick a different one of the rows tied at the
+    cut, results that differ just in those rows are treated as equal as well.
+    """
+    from dialect import to_postgres
+
+    different = []
+    for name, sql in queries.items():
+        duck_cur.execute(sql)
+        duck_rows = _normalize(duck_cur.fetchall())
+        pg_cur.execute(to_postgres(sql))
+        pg_rows = _normalize(pg_cur.fetchall())
+        same = sorted(duck_rows, key=repr) == sorted(pg_rows, key=repr)
+        if not same and _LIMIT.search(sql):
+            same = _same_but_ties(duck_rows, pg_rows)
+        logger.info(f"{name}: {len(duck_rows)} rows on DuckDB, {len(pg_rows)} on PostgreSQL, "
+                    f"{'same' if same else 'DIFFERENT'}")
+        if not same:
+            different.append(name)
+    return different
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the DuckDB star schema with the local PostgreSQL one.")
+    parser.parse_args()
+
+    import psycopg2
+    from db_session import connect_params
+    from sql_queries import analytics_queries
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    queries = {f"count {table}": f"SELECT COUNT(*) FROM {table};"
+               for table in ("songplays", "users", "songs", "artists", "time")}
+    queries.update(analytics_queries)
+
+    session = DuckDBSession.from_config(config)
+    pg = psycopg2.connect(**connect_params(config, 'LOCAL_DB'))
+    try:
+        with session.connection() as conn:
+            different = compare_backends(conn.cursor(), pg.cursor(), queries)
+    finally:
+        pg.close()
+        session.close()
+    if different:
+        raise SystemExit(f"Results differ: {', '.join(different)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import argparse
+import configparser
+import math
+import re
+from itertools import islice
+from ddl import parse_create_table, render_create_table, table_attributes, base_type
+from dialect import to_postgres
+from physical_design import get_profile, apply_profile
+from sql_queries import (staging_events_table_create, staging_songs_table_create, songplay_table_create,
+                         user_table_create, song_table_create, artist_table_create, time_table_create)
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+ADVISED_TABLES = [staging_events_table_create, staging_songs_table_create, songplay_table_create,
+                  user_table_create, song_table_create, artist_table_create, time_table_create]
+
+# Where the columns of the star schema come from, for sampling raw JSON
+SOURCES = {
+    "songplays": ("staging_events", {"user_id": "userId", "level": "level", "session_id": "sessionId",
+                                     "location": "location", "user_agent": "userAgent"}),
+    "users": ("staging_events", {"user_id": "userId", "first_name": "firstName", "last_name": "lastName",
+                                 "gender": "gender", "level": "level"}),
+    "songs": ("staging_songs", {"song_id": "song_id", "title": "title", "artist_id": "artist_id",
+                                "year": "year", "duration": "duration"}),
+    "artists": ("staging_songs", {"artist_id": "artist_id", "name": "artist_name",
+                                  "location": "artist_location", "latitude": "artist_latitude",
+                                  "longitude": "artist_longitude"}),
+}
+
+AZ64_TYPES = {"SMALLINT", "INT", "INTEGER", "BIGINT", "DECIMAL", "NUMERIC", "DATE", "TIMESTAMP", "TIMESTAMPTZ"}
+TEXT_TYPES = {"VARCHAR", "CHAR"}
+BYTEDICT_MAX_DISTINCT = 256
+RUNLENGTH_MIN_RUN = 8
+MAX_VARCHAR = 65535
+
+
+def column_stats(values):
+    """Cardinality, null share, average run length and widest value of a sampled column."""
+    count = len(values)
+    present = [value for value in values if value is not None]
+    runs = sum(1 for i, value in enumerate(values) if i == 0 or value != values[i - 1])
+    return {
+        "count": count,
+        "null_share": 1 - len(present) / count if count else 0.0,
+        "distinct": len(set(present)),
+        "avg_run": count / runs if runs else 0.0,
+        "max_bytes": max((len(str(value).encode("utf-8")) for value in present), default=0),
+    }
+
+
+def propose_encoding(column_type, stats, sort_key=False):
+    """Picks a Redshift encoding for a column from its sample statistics; returns (encoding, reason)."""
+    kind = base_type(column_type)
+    if sort_key:
+        return "RAW", "leading sort key column, keeps zone maps effective"
+    if stats["count"] and stats["null_share"] == 1:
+        return "ZSTD", "only NULLs in the sample"
+    if stats["avg_run"] >= RUNLENGTH_MIN_RUN:
+        return "RUNLENGTH", f"average run of {stats['avg_run']:.0f} equal values"
+    if kind in TEXT_TYPES and stats["distinct"] <= BYTEDICT_MAX_DISTINCT:
+        return "BYTEDICT", f"{stats['distinct']} distinct values"
+    if kind in AZ64_TYPES:
+        return "AZ64", "numeric or temporal type"
+    return "ZSTD", "high-cardinality or floating point values"
+
+
+def right_size(column_type, stats, headroom=1.25):
+    """Proposes a VARCHAR length from the widest sampled value plus headroom, rounded to 16 bytes."""
+    if base_type(column_type) != "VARCHAR" or not stats["count"]:
+        return column_type
+    length = max(16, int(math.ceil(stats["max_bytes"] * headroom / 16.0)) * 16)
+    return f"VARCHAR({min(length, MAX_VARCHAR)})"
+
+
+def sort_key_column(attributes):
+    """Returns the leading SORTKEY column of a table attribute string, if any."""
+    match = re.search(r"SORTKEY\s*\(\s*(\w+)", attributes or "", re.I)
+    return match.group(1).lower() if match else None
+
+
+def advise_table(query, samples, sort_key=None, encodings=None):
+    """Returns one advice dict per column of `query`.
+
+    `samples` maps lower-case column names to sampled values; `encodings` can
+    carry encodings already proposed by ANALYZE COMPRESSION.
+    """
+    _, columns = parse_create_table(query)
+    advice = []
+    for column in columns:
+        name = column["name"].lower()
+        values = samples.get(name)
+        is_sort_key = name == sort_key
+        if values is None:
+            stats, proposed_type = None, column["type"]
+            if is_sort_key:
+                encoding, reason = "RAW", "leading sort key column"
+            elif base_type(column["type"]) in AZ64_TYPES:
+                encoding, reason = "AZ64", "not sampled, numeric or temporal type"
+            else:
+                encoding, reason = "ZSTD", "not sampled"
+        else:
+            stats = column_stats(values)
+            encoding, reason = propose_encoding(column["type"], stats, is_sort_key)
+            proposed_type = right_size(column["type"], stats)
+        if encodings and name in encodings and not is_sort_key:
+            encoding, reason = encodings[name], "ANALYZE COMPRESSION"
+        advice.append({"column": column["name"], "type": column["type"], "proposed_type": proposed_type,
+                       "encoding": encoding, "reason": reason, "stats": stats})
+    return advice
+
+
+def render_advice(query, advice, profile_name="none"):
+    """Renders the CREATE TABLE of `query` with the advised types and encodings and the profile's attributes."""
+    table, columns = parse_create_table(apply_profile(query, get_profile(profile_name)))
+    by_name = {item["column"]: item for item in advice}
+    for column in columns:
+        item = by_name[column["name"]]
+        column["type"] = item["proposed_type"]
+        # ENCODE precedes constraints; drop an encoding the profile already set
+        attributes = re.sub(r"ENCODE\s+\w+\s*", "", column["attributes"]).strip()
+        column["attributes"] = f"ENCODE {item['encoding']} {attributes}".strip()
+    return render_create_table(table, columns, table_attributes(apply_profile(query, get_profile(profile_name))))
+
+
+def sample_postgres(cur, query, limit=100000, translate=to_postgres):
+    """Samples up to `limit` rows of a table in PostgreSQL or Redshift as {column: values}."""
+    table, columns = parse_create_table(query)
+    names = [column["name"] for column in columns]
+    cur.execute(translate(f"SELECT {', '.join(names)} FROM {table} LIMIT %s;"), (limit,))
+    rows = cur.fetchall()
+    return {name.lower(): [row[i] for row in rows] for i, name in enumerate(names)}
+
+
+def sample_json(config, limit=100000):
+    """Samples the local [LOCAL] JSON for the staging tables and, via SOURCES, the star schema."""
+    from local_ingest import staging_rows, load_jsonpaths
+
+    staged = {}
+    for table, query, root, jsonpaths in (
+            ("staging_events", staging_events_table_create, config.get('LOCAL', 'LOG_DATA'),
+             load_jsonpaths(config.get('LOCAL', 'LOG_JSONPATH'))),
+            ("staging_songs", staging_songs_table_create, config.get('LOCAL', 'SONG_DATA'), None)):
+        names = [column["name"].lower() for column in parse_create_table(query)[1]]
+        rows = list(islice(staging_rows(root, query, jsonpaths), limit))
+        staged[table] = {name: [row[i] for row in rows] for i, name in enumerate(names)}
+
+    samples = dict(staged)
+    for table, (source, mapping) in SOURCES.items():
+        samples[table] = {column: staged[source][source_column.lower()]
+                          for column, source_column in mapping.items()}
+    return samples
+
+
+def analyze_compression(cur, table, rows=100000):
+    """Runs ANALYZE COMPRESSION on Redshift and returns {column: encoding}."""
+    cur.execute(f"ANALYZE COMPRESSION {table} COMPRESSROWS {int(rows)};")
+    return {row[1].lower(): row[2].upper() for row in cur.fetchall()}
+
+
+def advise(samples, profile_name="none", encodings=None):
+    """Advises every table in ADVISED_TABLES; returns [(query, advice)]."""
+    profile = get_profile(profile_name)
+    result = []
+    for query in ADVISED_TABLES:
+        table, _ = parse_create_table(query)
+        sort_key = sort_key_column(profile.get(table, {}).get("table"))
+        result.append((query, advise_table(query, samples.get(table, {}), sort_key,
+                                           (encodings or {}).get(table))))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Propose column encodings and VARCHAR lengths from sampled data.")
+    parser.add_argument("--source", choices=["redshift", "postgres", "json"], default="json")
+    parser.add_argument("--sample", type=int, default=100000, help="rows sampled per table")
+    parser.add_argument("--output", default=None, help="write the DDL to this file instead of stdout")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+    profile_name = config.get('SCHEMA', 'PROFILE', fallback='none')
+
+    encodings = None
+    if args.source == "json":
+        samples = sample_json(config, args.sample)
+    else:
+        import psycopg2
+        from db_session import connect_params
+
+        conn = psycopg2.connect(**connect_params(config, 'CLUSTER' if args.source == "redshift" else 'LOCAL_DB'))
+        # ANALYZE COMPRESSION cannot run inside a transaction block
+        conn.autocommit = True
+        try:
+            cur = conn.cursor()
+            translate = (lambda query: query) if args.source == "redshift" else to_postgres
+            samples = {parse_create_table(query)[0]: sample_postgres(cur, query, args.sample, translate)
+                       for query in ADVISED_TABLES}
+            if args.source == "redshift":
+                encodings = {table: analyze_compression(cur, table, args.sample) for table in samples}
+        finally:
+            conn.close()
+
+    ddl = []
+    for query, advice in advise(samples, profile_name, encodings):
+        table, _ = parse_create_table(query)
+        for item in advice:
+            logger.info(f"{table}.{item['column']}: {item['type']} -> {item['proposed_type']} "
+                        f"ENCODE {item['encoding']} ({item['reason']})")
+        ddl.append(render_advice(query, advice, profile_name))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write("".join(ddl))
+        logger.info(f"DDL written to {args.output}")
+    else:
+        print("".join(ddl))
+
+
+if __name__ == "__main__":
+    main()
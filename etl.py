@@ -1,16 +1,23 @@
+import argparse
 import configparser
-import psycopg2
-from sql_queries import copy_table_queries, insert_table_queries
+from contextlib import contextmanager
+import sql_queries
+from sql_queries import (user_table_insert, song_table_insert, artist_table_insert, user_history_insert,
+                         song_match_rate_select, aggregate_refresh, full_load_clear_queries)
+from scheduler import Step, run_dag, execute_step
+from db_session import open_session
+from instrumentation import RunRecorder, execute
+from data_quality import check_quality
 from logger import get_logger
 
 # Initialize logger
 logger = get_logger(__name__)
 
-def load_staging_tables(cur, conn):
-    for i, query in enumerate(copy_table_queries):
+def load_staging_tables(cur, conn, recorder=None):
+    for i, query in enumerate(sql_queries.copy_table_queries):
         try:
-            logger.info(f"Loading staging table {i+1}/{len(copy_table_queries)}")
-            cur.execute(query)
+            logger.info(f"Loading staging table {i+1}/{len(sql_queries.copy_table_queries)}")
+            execute(cur, query, recorder)
             conn.commit()
             logger.info(f"Successfully loaded staging table {i+1}")
         except Exception as e:
@@ -18,11 +25,11 @@ def load_staging_tables(cur, conn):
             conn.rollback()
             raise
 
-def insert_tables(cur, conn):
-    for i, query in enumerate(insert_table_queries):
+def insert_tables(cur, conn, recorder=None):
+    for i, query in enumerate(sql_queries.insert_table_queries):
         try:
-            logger.info(f"Inserting into table {i+1}/{len(insert_table_queries)}")
-            cur.execute(query)
+            logger.info(f"Inserting into table {i+1}/{len(sql_queries.insert_table_queries)}")
+            execute(cur, query, recorder)
             conn.commit()
             logger.info(f"Successfully inserted into table {i+1}")
         except Exception as e:
@@ -30,26 +37,203 @@ def insert_tables(cur, conn):
             conn.rollback()
             raise
 
-def main():
-    config = configparser.ConfigParser()
-    config.read('dwh.cfg')
+def clear_tables(cur, conn):
+    """Empties the staging, star schema and aggregate tables before a full load."""
+    for query in full_load_clear_queries:
+        cur.execute(query)
+    conn.commit()
 
-    try:
-        conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+def build_calendar(cur, conn):
+    """Fills the time dimension with time_dimension.py when TIME_BUILDER=calendar."""
+    if sql_queries.TIME_BUILDER != 'calendar':
+        return
+    from time_dimension import build_time_dimension
+    build_time_dimension(cur)
+    conn.commit()
+
+def log_match_rate(cur):
+    """Logs the share of NextSong events that matched a song in song_lookup."""
+    cur.execute(song_match_rate_select)
+    matched, unmatched = cur.fetchone()
+    rate = matched / (matched + unmatched) if matched + unmatched else 1.0
+    logger.info(f"Song match rate: {rate:.1%} ({matched} matched, {unmatched} unmatched plays)")
+    return rate
+
+def etl_steps():
+    """Declares the ETL statements and the staging tables each one reads."""
+    steps = [
+        Step("staging_events", sql_queries.staging_events_copy),
+        Step("staging_songs", sql_queries.staging_songs_copy),
+        Step("song_lookup", sql_queries.song_lookup_insert, depends_on=["staging_songs"]),
+        Step("songplays", sql_queries.songplay_table_insert, depends_on=["staging_events", "song_lookup"]),
+        Step("songplays_unmatched", sql_queries.songplay_unmatched_insert,
+             depends_on=["staging_events", "song_lookup"]),
+        Step("users", user_table_insert, depends_on=["staging_events"]),
+        Step("songs", song_table_insert, depends_on=["staging_songs"]),
+        Step("artists", artist_table_insert, depends_on=["staging_songs"]),
+    ]
+    if sql_queries.time_table_insert in sql_queries.insert_table_queries:
+        steps.append(Step("time", sql_queries.time_table_insert, depends_on=["staging_events"]))
+    steps.append(Step("aggregates", aggregate_refresh, depends_on=["songplays"]))
+    if user_history_insert in sql_queries.insert_table_queries:
+        steps.append(Step("users_history", user_history_insert, depends_on=["staging_events"]))
+    return steps
+
+def run_parallel(session, max_concurrency, recorder=None):
+    """Runs the ETL graph with independent steps on separate pooled connections."""
+    # Only connecting is retried (session.connect): a step whose commit was
+    # acknowledged too late would append its rows twice if it ran again
+    report = run_dag(etl_steps(), session.connect, max_concurrency=max_concurrency,
+                     run_step=recorder.step_runner() if recorder else execute_step)
+    with session.connection() as conn:
+        cur = conn.cursor()
+        build_calendar(cur, conn)
+        log_match_rate(cur)
+    return report
+
+def s3_client(config):
+    import boto3
+    from load_config import load_config
+
+    KEY, SECRET, _ = load_config()
+    return boto3.client('s3', aws_access_key_id=KEY, aws_secret_access_key=SECRET,
+                        region_name=config.get('CLUSTER', 'REGION'))
+
+def run_incremental(session, config, recorder=None):
+    """Loads only the S3 objects that were not loaded by an earlier run."""
+    from incremental import load_incremental
+
+    s3 = s3_client(config)
+    with session.connection() as conn:
+        logger.info("Starting incremental ETL process")
         cur = conn.cursor()
-        
-        logger.info("Starting ETL process")
-        load_staging_tables(cur, conn)
-        insert_tables(cur, conn)
+        load_incremental(cur, conn, s3, config, recorder)
+        log_match_rate(cur)
+        logger.info("ETL process completed successfully")
+
+def run_backfill(session, config, recorder=None):
+    """Loads the pending S3 objects partition by partition, resuming after the last committed one."""
+    from backfill import Backfill
+
+    logger.info("Starting backfill")
+    backfill = Backfill(session.params, config, s3_client(config), recorder,
+                        by=config.get('ETL', 'BACKFILL_PARTITION', fallback='day'))
+    committed = backfill.run(config.getint('ETL', 'MAX_CONCURRENCY', fallback=4))
+    with session.connection() as conn:
+        log_match_rate(conn.cursor())
+    logger.info(f"Backfill completed, {committed} partitions committed")
+
+@contextmanager
+def managed_capacity(config, redshift=True):
+    """Resumes, resizes and pauses the cluster around the run when [CAPACITY] MANAGE is set."""
+    if not redshift or not config.getboolean('CAPACITY', 'MANAGE', fallback=False):
+        yield
+        return
+
+    from capacity import from_config, managed_run
+
+    manager, s3, session = from_config(config)
+    heavy = config.get('ETL', 'LOAD_MODE', fallback='full') == 'backfill'
+    with managed_run(manager, config, s3, heavy=heavy, iam=session.client('iam')):
+        yield
+
+def write_run_report(recorder, config):
+    """Writes the JSON run report and the Prometheus metrics file, if configured."""
+    report_dir = config.get('ETL', 'REPORT_DIR', fallback='')
+    metrics_file = config.get('ETL', 'METRICS_TEXTFILE', fallback='')
+    try:
+        if report_dir:
+            recorder.write_json(report_dir)
+        if metrics_file:
+            recorder.write_prometheus(metrics_file)
+    except OSError as e:
+        logger.error(f"Could not write run report: {e}")
+
+def run(session, config, recorder=None):
+    """Runs the ETL in the configured mode: incremental, parallel or serial."""
+    max_concurrency = config.getint('ETL', 'MAX_CONCURRENCY', fallback=1)
+    load_mode = config.get('ETL', 'LOAD_MODE', fallback='full')
+
+    if load_mode in ('incremental', 'backfill') and config.get('ETL', 'BACKEND', fallback='redshift') == 'duckdb':
+        raise ValueError(f"LOAD_MODE={load_mode} lists S3 objects; the duckdb backend only runs full loads")
+    # Rejects invalid TIME_GRAIN/TIME_BUILDER combinations before any table is cleared or loaded
+    logger.info(f"Time dimension: {sql_queries.TIME_BUILDER} builder, {sql_queries.TIME_GRAIN} grain")
+
+    if load_mode == 'incremental':
+        run_incremental(session, config, recorder)
+        return
+
+    if load_mode == 'backfill':
+        run_backfill(session, config, recorder)
+        return
+
+    with session.connection() as conn:
+        logger.info("Clearing the tables for a full load")
+        clear_tables(conn.cursor(), conn)
+
+    if max_concurrency > 1:
+        logger.info("Starting parallel ETL process")
+        run_parallel(session, max_concurrency, recorder)
         logger.info("ETL process completed successfully")
+        return
+
+    try:
+        with session.connection() as conn:
+            cur = conn.cursor()
+
+            logger.info("Starting ETL process")
+            load_staging_tables(cur, conn, recorder)
+            insert_tables(cur, conn, recorder)
+            build_calendar(cur, conn)
+            log_match_rate(cur)
+            logger.info("ETL process completed successfully")
 
     except Exception as e:
         logger.error(f"ETL process failed: {e}")
         raise
+
+def load(session, config, quality=True):
+    """Runs the ETL and the quality checks on an open session and writes the run report.
+
+    With `quality` False the checks are left to the caller, e.g. a following check stage.
+    """
+    recorder = RunRecorder(redshift=config.get('ETL', 'BACKEND', fallback='redshift') == 'redshift')
+    try:
+        run(session, config, recorder)
+        if quality:
+            check_quality(session, config, recorder.run_id)
+        recorder.finish(success=True)
+    except Exception:
+        recorder.finish(success=False)
+        raise
     finally:
-        if conn:
-            conn.close()
-            logger.info("Database connection closed")
+        if recorder.redshift:
+            try:
+                with session.connection() as conn:
+                    recorder.read_bytes(conn)
+            except Exception as e:
+                logger.warning(f"Could not read statement statistics: {e}")
+        write_run_report(recorder, config)
+    return recorder
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the staging tables and the star schema.")
+    parser.add_argument("--backend", choices=["redshift", "duckdb"], default=None,
+                        help="database to load, default [ETL] BACKEND")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+    if args.backend:
+        config.set('ETL', 'BACKEND', args.backend)
+
+    with managed_capacity(config, config.get('ETL', 'BACKEND', fallback='redshift') == 'redshift'):
+        session = open_session(config)
+        try:
+            load(session, config)
+        finally:
+            session.close()
+            logger.info("Database connections closed")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,207 @@
+import argparse
+import configparser
+import json
+import os
+import re
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from dialect import translate
+from instrumentation import statement_name
+import sql_queries
+from sql_queries import analytics_queries, aggregate_queries
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Redshift steps that move rows between slices: the inner table is broadcast to
+# every node, both sides are redistributed, or a replicated table is sent around
+REDISTRIBUTIONS = {"DS_BCAST_INNER", "DS_DIST_BOTH", "DS_DIST_ALL_INNER", "DS_DIST_ALL_NONE"}
+
+# "->  XN Hash Join DS_BCAST_INNER  (cost=0.00..2.50 rows=10 width=40)"
+_NODE = re.compile(r"^(?P<indent>\s*)(?:->\s+)?(?P<text>.+?)\s+"
+                   r"\(cost=(?P<startup>[\d.]+)\.\.(?P<total>[\d.]+) rows=(?P<rows>\d+) width=(?P<width>\d+)\)")
+_DISTRIBUTION = re.compile(r"\b(DS_\w+|DIST_\w+)\b")
+_RELATION = re.compile(r"\bon (\w+)(?: (\w+))?")
+
+
+def split_statements(query):
+    """Splits a multi-statement string (e.g. aggregate_refresh) into single statements."""
+    return [statement.strip() + ";" for statement in query.split(";") if statement.strip()]
+
+
+def parse_plan(lines):
+    """Parses the text output of EXPLAIN on Redshift or PostgreSQL.
+
+    Returns {"nodes", "warnings"}; every node carries its depth in the plan tree
+    (0 for the root), operation, distribution step (Redshift only), relation,
+    estimated costs and rows and the condition lines printed below it.
+    """
+    nodes, warnings = [], []
+    # Indent widths of the current node's ancestors; a child is indented further than its parent
+    parents = []
+    for line in lines:
+        if line.strip().startswith("-----"):
+            # Redshift appends e.g. "----- Tables missing statistics: songs -----"
+            warnings.append(line.strip(" -"))
+            continue
+        match = _NODE.match(line)
+        if not match:
+            if nodes and line.strip():
+                nodes[-1]["details"].append(line.strip())
+            continue
+        text = re.sub(r"^XN\s+", "", match.group("text").strip())
+        distribution = _DISTRIBUTION.search(text)
+        relation = _RELATION.search(text)
+        operation = _RELATION.sub("", _DISTRIBUTION.sub("", text)).strip()
+        indent = len(match.group("indent"))
+        while parents and parents[-1] >= indent:
+            parents.pop()
+        nodes.append({
+            "depth": len(parents),
+            "operation": " ".join(operation.split()),
+            "distribution": distribution.group(1) if distribution else None,
+            "relation": relation.group(1) if relation else None,
+            "startup_cost": float(match.group("startup")),
+            "total_cost": float(match.group("total")),
+            "rows": int(match.group("rows")),
+            "width": int(match.group("width")),
+            "details": [],
+        })
+        parents.append(indent)
+    return {"nodes": nodes, "warnings": warnings}
+
+
+def summarize(plan):
+    """Adds the root cost and rows and the join strategies of a parsed plan."""
+    nodes = plan["nodes"]
+    joins = [{"operation": node["operation"], "distribution": node["distribution"]}
+             for node in nodes if "Join" in node["operation"] or "Nested Loop" in node["operation"]]
+    plan.update(total_cost=nodes[0]["total_cost"] if nodes else None,
+                rows=nodes[0]["rows"] if nodes else None,
+                joins=joins,
+                redistributions=[node["distribution"] for node in nodes if node["distribution"] in REDISTRIBUTIONS])
+    return plan
+
+
+def explain(cur, query, dialect="redshift"):
+    """Runs EXPLAIN for one statement and returns its summarized plan."""
+    cur.execute("EXPLAIN " + translate(query, dialect))
+    return summarize(parse_plan([row[0] for row in cur.fetchall()]))
+
+
+def explained_statements():
+    """Returns (name, statement) for every insert statement and analytics query, with unique names."""
+    statements = [(statement_name(statement), statement)
+                  for query in sql_queries.insert_table_queries for statement in split_statements(query)]
+    statements += [(f"query {name}", query) for name, query in analytics_queries.items()]
+    statements += [(f"aggregate {name}", query) for name, query in aggregate_queries.items()]
+
+    seen = Counter()
+    named = []
+    for name, statement in statements:
+        seen[name] += 1
+        named.append((name if seen[name] == 1 else f"{name} #{seen[name]}", statement))
+    return named
+
+
+def capture(cur, conn, dialect="redshift"):
+    """EXPLAINs all statements; a statement that cannot be explained is recorded with its error."""
+    plans = {}
+    for name, statement in explained_statements():
+        try:
+            plans[name] = explain(cur, statement, dialect)
+            conn.rollback()
+        except Exception as e:
+            conn.rollback()
+            logger.warning(f"Could not explain {name}: {e}")
+            plans[name] = {"error": str(e).strip()}
+            continue
+        plan = plans[name]
+        logger.info(f"{name}: cost={plan['total_cost']}, rows={plan['rows']}, "
+                    f"joins={[' '.join(filter(None, join.values())) for join in plan['joins']]}")
+    return plans
+
+
+def compare(plans, baseline, tolerance):
+    """Returns {statement: [reasons]} for plans that got worse than the baseline.
+
+    A plan regresses when it gains a redistribution step or a join strategy the
+    baseline did not use, or when its estimated cost grows by more than
+    `tolerance` (e.g. 0.5 = 50%).
+    """
+    regressions = {}
+    for name, plan in plans.items():
+        before = baseline.get("plans", {}).get(name)
+        if not before or "error" in before or "error" in plan:
+            continue
+        reasons = []
+        for step in (Counter(plan["redistributions"]) - Counter(before["redistributions"])):
+            reasons.append(f"new {step} step")
+        before_joins = {join["operation"] for join in before["joins"]}
+        for operation in sorted({join["operation"] for join in plan["joins"]} - before_joins):
+            reasons.append(f"new {operation}")
+        if before["total_cost"] and plan["total_cost"] is not None:
+            change = plan["total_cost"] / before["total_cost"] - 1
+            if change > tolerance:
+                reasons.append(f"cost {before['total_cost']:.2f} -> {plan['total_cost']:.2f} ({change:+.0%})")
+        if reasons:
+            logger.warning(f"{name}: {'; '.join(reasons)}")
+            regressions[name] = reasons
+    return regressions
+
+
+def write_plans(result, directory):
+    """Writes the captured plans to `<directory>/plans-<run_id>.json` and returns the path."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"plans-{result['run_id']}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    logger.info(f"Plans written to {path}")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture EXPLAIN plans and compare them to a baseline.")
+    parser.add_argument("--target", choices=["redshift", "postgres"], default="redshift")
+    parser.add_argument("--baseline-dir", default="benchmarks")
+    parser.add_argument("--save-baseline", action="store_true", help="store these plans as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed estimated cost increase")
+    args = parser.parse_args()
+
+    import psycopg2
+    from db_session import connect_params
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+    profile = config.get('SCHEMA', 'PROFILE', fallback='none')
+
+    conn = psycopg2.connect(**connect_params(config, 'CLUSTER' if args.target == "redshift" else 'LOCAL_DB'))
+    try:
+        plans = capture(conn.cursor(), conn, args.target)
+    finally:
+        conn.close()
+
+    result = {"run_id": datetime.utcnow().strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:8],
+              "captured_at": datetime.now(timezone.utc).isoformat(), "target": args.target,
+              "profile": profile, "plans": plans}
+    write_plans(result, config.get('ETL', 'REPORT_DIR', fallback='reports'))
+    baseline_path = os.path.join(args.baseline_dir, f"plans-{args.target}-{profile}.json")
+
+    regressions = {}
+    if os.path.exists(baseline_path) and not args.save_baseline:
+        with open(baseline_path) as f:
+            regressions = compare(plans, json.load(f), args.tolerance)
+    if args.save_baseline or not os.path.exists(baseline_path):
+        os.makedirs(args.baseline_dir, exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump(result, f, indent=2)
+        logger.info(f"Baseline saved to {baseline_path}")
+
+    if regressions:
+        raise SystemExit(f"Plans worse than baseline: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import argparse
+import configparser
+import os
+import shutil
+import time
+import pyarrow as pa
+from ddl import parse_create_table
+from dialect import translate
+from parquet_staging import arrow_schema, write_batches
+from sql_queries import (songplay_table_create, user_table_create, song_table_create, artist_table_create,
+                         time_table_create, table_unload, unload_count_select)
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Exported tables and their partition columns; None partitions by a column the table has
+EXPORTS = {
+    "songplays": (songplay_table_create, {"year": "CAST(EXTRACT(year FROM start_time) AS INT)",
+                                          "month": "CAST(EXTRACT(month FROM start_time) AS INT)"}),
+    "users": (user_table_create, {}),
+    "songs": (song_table_create, {}),
+    "artists": (artist_table_create, {}),
+    "time": (time_table_create, {"year": None, "month": None}),
+}
+
+
+def export_select(table):
+    """Selects the columns of an exported table in DDL order, plus its derived partition columns."""
+    create_query, partitions = EXPORTS[table]
+    names = [column["name"] for column in parse_create_table(create_query)[1]]
+    names += [f"{expression} AS {name}" for name, expression in partitions.items() if expression]
+    return f"SELECT {', '.join(names)} FROM {table}"
+
+
+def export_schema(table):
+    """The Arrow schema of the exported rows; derived partition columns are integers."""
+    create_query, partitions = EXPORTS[table]
+    schema = arrow_schema(create_query)
+    for name, expression in partitions.items():
+        if expression:
+            schema = schema.append(pa.field(name, pa.int32()))
+    return schema
+
+
+def unload(cur, table, target, role):
+    """Unloads a table from Redshift to Parquet below the S3 prefix `target`; returns the row count."""
+    partitions = list(EXPORTS[table][1])
+    start = time.perf_counter()
+    cur.execute(table_unload.format(select=export_select(table).replace("'", "''"),
+                                    target=f"{target.rstrip('/')}/{table}/", role=role,
+                                    partition=f"PARTITION BY ({', '.join(partitions)})" if partitions else ""))
+    cur.execute(unload_count_select)
+    rows = cur.fetchone()[0]
+    seconds = time.perf_counter() - start
+    logger.info(f"Unloaded {rows} rows of {table} in {seconds:.2f}s ({rows / max(seconds, 1e-9):.0f} rows/s)")
+    return rows
+
+
+def stream_rows(conn, query, batch_size=100000):
+    """Yields the rows of `query` through a server-side cursor, `batch_size` rows per round trip."""
+    with conn.cursor(name="export_cursor") as cur:
+        cur.itersize = batch_size
+        cur.execute(query)
+        while True:
+            batch = cur.fetchmany(batch_size)
+            if not batch:
+                break
+            yield from batch
+
+
+def export_local(conn, table, target, batch_size=100000, dialect="postgres"):
+    """Streams a table into partitioned Parquet below `target/<table>`; returns the row count.
+
+    Client memory is bounded by `batch_size` rows, whatever the size of the table.
+    """
+    directory = os.path.join(target, table)
+    # Like UNLOAD ... ALLOWOVERWRITE, an export replaces the previous one
+    shutil.rmtree(directory, ignore_errors=True)
+    start = time.perf_counter()
+    rows = write_batches(stream_rows(conn, translate(export_select(table), dialect), batch_size),
+                         export_schema(table), directory, batch_size=batch_size,
+                         partition_cols=list(EXPORTS[table][1]) or None)
+    conn.commit()
+    seconds = time.perf_counter() - start
+    logger.info(f"Exported {rows} rows of {table} to {directory} in {seconds:.2f}s "
+                f"({rows / max(seconds, 1e-9):.0f} rows/s)")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the star schema tables to partitioned Parquet.")
+    parser.add_argument("--target", choices=["redshift", "postgres"], default="redshift",
+                        help="UNLOAD from the cluster or stream from the local database")
+    parser.add_argument("--tables", nargs="+", choices=list(EXPORTS), default=list(EXPORTS))
+    args = parser.parse_args()
+
+    from db_session import Session
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    session = Session.from_config(config, 'CLUSTER' if args.target == "redshift" else 'LOCAL_DB')
+    try:
+        with session.connection() as conn:
+            for table in args.tables:
+                if args.target == "redshift":
+                    unload(conn.cursor(), table, config.get('EXPORT', 'S3_PREFIX'), config.get('IAM_ROLE', 'ARN'))
+                    conn.commit()
+                else:
+                    export_local(conn, table, config.get('EXPORT', 'LOCAL_DIR', fallback='data/export'),
+                                 config.getint('EXPORT', 'BATCH_SIZE', fallback=100000))
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
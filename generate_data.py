@@ -0,0 +1,172 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import string
+from datetime import datetime, timedelta, timezone
+from ddl import column_names
+from sql_queries import staging_events_table_create
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Size of the udacity sample at scale factor 1
+BASE_SONGS = 15000
+BASE_USERS = 100
+BASE_EVENTS = 8000
+DAYS = 30
+
+FIRST_NAMES = ["Lily", "Kevin", "Jacob", "Chloe", "Tegan", "Aleena", "Mohammad", "Jayden", "Kate", "Ava",
+               "Ryan", "Sara", "Noah", "Emma", "Liam", "Mia", "Lucas", "Zoe", "Ethan", "Isabella"]
+LAST_NAMES = ["Koch", "Arellano", "Garrison", "Cuevas", "Levine", "Kirby", "Rodriguez", "Hahn", "Harrell",
+              "Robinson", "Smith", "Cruz", "Lynch", "Hoffman", "Jones", "Ortiz", "Kim", "Nguyen", "Weber", "Fox"]
+LOCATIONS = ["San Francisco-Oakland-Hayward, CA", "Chicago-Naperville-Elgin, IL-IN-WI",
+             "New York-Newark-Jersey City, NY-NJ-PA", "Atlanta-Sandy Springs-Roswell, GA",
+             "Lansing-East Lansing, MI", "Portland-South Portland, ME", "Tampa-St. Petersburg-Clearwater, FL"]
+USER_AGENTS = [
+    "\"Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.143 Safari/537.36\"",
+    "\"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.78.2 (KHTML, like Gecko) Version/7.0.6 Safari/537.78.2\"",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:31.0) Gecko/20100101 Firefox/31.0",
+    "Mozilla/5.0 (Windows NT 6.3; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0",
+]
+# Share of pages in the sample log, NextSong dominates
+PAGES = [("NextSong", 0.82), ("Home", 0.07), ("Logout", 0.03), ("Login", 0.03), ("Settings", 0.02),
+         ("Upgrade", 0.01), ("Help", 0.01), ("About", 0.01)]
+WORDS = ["love", "night", "heart", "fire", "blue", "dream", "rain", "city", "gold", "wild", "home", "light",
+         "river", "stone", "ghost", "summer", "road", "shadow", "echo", "dance"]
+
+
+def zipf_weights(n, exponent):
+    """Cumulative Zipf weights for n ranks: a few items get most of the traffic."""
+    return list(itertools.accumulate(1.0 / (rank ** exponent) for rank in range(1, n + 1)))
+
+
+def _id(rng, prefix, length=16):
+    return prefix + "".join(rng.choices(string.ascii_uppercase + string.digits, k=length))
+
+
+def make_catalog(rng, num_songs):
+    """Creates songs and their artists, roughly 1.5 songs per artist."""
+    artists = []
+    for _ in range(max(1, int(num_songs / 1.5))):
+        artists.append({
+            "artist_id": _id(rng, "AR"),
+            "artist_name": " ".join(rng.choice(WORDS).title() for _ in range(rng.randint(1, 3))),
+            "artist_location": rng.choice(LOCATIONS + [""]),
+            "artist_latitude": round(rng.uniform(25, 48), 5) if rng.random() < 0.4 else None,
+            "artist_longitude": round(rng.uniform(-122, -71), 5) if rng.random() < 0.4 else None,
+        })
+    songs = []
+    for _ in range(num_songs):
+        artist = rng.choice(artists)
+        songs.append(dict(artist, **{
+            "num_songs": 1,
+            "song_id": _id(rng, "SO"),
+            "title": " ".join(rng.choice(WORDS).title() for _ in range(rng.randint(1, 4))),
+            "duration": round(rng.uniform(90, 420), 5),
+            "year": rng.choice([0] + list(range(1960, 2019))),
+        }))
+    return songs
+
+
+def make_users(rng, num_users):
+    """Creates users with a starting level; some of them upgrade during the month."""
+    return [{
+        "userId": str(user_id),
+        "firstName": rng.choice(FIRST_NAMES),
+        "lastName": rng.choice(LAST_NAMES),
+        "gender": rng.choice("MF"),
+        "level": "paid" if rng.random() < 0.3 else "free",
+        "location": rng.choice(LOCATIONS),
+        "userAgent": rng.choice(USER_AGENTS),
+        "registration": rng.randint(1_530_000_000_000, 1_541_000_000_000),
+    } for user_id in range(1, num_users + 1)]
+
+
+def write_songs(songs, root):
+    """Writes one JSON file per song in the A/B/C/TRABC... layout of the song dataset."""
+    for song in songs:
+        track = "TR" + song["song_id"][2:]
+        directory = os.path.join(root, track[2], track[3], track[4])
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{track}.json"), "w") as f:
+            json.dump(song, f)
+
+
+def write_events(rng, songs, users, num_events, root, start=datetime(2018, 11, 1, tzinfo=timezone.utc),
+                 unmatched_share=0.05):
+    """Writes one newline-delimited JSON file per day in the YYYY/MM/YYYY-MM-DD-events.json layout."""
+    song_weights = zipf_weights(len(songs), 1.1)
+    user_weights = zipf_weights(len(users), 0.8)
+    pages, page_weights = zip(*PAGES)
+    sessions = itertools.count(1)
+    per_day = max(1, num_events // DAYS)
+    written = 0
+
+    for day in range(DAYS):
+        moment = start + timedelta(days=day)
+        directory = os.path.join(root, f"{moment:%Y}", f"{moment:%m}")
+        os.makedirs(directory, exist_ok=True)
+        timestamps = sorted(rng.randint(0, 86_399_999) for _ in range(per_day))
+        session_of = {}
+        with open(os.path.join(directory, f"{moment:%Y-%m-%d}-events.json"), "w") as f:
+            for item, offset in enumerate(timestamps):
+                user = rng.choices(users, cum_weights=user_weights)[0]
+                if user["level"] == "free" and rng.random() < 0.001:
+                    user["level"] = "paid"
+                session_id = session_of.setdefault(user["userId"], next(sessions))
+                page = rng.choices(pages, weights=page_weights)[0]
+                event = {"artist": None, "auth": "Logged In", "firstName": user["firstName"],
+                         "gender": user["gender"], "itemInSession": item, "lastName": user["lastName"],
+                         "length": None, "level": user["level"], "location": user["location"],
+                         "method": "PUT" if page == "NextSong" else "GET", "page": page,
+                         "registration": user["registration"], "sessionId": session_id, "song": None,
+                         "status": 200, "ts": int(moment.timestamp() * 1000) + offset,
+                         "userAgent": user["userAgent"], "userId": user["userId"]}
+                if page == "NextSong":
+                    song = rng.choices(songs, cum_weights=song_weights)[0]
+                    artist = song["artist_name"]
+                    if rng.random() < unmatched_share:
+                        # Plays of songs missing from the catalog
+                        artist += " Live"
+                    event.update(artist=artist, song=song["title"], length=song["duration"])
+                elif page == "Login":
+                    event.update(auth="Logged Out", firstName=None, gender=None, lastName=None,
+                                 location=None, registration=None, userAgent=None, userId="")
+                f.write(json.dumps(event) + "\n")
+                written += 1
+    return written
+
+
+def write_jsonpaths(path):
+    """Writes a log_json_path.json mapping the event keys onto the staging_events columns."""
+    with open(path, "w") as f:
+        json.dump({"jsonpaths": [f"$['{name}']" for name in column_names(staging_events_table_create)]}, f, indent=1)
+
+
+def generate(output, scale=1, seed=42):
+    """Generates log_data, song_data and log_json_path.json below `output` at a scale factor."""
+    rng = random.Random(seed)
+    songs = make_catalog(rng, int(BASE_SONGS * scale))
+    users = make_users(rng, max(1, int(BASE_USERS * scale)))
+    os.makedirs(output, exist_ok=True)
+    write_songs(songs, os.path.join(output, "song_data"))
+    events = write_events(rng, songs, users, int(BASE_EVENTS * scale), os.path.join(output, "log_data"))
+    write_jsonpaths(os.path.join(output, "log_json_path.json"))
+    logger.info(f"Generated {len(songs)} songs, {len(users)} users and {events} events in {output}")
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic Sparkify log and song data.")
+    parser.add_argument("--scale", type=float, default=1, help="scale factor relative to the udacity sample")
+    parser.add_argument("--output", default=None, help="target directory, default data/synthetic/<scale>x")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    generate(args.output or os.path.join("data", "synthetic", f"{args.scale:g}x"), args.scale, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import uuid
+from datetime import datetime, timedelta
+from psycopg2.extras import execute_values
+import sql_queries
+from sql_queries import (staging_events_clear, staging_songs_clear, staging_events_manifest_copy,
+                         staging_songs_manifest_copy, pipeline_state_select, pipeline_state_upsert,
+                         pipeline_loaded_files_select, pipeline_loaded_files_insert)
+from manifest import list_json_keys, split_s3_uri, write_manifest
+from instrumentation import execute
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+WATERMARK = "last_ts"
+
+
+def get_watermark(cur):
+    """Returns the highest event ts loaded so far, or None before the first run."""
+    cur.execute(pipeline_state_select, (WATERMARK,))
+    row = cur.fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+
+def log_start_after(log_data, watermark, lookback_days):
+    """Returns the key before the log objects of the watermark's day minus `lookback_days`.
+
+    Assumes the year/month/yyyy-mm-dd key layout of the log data, e.g.
+    log_data/2018/11/2018-11-01-events.json; earlier days are then not listed again.
+    """
+    _, prefix = split_s3_uri(log_data)
+    day = datetime.utcfromtimestamp(watermark / 1000) - timedelta(days=lookback_days)
+    return f"{prefix.rstrip('/')}/{day:%Y/%m/%Y-%m-%d}" if prefix else f"{day:%Y/%m/%Y-%m-%d}"
+
+
+def new_keys(cur, s3, log_data, song_data, log_start=None):
+    """Returns the log and song objects that are not yet in pipeline_loaded_files.
+
+    With `log_start` (see log_start_after) only the log keys after it are listed.
+    """
+    cur.execute(pipeline_loaded_files_select)
+    loaded = {row[0] for row in cur.fetchall()}
+    log_keys = [key for key in list_json_keys(s3, log_data, start_after=log_start) if key not in loaded]
+    song_keys = [key for key in list_json_keys(s3, song_data) if key not in loaded]
+    return log_keys, song_keys
+
+
+def load_incremental(cur, conn, s3, config, recorder=None):
+    """Stages the new S3 objects and merges them into the star schema in one transaction.
+
+    The staged keys and the new watermark are committed together with the merged
+    rows, so a run that fails part-way leaves no trace and can simply be repeated.
+    """
+    log_data, song_data = config.get('S3', 'LOG_DATA'), config.get('S3', 'SONG_DATA')
+    manifest_prefix = config.get('S3', 'MANIFEST_PREFIX').strip("'\"").rstrip("/")
+    role, region = config.get('IAM_ROLE', 'ARN'), config.get('CLUSTER', 'REGION')
+    jsonpath = config.get('S3', 'LOG_JSONPATH').strip("'\"")
+
+    # The watermark narrows the listing of date-partitioned logs to the recent days
+    lookback = config.get('ETL', 'INCREMENTAL_LOOKBACK_DAYS', fallback='')
+    try:
+        watermark = get_watermark(cur)
+        log_start = log_start_after(log_data, watermark, int(lookback)) if lookback and watermark else None
+        log_keys, song_keys = new_keys(cur, s3, log_data, song_data, log_start)
+        logger.info(f"Found {len(log_keys)} new log files and {len(song_keys)} new song files")
+        if not log_keys and not song_keys:
+            conn.rollback()
+            return 0
+
+        run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:8]
+        cur.execute(staging_events_clear)
+        cur.execute(staging_songs_clear)
+
+        if log_keys:
+            manifest = write_manifest(s3, f"{manifest_prefix}/incremental/{run_id}-events.manifest", log_keys)
+            logger.info(f"Staging new log files via {manifest}")
+            execute(cur, staging_events_manifest_copy.format(manifest=manifest, role=role, jsonpath=jsonpath,
+                                                             region=region, compression=""), recorder)
+        if song_keys:
+            manifest = write_manifest(s3, f"{manifest_prefix}/incremental/{run_id}-songs.manifest", song_keys)
+            logger.info(f"Staging new song files via {manifest}")
+            execute(cur, staging_songs_manifest_copy.format(manifest=manifest, role=role, region=region,
+                                                            compression=""), recorder)
+
+        for i, query in enumerate(sql_queries.merge_table_queries):
+            logger.info(f"Merging into table {i+1}/{len(sql_queries.merge_table_queries)}")
+            execute(cur, query, recorder)
+        if sql_queries.TIME_BUILDER == 'calendar':
+            from time_dimension import build_time_dimension
+            build_time_dimension(cur)
+
+        now = datetime.utcnow()
+        execute_values(cur, pipeline_loaded_files_insert, [(key, now) for key in log_keys + song_keys])
+
+        cur.execute("SELECT MAX(ts) FROM staging_events;")
+        staged_max = cur.fetchone()[0]
+        if staged_max is not None and (watermark is None or staged_max > watermark):
+            cur.execute(pipeline_state_upsert, {"name": WATERMARK, "value": str(staged_max), "updated_at": now})
+            watermark = staged_max
+
+        conn.commit()
+        logger.info(f"Incremental load committed, watermark ts={watermark}")
+        return len(log_keys) + len(song_keys)
+    except Exception as e:
+        logger.error(f"Incremental load failed, rolling back: {e}")
+        conn.rollback()
+        raise
@@ -0,0 +1,230 @@
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Redshift system tables; unavailable on PostgreSQL, where only timing and rows are recorded
+_LAST_QUERY_ID = "SELECT pg_last_query_id();"
+_LAST_COPY_ID = "SELECT pg_last_copy_id();"
+_LAST_COPY_COUNT = "SELECT pg_last_copy_count();"
+_SCANNED_BYTES = "SELECT query, SUM(bytes) FROM stl_scan WHERE query IN %s GROUP BY query;"
+_LOADED_BYTES = "SELECT query, SUM(transfer_size) FROM stl_s3client WHERE query IN %s GROUP BY query;"
+_LOAD_ERRORS = ("""
+SELECT query, TRIM(filename), line_number, TRIM(colname), err_code, TRIM(err_reason), TRIM(raw_line)
+FROM stl_load_errors
+WHERE session = pg_backend_pid()
+ORDER BY starttime DESC
+LIMIT %s;
+""")
+_LOAD_ERROR_DETAIL = ("""
+SELECT query_id, TRIM(file_name), line_number, TRIM(column_name), error_code, TRIM(error_message), TRIM(log_line_text)
+FROM sys_load_error_detail
+WHERE session_id = pg_backend_pid()
+ORDER BY start_time DESC
+LIMIT %s;
+""")
+_LOAD_ERROR_FIELDS = ["query_id", "file", "line_number", "column", "error_code", "reason", "raw_line"]
+
+
+def statement_name(query):
+    """Derives a short name like 'copy staging_events' or 'insert songplays' from a statement."""
+    match = re.search(r"\b(COPY|INSERT\s+INTO|DELETE\s+FROM|UPDATE|CREATE\s+TABLE|DROP\s+TABLE(?:\s+IF\s+EXISTS)?)\s+(\w+)",
+                      query, re.I)
+    if not match:
+        return " ".join(query.split())[:40]
+    return f"{match.group(1).split()[0].lower()} {match.group(2)}"
+
+
+def _fetch_value(cur, query, params=None):
+    cur.execute(query, params)
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+class RunRecorder:
+    """Collects per-statement timings, row counts, bytes and query IDs of one ETL run."""
+
+    def __init__(self, run_id=None, redshift=True, max_load_errors=20):
+        self.run_id = run_id or datetime.utcnow().strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:8]
+        self.redshift = redshift
+        self.max_load_errors = max_load_errors
+        self.started_at = datetime.now(timezone.utc)
+        self.statements = []
+        self.success = None
+        self.seconds = None
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        # (record, is_copy) of the statements whose bytes `read_bytes` still has to look up
+        self._pending_bytes = []
+
+    def execute(self, cur, query, name=None, params=None):
+        """Executes `query` on `cur` and records its metrics; load errors are captured on failure."""
+        name = name or statement_name(query)
+        is_copy = query.lstrip().upper().startswith("COPY")
+        record = {"name": name, "started_at": datetime.utcnow().isoformat(), "status": "ok"}
+        start = time.perf_counter()
+        try:
+            cur.execute(query, params)
+        except Exception as e:
+            record.update(status="failed", seconds=round(time.perf_counter() - start, 3), error=str(e).strip())
+            if is_copy and self.redshift:
+                record["load_errors"] = self.load_errors(cur.connection)
+            self._add(record)
+            raise
+        record["seconds"] = round(time.perf_counter() - start, 3)
+        record["rows"] = cur.rowcount if cur.rowcount is not None and cur.rowcount >= 0 else None
+        if self.redshift:
+            record.update(self._redshift_stats(cur, is_copy))
+            with self._lock:
+                self._pending_bytes.append((record, is_copy))
+        self._add(record)
+        logger.info(f"{name}: {record['seconds']:.2f}s, rows={record['rows']}, query_id={record.get('query_id')}")
+        return record
+
+    def _redshift_stats(self, cur, is_copy):
+        """Looks up query ID and rows of the last statement with the session's leader node functions.
+
+        These run inside the caller's transaction, so the STL tables are left to `read_bytes`.
+        """
+        if is_copy:
+            return {"query_id": _fetch_value(cur, _LAST_COPY_ID), "rows": _fetch_value(cur, _LAST_COPY_COUNT)}
+        return {"query_id": _fetch_value(cur, _LAST_QUERY_ID)}
+
+    def read_bytes(self, conn):
+        """Fills in the bytes loaded or scanned per statement from the STL tables.
+
+        Runs on its own connection once the load committed; a failing lookup is rolled
+        back and only costs the byte counts.
+        """
+        with self._lock:
+            pending, self._pending_bytes = self._pending_bytes, []
+        cur = conn.cursor()
+        for copy, query in ((True, _LOADED_BYTES), (False, _SCANNED_BYTES)):
+            records = [record for record, is_copy in pending
+                       if is_copy is copy and record.get("query_id") not in (None, -1)]
+            if not records:
+                continue
+            try:
+                cur.execute(query, (tuple(record["query_id"] for record in records),))
+                scanned = {query_id: int(value) for query_id, value in cur.fetchall() if value is not None}
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.warning(f"Could not read statement statistics: {e}")
+                continue
+            for record in records:
+                record["bytes"] = scanned.get(record["query_id"])
+
+    def load_errors(self, conn):
+        """Reads the most recent load errors of this session, after rolling back the failed COPY."""
+        conn.rollback()
+        cur = conn.cursor()
+        for query in (_LOAD_ERRORS, _LOAD_ERROR_DETAIL):
+            try:
+                cur.execute(query, (self.max_load_errors,))
+                rows = cur.fetchall()
+                if rows:
+                    for row in rows:
+                        logger.error(f"Load error: {dict(zip(_LOAD_ERROR_FIELDS, row))}")
+                    return [dict(zip(_LOAD_ERROR_FIELDS, [str(v) if v is not None else None for v in row]))
+                            for row in rows]
+            except Exception as e:
+                conn.rollback()
+                logger.warning(f"Could not read load errors: {e}")
+        return []
+
+    def step_runner(self):
+        """Returns a scheduler `run_step` that executes each step through this recorder."""
+        def run_step(step, connect):
+            conn = connect()
+            try:
+                cur = conn.cursor()
+                start = time.perf_counter()
+                self.execute(cur, step.query, name=step.name)
+                conn.commit()
+                return start, time.perf_counter()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+        return run_step
+
+    def _add(self, record):
+        with self._lock:
+            self.statements.append(record)
+
+    def finish(self, success):
+        """Marks the run as finished; called once all statements ran or one failed."""
+        self.success = success
+        self.seconds = round(time.perf_counter() - self._start, 3)
+
+    def report(self):
+        """Returns the run report as a JSON-serializable dict."""
+        return {
+            "run_id": self.run_id,
+            "started_at": self.started_at.isoformat(),
+            "seconds": self.seconds if self.seconds is not None else round(time.perf_counter() - self._start, 3),
+            "success": self.success,
+            "statements": self.statements,
+        }
+
+    def write_json(self, directory):
+        """Writes the report to `<directory>/run-<run_id>.json` and returns the path."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"run-{self.run_id}.json")
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2, default=str)
+        logger.info(f"Run report written to {path}")
+        return path
+
+    def write_prometheus(self, path):
+        """Writes the run metrics in the Prometheus textfile collector format."""
+        report = self.report()
+        lines = [
+            "# HELP sparkify_etl_run_seconds Wall time of the last ETL run.",
+            "# TYPE sparkify_etl_run_seconds gauge",
+            f"sparkify_etl_run_seconds {report['seconds']}",
+            "# HELP sparkify_etl_run_success Whether the last ETL run succeeded.",
+            "# TYPE sparkify_etl_run_success gauge",
+            f"sparkify_etl_run_success {1 if report['success'] else 0}",
+            "# HELP sparkify_etl_last_run_timestamp_seconds Start of the last ETL run.",
+            "# TYPE sparkify_etl_last_run_timestamp_seconds gauge",
+            f"sparkify_etl_last_run_timestamp_seconds {self.started_at.timestamp():.0f}",
+        ]
+        for metric, key, help_text in [("statement_seconds", "seconds", "Wall time per statement."),
+                                       ("statement_rows", "rows", "Rows affected per statement."),
+                                       ("statement_bytes", "bytes", "Bytes scanned or loaded per statement.")]:
+            lines.append(f"# HELP sparkify_etl_{metric} {help_text}")
+            lines.append(f"# TYPE sparkify_etl_{metric} gauge")
+            # Statements sharing a name (e.g. repeated merges) are summed into one series
+            totals = {}
+            for record in report["statements"]:
+                if record.get(key) is not None:
+                    labels = (record["name"].replace('"', "'"), record["status"])
+                    totals[labels] = totals.get(labels, 0) + record[key]
+            for (label, status), value in totals.items():
+                lines.append(f'sparkify_etl_{metric}{{statement="{label}",status="{status}"}} {value}')
+
+        # Write to a temp file and rename, so the collector never reads a partial file
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(path + ".tmp", path)
+        return path
+
+
+def execute(cur, query, recorder=None, name=None, params=None):
+    """Executes `query`, through `recorder` when one is given."""
+    if recorder is not None:
+        return recorder.execute(cur, query, name=name, params=params)
+    cur.execute(query, params)
@@ -1,33 +1,35 @@
 import configparser
 from logger import get_logger
 import os
-from dotenv import load_dotenv
-
-# Laden der Umgebungsvariablen aus der .env-Datei
-load_dotenv()
-KEY = os.getenv("AWS_ACCESS_KEY_ID")
-SECRET = os.getenv("AWS_SECRET_ACCESS_KEY")
 
 # Konfiguration des Loggers
 logger = get_logger(__name__)
-logger.info("Dies ist eine Info-Nachricht")
-logger.error("Hier ist ein Fehler aufgetreten!")
 
 
-def load_config(file_path='dwh.cfg'):
-    """Lädt die Konfiguration aus einer Datei."""
-    config = configparser.ConfigParser()
+def load_credentials():
+    """Lädt die AWS-Zugangsdaten aus der .env-Datei bzw. der Umgebung (erst beim Aufruf, nicht beim Import)."""
+    from dotenv import load_dotenv
 
-    try:
-        config.read_file(open(file_path))
-        logger.info(f'Konfigurationsdatei {file_path} erfolgreich geladen.')
-    except Exception as e:
-        logger.error(f'Fehler beim Laden der Konfiguration: {e}')
-        raise
+    load_dotenv()
+    return os.getenv("AWS_ACCESS_KEY_ID"), os.getenv("AWS_SECRET_ACCESS_KEY")
+
+
+def load_config(file_path='dwh.cfg', config=None):
+    """Lädt die Konfiguration aus einer Datei, oder nimmt die bereits gelesene `config`."""
+    if config is None:
+        config = configparser.ConfigParser()
+
+        try:
+            config.read_file(open(file_path))
+            logger.info(f'Konfigurationsdatei {file_path} erfolgreich geladen.')
+        except Exception as e:
+            logger.error(f'Fehler beim Laden der Konfiguration: {e}')
+            raise
 
     # AWS-Zugangsdaten
     # KEY = config.get('AWS', 'KEY', fallback=None)
     # SECRET = config.get('AWS', 'SECRET', fallback=None)
+    KEY, SECRET = load_credentials()
 
     if not KEY or not SECRET:
         logger.error("Fehlende AWS-Zugangsdaten! Bitte überprüfe die Konfiguration.")
@@ -0,0 +1,207 @@
+import configparser
+import io
+import json
+import os
+import re
+import time
+import psycopg2
+from ddl import INT_TYPES, FLOAT_TYPES, parse_create_table, base_type
+from dialect import to_postgres
+import sql_queries
+from sql_queries import (staging_events_table_create, staging_songs_table_create,
+                         create_table_queries, drop_table_queries)
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+
+def parse_jsonpath(expression):
+    """Turns a Redshift JSONPath like "$['artist']" or "$.song.title" into a key tuple."""
+    keys = re.findall(r"\['([^']+)'\]|\.(\w+)", expression)
+    if not expression.startswith("$") or not keys:
+        raise ValueError(f"Unsupported JSONPath expression: {expression}")
+    return tuple(bracket or dotted for bracket, dotted in keys)
+
+
+def load_jsonpaths(path):
+    """Reads a Redshift jsonpaths file such as log_json_path.json."""
+    with open(path) as f:
+        return [parse_jsonpath(expression) for expression in json.load(f)["jsonpaths"]]
+
+
+def iter_json_files(root):
+    """Yields all *.json files below `root` in a stable order."""
+    if os.path.isfile(root):
+        yield root
+        return
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith(".json"):
+                yield os.path.join(dirpath, filename)
+
+
+def iter_records(path):
+    """Streams JSON objects from a file holding one object per line or a single object."""
+    with open(path) as f:
+        first = f.readline()
+        if not first.strip():
+            return
+        try:
+            yield json.loads(first)
+        except json.JSONDecodeError:
+            # Pretty-printed single object, small enough to read whole
+            yield json.loads(first + f.read())
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def extract_jsonpaths(record, jsonpaths):
+    """Maps a record onto the column order given by the jsonpaths file."""
+    values = []
+    for keys in jsonpaths:
+        value = record
+        for key in keys:
+            value = value.get(key) if isinstance(value, dict) else None
+        values.append(value)
+    return values
+
+
+def extract_auto(record, names):
+    """Maps a record onto columns by case-insensitive key name, like FORMAT AS JSON 'auto'."""
+    lowered = {key.lower(): value for key, value in record.items()}
+    return [lowered.get(name.lower()) for name in names]
+
+
+def coerce(value, column_type):
+    """Converts a JSON value to the Python value COPY expects for a column type."""
+    if value is None:
+        return None
+    kind = base_type(column_type)
+    if kind in INT_TYPES:
+        return None if value == "" else int(value)
+    if kind in FLOAT_TYPES:
+        return None if value == "" else float(value)
+    return str(value)
+
+
+def _copy_field(value):
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def copy_rows(cur, table, names, rows, batch_size=10000):
+    """Bulk-loads an iterable of rows via COPY FROM STDIN, `batch_size` rows per COPY."""
+    statement = f"COPY {table} ({', '.join(names)}) FROM STDIN"
+    buffer, pending, total = io.StringIO(), 0, 0
+    for row in rows:
+        buffer.write("\t".join(_copy_field(value) for value in row))
+        buffer.write("\n")
+        pending += 1
+        if pending >= batch_size:
+            buffer.seek(0)
+            cur.copy_expert(statement, buffer)
+            total += pending
+            buffer, pending = io.StringIO(), 0
+    if pending:
+        buffer.seek(0)
+        cur.copy_expert(statement, buffer)
+        total += pending
+    return total
+
+
+def staging_rows(root, create_query, jsonpaths=None):
+    """Yields coerced staging rows for all JSON files below `root`."""
+    _, columns = parse_create_table(create_query)
+    names = [column["name"] for column in columns]
+    if jsonpaths is not None and len(jsonpaths) != len(columns):
+        raise ValueError(f"jsonpaths file has {len(jsonpaths)} entries, table has {len(columns)} columns")
+
+    for path in iter_json_files(root):
+        for record in iter_records(path):
+            values = extract_jsonpaths(record, jsonpaths) if jsonpaths else extract_auto(record, names)
+            try:
+                yield [coerce(value, column["type"]) for value, column in zip(values, columns)]
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Cannot load record from {path}: {e}") from e
+
+
+def ingest_directory(cur, root, create_query, jsonpaths=None, batch_size=10000, validator=None):
+    """Loads the JSON files below `root` into the staging table of `create_query`.
+
+    With a validation.Validator only the rows passing its checks are loaded.
+    """
+    table, columns = parse_create_table(create_query)
+    names = [column["name"] for column in columns]
+    rows = validator.rows(root, create_query, jsonpaths) if validator else staging_rows(root, create_query, jsonpaths)
+    start = time.perf_counter()
+    total = copy_rows(cur, table, names, rows, batch_size)
+    seconds = time.perf_counter() - start
+    logger.info(f"Loaded {total} rows into {table} in {seconds:.2f}s ({total / max(seconds, 1e-9):.0f} rows/s)")
+    return total
+
+
+def load_local_staging(cur, conn, config):
+    """Loads the [LOCAL] log and song directories into the staging tables."""
+    batch_size = config.getint('LOCAL', 'BATCH_SIZE', fallback=10000)
+    jsonpaths = load_jsonpaths(config.get('LOCAL', 'LOG_JSONPATH'))
+    validator = None
+    if config.getboolean('VALIDATION', 'ENABLED', fallback=False):
+        from validation import Validator
+        validator = Validator.from_config(config)
+    ingest_directory(cur, config.get('LOCAL', 'LOG_DATA'), staging_events_table_create, jsonpaths, batch_size,
+                     validator)
+    ingest_directory(cur, config.get('LOCAL', 'SONG_DATA'), staging_songs_table_create, None, batch_size,
+                     validator)
+    conn.commit()
+
+
+def local_dsn(config):
+    """Builds the connection string of the local PostgreSQL stand-in."""
+    return "host={} dbname={} user={} password={} port={}".format(*config['LOCAL_DB'].values())
+
+
+def main():
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    conn = psycopg2.connect(local_dsn(config))
+    cur = conn.cursor()
+    timings = {}
+    try:
+        start = time.perf_counter()
+        for query in drop_table_queries + create_table_queries:
+            cur.execute(to_postgres(query))
+        conn.commit()
+        timings["create_tables"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        load_local_staging(cur, conn, config)
+        timings["staging"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for query in sql_queries.insert_table_queries:
+            cur.execute(to_postgres(query))
+        if sql_queries.time_table_insert not in sql_queries.insert_table_queries:
+            from time_dimension import build_time_dimension
+            build_time_dimension(cur, use_copy=True)
+        conn.commit()
+        timings["insert_tables"] = time.perf_counter() - start
+
+        for stage, seconds in timings.items():
+            logger.info(f"{stage}: {seconds:.2f}s")
+    except Exception as e:
+        logger.error(f"Local pipeline failed: {e}")
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import configparser
+import gzip
+import io
+import json
+import math
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Slices per node, see "Node type details" in the Redshift management guide
+NODE_SLICES = {
+    "dc2.large": 2,
+    "dc2.8xlarge": 16,
+    "ds2.xlarge": 2,
+    "ds2.8xlarge": 16,
+    "ra3.xlplus": 2,
+    "ra3.4xlarge": 4,
+    "ra3.16xlarge": 16,
+}
+
+
+def cluster_slices(node_type, num_nodes):
+    """Returns the number of slices of a cluster, i.e. how many files COPY loads in parallel."""
+    if node_type not in NODE_SLICES:
+        raise ValueError(f"Unknown node type {node_type}, known: {sorted(NODE_SLICES)}")
+    return NODE_SLICES[node_type] * int(num_nodes)
+
+
+def split_s3_uri(uri):
+    """Splits 's3://bucket/prefix' (optionally quoted, as in dwh.cfg) into bucket and prefix."""
+    uri = uri.strip().strip("'\"")
+    if not uri.startswith("s3://"):
+        raise ValueError(f"Not an S3 URI: {uri}")
+    bucket, _, prefix = uri[len("s3://"):].partition("/")
+    return bucket, prefix
+
+
+def list_objects(s3, uri, suffix=".json", start_after=None):
+    """Lists (url, size) of all objects below an S3 prefix ending in `suffix`.
+
+    With `start_after` (a key) S3 only returns the keys sorting after it.
+    """
+    bucket, prefix = split_s3_uri(uri)
+    params = {"StartAfter": start_after} if start_after else {}
+    objects = []
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix, **params):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith(suffix):
+                objects.append((f"s3://{bucket}/{obj['Key']}", obj["Size"]))
+    return sorted(objects)
+
+
+def list_json_keys(s3, uri, start_after=None):
+    """Lists all JSON object keys below an S3 prefix (after the key `start_after`) as full s3:// URLs."""
+    return [url for url, _ in list_objects(s3, uri, start_after=start_after)]
+
+
+def write_manifest(s3, manifest_uri, urls, sizes=None):
+    """Writes a Redshift COPY manifest listing `urls` to `manifest_uri`."""
+    bucket, key = split_s3_uri(manifest_uri)
+    entries = []
+    for i, url in enumerate(urls):
+        entry = {"url": url, "mandatory": True}
+        if sizes is not None:
+            entry["meta"] = {"content_length": sizes[i]}
+        entries.append(entry)
+    s3.put_object(Bucket=bucket, Key=key, Body=json.dumps({"entries": entries}).encode("utf-8"))
+    return f"s3://{bucket}/{key}"
+
+
+def plan_parts(objects, slices, target_part_bytes):
+    """Distributes objects over a multiple of `slices` parts of roughly equal size.
+
+    Largest objects are placed first, each into the currently smallest part.
+    """
+    total = sum(size for _, size in objects)
+    rounds = max(1, math.ceil(total / (slices * target_part_bytes)))
+    parts = [[] for _ in range(min(slices * rounds, max(1, len(objects))))]
+    loads = [0] * len(parts)
+    for url, size in sorted(objects, key=lambda obj: obj[1], reverse=True):
+        i = loads.index(min(loads))
+        parts[i].append(url)
+        loads[i] += size
+    return [sorted(part) for part in parts if part]
+
+
+def write_part(s3, urls, target_uri):
+    """Concatenates the JSON objects in `urls` into one gzip-compressed newline-delimited part."""
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb") as gz:
+        for url in urls:
+            bucket, key = split_s3_uri(url)
+            body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+            gz.write(body.rstrip(b"\n"))
+            gz.write(b"\n")
+    bucket, key = split_s3_uri(target_uri)
+    data = buffer.getvalue()
+    s3.put_object(Bucket=bucket, Key=key, Body=data)
+    return f"s3://{bucket}/{key}", len(data)
+
+
+def compact(s3, objects, target_prefix, slices, target_part_bytes=64 * 1024 * 1024):
+    """Compacts the objects into gzip parts and returns (urls, sizes) of the parts.
+
+    Objects below `target_part_bytes` are merged; larger ones are only compressed,
+    each into its own part, since the COPY reads every manifest entry as GZIP.
+    """
+    target_prefix = target_prefix.strip("'\"").rstrip("/")
+    small = [(url, size) for url, size in objects if size < target_part_bytes]
+    large = [url for url, size in objects if size >= target_part_bytes]
+    parts = (plan_parts(small, slices, target_part_bytes) if small else []) + [[url] for url in large]
+    logger.info(f"Compacting {len(small)} objects into {len(parts) - len(large)} parts for {slices} slices, "
+                f"compressing {len(large)} large objects on their own")
+    urls, sizes = [], []
+    for i, part in enumerate(parts):
+        url, size = write_part(s3, part, f"{target_prefix}/part-{i:05d}.json.gz")
+        urls.append(url)
+        sizes.append(size)
+    return urls, sizes
+
+
+def build_manifest(s3, source_uri, manifest_uri, compact_prefix=None, slices=None,
+                   target_part_bytes=64 * 1024 * 1024):
+    """Lists `source_uri` and writes a COPY manifest, compacting the objects first if requested."""
+    objects = list_objects(s3, source_uri)
+    if not objects:
+        raise ValueError(f"No JSON objects found below {source_uri}")
+    if compact_prefix:
+        urls, sizes = compact(s3, objects, compact_prefix, slices, target_part_bytes)
+    else:
+        urls, sizes = [url for url, _ in objects], [size for _, size in objects]
+    manifest = write_manifest(s3, manifest_uri, urls, sizes)
+    logger.info(f"Wrote manifest {manifest} with {len(urls)} entries for {len(objects)} source objects")
+    return manifest
+
+
+def main():
+    import boto3
+    from load_config import load_config
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+    KEY, SECRET, dwh_params = load_config()
+
+    s3 = boto3.client('s3', aws_access_key_id=KEY, aws_secret_access_key=SECRET,
+                      region_name=config.get('CLUSTER', 'REGION'),
+                      endpoint_url=config.get('S3', 'ENDPOINT_URL', fallback=None) or None)
+
+    compact_data = config.getboolean('ETL', 'COMPACT', fallback=False)
+    slices = cluster_slices(dwh_params["DWH_NODE_TYPE"], dwh_params["DWH_NUM_NODES"])
+    part_bytes = config.getint('ETL', 'COMPACT_PART_MB', fallback=64) * 1024 * 1024
+    compact_prefix = config.get('S3', 'COMPACT_PREFIX').strip("'\"").rstrip("/") if compact_data else None
+
+    for source, target, name in [('LOG_DATA', 'LOG_MANIFEST', 'log_data'),
+                                 ('SONG_DATA', 'SONG_MANIFEST', 'song_data')]:
+        build_manifest(s3, config.get('S3', source), config.get('S3', target),
+                       compact_prefix=f"{compact_prefix}/{name}" if compact_prefix else None,
+                       slices=slices, target_part_bytes=part_bytes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import argparse
+import configparser
+import uuid
+from datetime import datetime
+from ddl import parse_create_table, base_type
+from dialect import translate
+from physical_design import PROFILES, profile_create_queries
+import sql_queries
+from sql_queries import (create_table_queries, schema_migrations_table_create, schema_migrations_insert,
+                         catalog_columns_select, schema_profile_table_create, schema_profile_insert,
+                         schema_profile_select)
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# DDL types and the data_type information_schema reports for them
+CATALOG_TYPES = {
+    "INT": "integer",
+    "INTEGER": "integer",
+    "SMALLINT": "smallint",
+    "BIGINT": "bigint",
+    "FLOAT": "double precision",
+    "FLOAT8": "double precision",
+    "DOUBLE": "double precision",
+    "REAL": "real",
+    "FLOAT4": "real",
+    "NUMERIC": "numeric",
+    "DECIMAL": "numeric",
+    "VARCHAR": "character varying",
+    "CHAR": "character",
+    "TEXT": "text",
+    "BOOLEAN": "boolean",
+    "DATE": "date",
+    "TIMESTAMP": "timestamp without time zone",
+}
+# DuckDB's names for the data_type of information_schema.columns
+DUCKDB_CATALOG_TYPES = {
+    "varchar": "character varying",
+    "double": "double precision",
+    "float": "real",
+    "timestamp": "timestamp without time zone",
+}
+# Redshift stores a VARCHAR without length as VARCHAR(256), PostgreSQL as unlimited;
+# DuckDB ignores declared lengths, so they are not compared there
+DEFAULT_VARCHAR_LENGTH = {"redshift": 256, "postgres": None, "duckdb": None}
+
+# Names of the sql_queries statements filling a column added to a table that already holds rows
+COLUMN_BACKFILLS = {
+    ("songplays", "time_key"): "songplay_time_key_update",
+    ("songplays", "load_id"): "songplay_load_id_update",
+}
+
+
+def catalog(cur):
+    """Reads the tables of the current schema as {table: {column: (data_type, length)}}."""
+    cur.execute(catalog_columns_select)
+    tables = {}
+    for table, column, data_type, length in cur.fetchall():
+        data_type = DUCKDB_CATALOG_TYPES.get(data_type.lower(), data_type.lower())
+        tables.setdefault(table.lower(), {})[column.lower()] = (data_type, length)
+    return tables
+
+
+def _declared_length(column_type, dialect):
+    size = column_type.partition("(")[2].rstrip(")").strip()
+    if size.isdigit():
+        return int(size)
+    if base_type(column_type) == "VARCHAR":
+        return DEFAULT_VARCHAR_LENGTH[dialect]
+    if base_type(column_type) == "CHAR":
+        return 1
+    return None
+
+
+def _add_column_attributes(attributes):
+    """Keeps the attributes ALTER TABLE ADD COLUMN accepts (ENCODE, DEFAULT)."""
+    words = attributes.split()
+    kept, i = [], 0
+    while i < len(words):
+        word = words[i].upper()
+        if word in ("ENCODE", "DEFAULT") and i + 1 < len(words):
+            kept += words[i:i + 2]
+            i += 2
+        else:
+            i += 1
+    return " ".join(kept)
+
+
+def plan(current, create_queries, dialect="redshift"):
+    """Diffs the catalog against the CREATE TABLE statements.
+
+    Returns (statements, notes): the statements bringing the schema up to date
+    and the differences that need a manual change (type changes Redshift cannot
+    do in a transaction, columns that exist only in the database, ...).
+    """
+    statements, notes = [], []
+    for query in create_queries:
+        table, columns = parse_create_table(query)
+        existing = current.get(table.lower())
+        if existing is None:
+            statements.append(translate(query, dialect).strip())
+            continue
+
+        for column in columns:
+            name = column["name"].lower()
+            attributes = column["attributes"].upper()
+            if name not in existing:
+                if "IDENTITY" in attributes or "PRIMARY KEY" in attributes:
+                    notes.append(f"{table}.{name}: key columns cannot be added, reset the table")
+                    continue
+                extra = _add_column_attributes(column["attributes"])
+                statements.append(translate(f"ALTER TABLE {table} ADD COLUMN {column['name']} {column['type']}"
+                                            + (f" {extra}" if extra else "") + ";", dialect).strip())
+                backfill = COLUMN_BACKFILLS.get((table, name))
+                backfill = backfill and getattr(sql_queries, backfill)
+                if backfill:
+                    statements.append(translate(backfill, dialect).strip())
+                if "NOT NULL" in attributes:
+                    if dialect in ("postgres", "duckdb") and backfill:
+                        statements.append(f"ALTER TABLE {table} ALTER COLUMN {column['name']} SET NOT NULL;")
+                    else:
+                        notes.append(f"{table}.{name}: added without NOT NULL")
+                continue
+
+            data_type, length = existing[name]
+            wanted_type = CATALOG_TYPES.get(base_type(column["type"]))
+            if dialect == "duckdb" and wanted_type == "character":
+                wanted_type = "character varying"
+            wanted_length = _declared_length(column["type"], dialect)
+            if (wanted_type, data_type) == ("double precision", "real") and dialect in ("postgres", "duckdb"):
+                # Widening keeps every value; e.g. FLOAT columns DuckDB created as 4-byte REAL
+                statements.append(f"ALTER TABLE {table} ALTER COLUMN {column['name']} TYPE DOUBLE PRECISION;")
+            elif wanted_type and wanted_type != data_type:
+                notes.append(f"{table}.{name}: type {data_type} differs from {column['type']}")
+            elif (dialect != "duckdb" and wanted_length != length
+                  and wanted_type in ("character varying", "character")):
+                if base_type(column["type"]) == "VARCHAR" and dialect == "postgres":
+                    statements.append(f"ALTER TABLE {table} ALTER COLUMN {column['name']} TYPE {column['type']};")
+                else:
+                    notes.append(f"{table}.{name}: length {length} differs from {column['type']}")
+
+        declared = {column["name"].lower() for column in columns}
+        for name in sorted(set(existing) - declared):
+            notes.append(f"{table}.{name}: column exists only in the database")
+    return statements, notes
+
+
+def recorded_profile(cur):
+    """Returns the profile last recorded in schema_profile, or None."""
+    cur.execute(schema_profile_select)
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def design_notes(existing, recorded, profile, dialect):
+    """Lists the existing tables whose physical design differs between the recorded and the active profile.
+
+    Only Redshift has distribution, sort keys and encodings, and it can change them
+    only by recreating the table, so they are reported instead of planned.
+    """
+    if dialect != "redshift" or recorded in (None, profile):
+        return []
+    if recorded not in PROFILES:
+        return [f"recorded profile {recorded} is unknown, the physical design may differ from {profile}"]
+    notes = []
+    for table in sorted(set(PROFILES[recorded]) | set(PROFILES[profile])):
+        if table in existing and PROFILES[recorded].get(table) != PROFILES[profile].get(table):
+            notes.append(f"{table}: physical design of profile {recorded} differs from {profile}")
+    return notes
+
+
+def migrate(cur, conn, profile="none", dialect="redshift", dry_run=False):
+    """Applies the planned statements and their history rows in one transaction.
+
+    The active profile is recorded unless existing tables still have the physical
+    design of another one. Returns the applied (or, with `dry_run`, planned) statements.
+    """
+    cur.execute(translate(schema_migrations_table_create, dialect))
+    cur.execute(translate(schema_profile_table_create, dialect))
+    conn.commit()
+
+    existing = catalog(cur)
+    recorded = recorded_profile(cur)
+    statements, notes = plan(existing, profile_create_queries(create_table_queries, profile), dialect)
+    redesign = design_notes(existing, recorded, profile, dialect)
+    for note in notes + redesign:
+        logger.warning(f"Not migrated: {note}")
+    if redesign:
+        logger.warning(f"Profile {profile} is not recorded, recreate the tables with --reset to apply it")
+    record = recorded != profile and not redesign
+    if not statements:
+        if record and not dry_run:
+            cur.execute(schema_profile_insert, (profile, datetime.utcnow()))
+            conn.commit()
+            logger.info(f"Recorded schema profile {profile}")
+        logger.info("Schema is up to date")
+        return []
+    if dry_run:
+        for statement in statements:
+            logger.info(f"Would apply: {' '.join(statement.split())}")
+        return statements
+
+    migration_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:8]
+    try:
+        for statement in statements:
+            logger.info(f"Applying: {' '.join(statement.split())[:120]}")
+            cur.execute(statement)
+        now = datetime.utcnow()
+        cur.executemany(schema_migrations_insert, [(migration_id, statement, now) for statement in statements])
+        if record:
+            cur.execute(schema_profile_insert, (profile, now))
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Migration {migration_id} failed, rolling back: {e}")
+        conn.rollback()
+        raise
+    logger.info(f"Migration {migration_id} applied {len(statements)} statements")
+    return statements
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bring the warehouse schema up to date with sql_queries.py.")
+    parser.add_argument("--dry-run", action="store_true", help="only log the planned statements")
+    args = parser.parse_args()
+
+    from db_session import Session
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    session = Session.from_config(config)
+    try:
+        with session.connection() as conn:
+            migrate(conn.cursor(), conn, config.get('SCHEMA', 'PROFILE', fallback='none'), dry_run=args.dry_run)
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import configparser
+import os
+from datetime import datetime, timezone
+import pyarrow as pa
+import pyarrow.parquet as pq
+from ddl import parse_create_table, base_type
+from local_ingest import staging_rows, load_jsonpaths
+from sql_queries import staging_events_table_create, staging_songs_table_create
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Staging DDL types and the Parquet types Redshift COPY accepts for them
+_ARROW_TYPES = {
+    "INT": pa.int32(),
+    "INTEGER": pa.int32(),
+    "SMALLINT": pa.int16(),
+    "BIGINT": pa.int64(),
+    "FLOAT": pa.float64(),
+    "FLOAT8": pa.float64(),
+    "REAL": pa.float32(),
+    "VARCHAR": pa.string(),
+    "TIMESTAMP": pa.timestamp("us"),
+}
+
+
+def arrow_schema(create_query):
+    """Builds the Parquet schema matching a staging table, in column order."""
+    _, columns = parse_create_table(create_query)
+    return pa.schema([(column["name"], _ARROW_TYPES[base_type(column["type"])]) for column in columns])
+
+
+def _event_partition(ts):
+    if ts is None:
+        return None, None
+    moment = datetime.fromtimestamp(ts / 1000, tz=timezone.utc)
+    return moment.year, moment.month
+
+
+def write_batches(rows, schema, target, partition_by_ts=False, batch_size=100000, partition_cols=None):
+    """Writes rows as Parquet below `target`, optionally partitioned by year/month of ts.
+
+    `partition_cols` instead partitions by columns the rows already contain.
+    Rows are written in batches of `batch_size`, so memory stays bounded by the batch.
+    """
+    names = schema.names
+    ts_index = names.index("ts") if partition_by_ts else None
+    batch, part, total = [], 0, 0
+
+    def flush():
+        columns = list(zip(*batch))
+        table = pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                                     schema=schema)
+        if partition_by_ts:
+            years, months = zip(*(_event_partition(row[ts_index]) for row in batch))
+            table = table.append_column("year", pa.array(years, pa.int32()))
+            table = table.append_column("month", pa.array(months, pa.int32()))
+            pq.write_to_dataset(table, target, partition_cols=["year", "month"],
+                                basename_template=f"part-{part:05d}-{{i}}.parquet")
+        elif partition_cols:
+            pq.write_to_dataset(table, target, partition_cols=partition_cols,
+                                basename_template=f"part-{part:05d}-{{i}}.parquet")
+        else:
+            os.makedirs(target, exist_ok=True)
+            pq.write_table(table, os.path.join(target, f"part-{part:05d}.parquet"))
+
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            flush()
+            total += len(batch)
+            batch, part = [], part + 1
+    if batch:
+        flush()
+        total += len(batch)
+    return total
+
+
+def convert_events(source, target, jsonpaths, batch_size=100000, validator=None):
+    """Converts local log JSON into Parquet partitioned by year/month of ts."""
+    rows = (validator.rows if validator else staging_rows)(source, staging_events_table_create, jsonpaths)
+    total = write_batches(rows, arrow_schema(staging_events_table_create), target, True, batch_size)
+    logger.info(f"Converted {total} events from {source} to {target}")
+    return total
+
+
+def convert_songs(source, target, batch_size=100000, validator=None):
+    """Converts local song JSON into unpartitioned Parquet."""
+    rows = (validator.rows if validator else staging_rows)(source, staging_songs_table_create)
+    total = write_batches(rows, arrow_schema(staging_songs_table_create), target, False, batch_size)
+    logger.info(f"Converted {total} songs from {source} to {target}")
+    return total
+
+
+def upload_directory(s3, source, target_uri):
+    """Uploads all Parquet files below `source` to the S3 prefix `target_uri`, keeping the layout."""
+    from manifest import split_s3_uri
+
+    bucket, prefix = split_s3_uri(target_uri)
+    count = 0
+    for dirpath, _, filenames in os.walk(source):
+        for filename in filenames:
+            if filename.endswith(".parquet"):
+                path = os.path.join(dirpath, filename)
+                key = "/".join([prefix.rstrip("/"), os.path.relpath(path, source).replace(os.sep, "/")])
+                s3.upload_file(path, bucket, key)
+                count += 1
+    logger.info(f"Uploaded {count} Parquet files to s3://{bucket}/{prefix}")
+    return count
+
+
+def main():
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    batch_size = config.getint('LOCAL', 'BATCH_SIZE', fallback=10000)
+    target = config.get('LOCAL', 'PARQUET_DIR', fallback='data/parquet')
+    events_dir, songs_dir = os.path.join(target, 'log_data'), os.path.join(target, 'song_data')
+
+    validator = None
+    if config.getboolean('VALIDATION', 'ENABLED', fallback=False):
+        from validation import Validator
+        validator = Validator.from_config(config)
+
+    convert_events(config.get('LOCAL', 'LOG_DATA'), events_dir,
+                   load_jsonpaths(config.get('LOCAL', 'LOG_JSONPATH')), batch_size, validator)
+    convert_songs(config.get('LOCAL', 'SONG_DATA'), songs_dir, batch_size, validator)
+
+    if config.get('S3', 'LOG_PARQUET', fallback=''):
+        import boto3
+        from load_config import load_config
+
+        KEY, SECRET, _ = load_config()
+        s3 = boto3.client('s3', aws_access_key_id=KEY, aws_secret_access_key=SECRET,
+                          region_name=config.get('CLUSTER', 'REGION'),
+                          endpoint_url=config.get('S3', 'ENDPOINT_URL', fallback=None) or None)
+        upload_directory(s3, events_dir, config.get('S3', 'LOG_PARQUET'))
+        upload_directory(s3, songs_dir, config.get('S3', 'SONG_PARQUET'))
+
+
+if __name__ == "__main__":
+    main()
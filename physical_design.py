@@ -0,0 +1,71 @@
+from ddl import parse_create_table, render_create_table
+
+# Physical design profiles: per table the DISTSTYLE/DISTKEY/SORTKEY attributes
+# and optional column encodings. 'none' leaves the DDL in sql_queries.py untouched.
+PROFILES = {
+    "none": {},
+    "even": {
+        "staging_events": {"table": "DISTSTYLE EVEN"},
+        "staging_songs": {"table": "DISTSTYLE EVEN"},
+        "songplays": {"table": "DISTSTYLE EVEN"},
+        "users": {"table": "DISTSTYLE EVEN"},
+        "songs": {"table": "DISTSTYLE EVEN"},
+        "artists": {"table": "DISTSTYLE EVEN"},
+        "time": {"table": "DISTSTYLE EVEN"},
+        "users_history": {"table": "DISTSTYLE EVEN"},
+        "song_lookup": {"table": "DISTSTYLE EVEN"},
+        "songplays_unmatched": {"table": "DISTSTYLE EVEN"},
+    },
+    # Collocates songplays with songs, replicates the small dimensions to every
+    # node and distributes the staging tables on the songplays join columns
+    "star": {
+        "staging_events": {"table": "DISTKEY(song)"},
+        "staging_songs": {"table": "DISTKEY(title)"},
+        "songplays": {
+            "table": "DISTKEY(song_id) SORTKEY(start_time)",
+            "encode": {"level": "BYTEDICT", "location": "ZSTD", "user_agent": "ZSTD"},
+        },
+        "users": {"table": "DISTSTYLE ALL SORTKEY(user_id)", "encode": {"gender": "BYTEDICT", "level": "BYTEDICT"}},
+        "songs": {"table": "DISTKEY(song_id) SORTKEY(song_id)", "encode": {"title": "ZSTD"}},
+        "artists": {"table": "DISTSTYLE ALL SORTKEY(artist_id)", "encode": {"name": "ZSTD", "location": "ZSTD"}},
+        "time": {"table": "DISTSTYLE ALL SORTKEY(start_time)"},
+        "users_history": {"table": "DISTSTYLE ALL SORTKEY(user_id, valid_from)"},
+        "song_lookup": {"table": "DISTSTYLE ALL SORTKEY(song_key)"},
+        "songplays_unmatched": {"table": "DISTSTYLE EVEN SORTKEY(start_time)"},
+        "pipeline_state": {"table": "DISTSTYLE ALL"},
+        "pipeline_loaded_files": {"table": "DISTSTYLE ALL"},
+        "pipeline_partitions": {"table": "DISTSTYLE ALL"},
+        "agg_song_plays": {"table": "DISTSTYLE ALL SORTKEY(song_id)"},
+        "agg_user_plays": {"table": "DISTSTYLE ALL SORTKEY(user_id)"},
+        "agg_hourly_plays": {"table": "DISTSTYLE ALL"},
+    },
+}
+
+
+def get_profile(name):
+    """Returns the profile called `name`, raising a ValueError for unknown names."""
+    if name not in PROFILES:
+        raise ValueError(f"Unknown schema profile {name}, known: {sorted(PROFILES)}")
+    return PROFILES[name]
+
+
+def apply_profile(query, profile):
+    """Adds the distribution, sort key and column encodings of a profile to a CREATE TABLE."""
+    table, columns = parse_create_table(query)
+    design = profile.get(table)
+    if not design:
+        return query
+
+    encode = design.get("encode", {})
+    for column in columns:
+        if column["name"] in encode:
+            # ENCODE is a column attribute and has to precede constraints like NOT NULL
+            attributes = f"ENCODE {encode[column['name']]} {column['attributes']}"
+            column["attributes"] = attributes.strip()
+    return render_create_table(table, columns, design.get("table", ""))
+
+
+def profile_create_queries(create_queries, name):
+    """Returns the CREATE TABLE statements with the physical design of profile `name`."""
+    profile = get_profile(name)
+    return [apply_profile(query, profile) for query in create_queries]
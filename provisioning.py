@@ -0,0 +1,315 @@
+import configparser
+import json
+import random
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from botocore.exceptions import ClientError
+from logger import get_logger
+
+# Konfiguration des Loggers
+logger = get_logger(__name__)
+
+# Konsistente Region definieren (gleich wie in clean_up_cluster.py)
+REGION = 'us-west-2'
+S3_READ_ONLY_POLICY = "arn:aws:iam::aws:policy/AmazonS3ReadOnlyAccess"
+
+REQUIRED_PARAMS = ["DWH_CLUSTER_TYPE", "DWH_NODE_TYPE", "DWH_NUM_NODES", "DWH_DB",
+                   "DWH_CLUSTER_IDENTIFIER", "DWH_DB_USER", "DWH_DB_PASSWORD"]
+
+
+class Timings:
+    """Sammelt die Dauer der einzelnen Provisionierungsschritte."""
+
+    def __init__(self):
+        self.steps = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def measure(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps[name] = self.steps.get(name, 0.0) + time.perf_counter() - start
+
+    def log(self, title="Zeitaufschlüsselung der Provisionierung:"):
+        logger.info(title)
+        for name, seconds in self.steps.items():
+            logger.info(f"  {name:28} {seconds:8.1f}s")
+        logger.info(f"  {'gesamt':28} {time.perf_counter() - self._start:8.1f}s")
+
+
+def backoff_delays(base=2.0, cap=60.0, factor=2.0, rng=random):
+    """Liefert endlos exponentiell wachsende Wartezeiten mit Jitter (halb fix, halb zufällig)."""
+    delay = base
+    while True:
+        yield delay / 2 + rng.uniform(0, delay / 2)
+        delay = min(cap, delay * factor)
+
+
+def wait_until(check, timeout, description, base=2.0, cap=60.0, sleep=time.sleep):
+    """Ruft `check` mit Backoff auf, bis es einen Wert ungleich None liefert oder `timeout` abläuft."""
+    deadline = time.monotonic() + timeout
+    for attempt, delay in enumerate(backoff_delays(base, cap), start=1):
+        result = check()
+        if result is not None:
+            return result
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"{description}: nach {timeout}s und {attempt} Versuchen nicht bereit")
+        logger.info(f"{description}: Versuch {attempt}, nächster Versuch in {min(delay, remaining):.1f}s")
+        sleep(min(delay, remaining))
+
+
+def tcp_probe(host, port, timeout=3.0):
+    """Prüft, ob der Port auf TCP-Ebene Verbindungen annimmt."""
+    try:
+        with socket.create_connection((host, int(port)), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def ensure_role(iam, role_name):
+    """Erstellt die IAM-Rolle für Redshift, falls sie fehlt, und gibt ihre ARN zurück."""
+    try:
+        role = iam.get_role(RoleName=role_name)
+        logger.info(f"IAM-Rolle {role_name} existiert bereits")
+        return role['Role']['Arn']
+    except iam.exceptions.NoSuchEntityException:
+        pass
+
+    logger.info("1.1 Erstelle eine neue IAM-Rolle")
+    role = iam.create_role(
+        Path='/',
+        RoleName=role_name,
+        Description='Erlaubt Redshift-Cluster den Zugriff auf AWS-Dienste.',
+        AssumeRolePolicyDocument=json.dumps({
+            "Version": "2012-10-17",
+            "Statement": [{
+                "Effect": "Allow",
+                "Principal": {"Service": "redshift.amazonaws.com"},
+                "Action": "sts:AssumeRole"
+            }]
+        }),
+    )
+    logger.info(f"IAM-Rolle erfolgreich erstellt, Statuscode: {role['ResponseMetadata']['HTTPStatusCode']}")
+    return role['Role']['Arn']
+
+
+def attach_policy(iam, role_name):
+    """Hängt die S3ReadOnlyAccess-Policy an die Rolle (idempotent)."""
+    logger.info("1.2 Füge S3ReadOnlyAccess-Policy hinzu")
+    try:
+        iam.attach_role_policy(RoleName=role_name, PolicyArn=S3_READ_ONLY_POLICY)
+        logger.info("S3ReadOnlyAccess-Policy erfolgreich hinzugefügt")
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'EntityAlreadyExists' or 'PolicyAlreadyAttached' in str(e):
+            logger.info("Policy ist bereits an die Rolle angehängt")
+        else:
+            raise
+
+
+def ensure_cluster(redshift, dwh_params, role_arn):
+    """Startet die Erstellung des Clusters, falls er noch nicht existiert (wartet nicht)."""
+    identifier = dwh_params["DWH_CLUSTER_IDENTIFIER"]
+    try:
+        redshift.describe_clusters(ClusterIdentifier=identifier)
+        logger.info(f"Redshift-Cluster {identifier} existiert bereits")
+        return False
+    except redshift.exceptions.ClusterNotFoundFault:
+        pass
+
+    logger.info("2.1 Erstelle Redshift-Cluster")
+    params = dict(
+        ClusterType=dwh_params["DWH_CLUSTER_TYPE"],
+        NodeType=dwh_params["DWH_NODE_TYPE"],
+        DBName=dwh_params["DWH_DB"],
+        ClusterIdentifier=identifier,
+        MasterUsername=dwh_params["DWH_DB_USER"],
+        MasterUserPassword=dwh_params["DWH_DB_PASSWORD"],
+        Port=int(dwh_params.get("DWH_PORT") or 5439),
+        IamRoles=[role_arn],
+    )
+    # Single-Node-Cluster dürfen NumberOfNodes nicht angeben
+    if dwh_params["DWH_CLUSTER_TYPE"] != "single-node":
+        params["NumberOfNodes"] = int(dwh_params["DWH_NUM_NODES"])
+    redshift.create_cluster(**params)
+    logger.info("Redshift-Cluster wird erstellt")
+    return True
+
+
+def authorize_ingress(ec2, port, vpc_id=None, cidr='0.0.0.0/0'):
+    """Öffnet den Redshift-Port in der Default-Sicherheitsgruppe der (Default-)VPC."""
+    logger.info("2.2 Konfiguriere Sicherheitsgruppen")
+    if vpc_id is None:
+        vpcs = ec2.describe_vpcs(Filters=[{'Name': 'isDefault', 'Values': ['true']}])['Vpcs']
+        if not vpcs:
+            raise RuntimeError("Keine Default-VPC gefunden")
+        vpc_id = vpcs[0]['VpcId']
+    groups = ec2.describe_security_groups(Filters=[{'Name': 'vpc-id', 'Values': [vpc_id]},
+                                                   {'Name': 'group-name', 'Values': ['default']}])['SecurityGroups']
+    if not groups:
+        raise RuntimeError(f"Keine Sicherheitsgruppen in VPC {vpc_id} gefunden")
+
+    group = groups[0]
+    logger.info(f"Sicherheitsgruppe {group['GroupName']} aktualisieren")
+    try:
+        ec2.authorize_security_group_ingress(
+            GroupId=group['GroupId'],
+            IpPermissions=[{'IpProtocol': 'tcp', 'FromPort': int(port), 'ToPort': int(port),
+                            'IpRanges': [{'CidrIp': cidr}]}],
+        )
+        logger.info("Sicherheitsgruppe erfolgreich aktualisiert")
+    except ClientError as e:
+        if 'InvalidPermission.Duplicate' in str(e):
+            logger.info("Zugriff bereits konfiguriert")
+        else:
+            raise
+    return group['GroupId']
+
+
+def wait_for_cluster_available(redshift, identifier, timeout=1800, sleep=time.sleep):
+    """Wartet mit Backoff, bis der Cluster den Status 'available' und einen Endpoint hat."""
+    logger.info("Warte, bis der Cluster verfügbar ist...")
+
+    def check():
+        cluster = redshift.describe_clusters(ClusterIdentifier=identifier)['Clusters'][0]
+        logger.info(f"Cluster-Status: {cluster['ClusterStatus']}")
+        if cluster['ClusterStatus'] == 'available' and cluster.get('Endpoint'):
+            return cluster
+        return None
+
+    cluster = wait_until(check, timeout, "Cluster-Verfügbarkeit", base=10, cap=60, sleep=sleep)
+    logger.info("Cluster ist jetzt verfügbar!")
+    return cluster
+
+
+def validate_connection(host, dwh_params):
+    """Überprüft, ob der Cluster erreichbar ist"""
+    import psycopg2
+    from db_session import Session
+
+    session = Session({"host": host, "dbname": dwh_params["DWH_DB"], "user": dwh_params["DWH_DB_USER"],
+                       "password": dwh_params["DWH_DB_PASSWORD"], "port": dwh_params["DWH_PORT"],
+                       "connect_timeout": 10, "keepalives": 1}, max_connections=1, retries=0)
+    try:
+        session.execute("SELECT 1")
+        return True
+    except psycopg2.Error as e:
+        logger.warning(f"Verbindung zum Redshift-Cluster noch nicht möglich: {e}")
+        return None
+    finally:
+        session.close()
+
+
+def update_config(endpoint, role_arn, path='dwh.cfg'):
+    """Schreibt Endpoint, Region und Rollen-ARN in die dwh.cfg."""
+    config = configparser.ConfigParser()
+    config.read(path)
+    config.set('CLUSTER', 'HOST', endpoint)
+    if not config.has_option('CLUSTER', 'REGION'):
+        config.set('CLUSTER', 'REGION', REGION)
+    config.set('IAM_ROLE', 'ARN', role_arn)
+    with open(path, 'w') as configfile:
+        config.write(configfile)
+    logger.info(f"{path} wurde mit aktuellen Werten aktualisiert")
+
+
+def provision(iam, redshift, ec2, dwh_params, timings=None, sleep=time.sleep, connect=validate_connection):
+    """Richtet Rolle, Policy, Sicherheitsgruppe und Cluster ein; unabhängige Schritte laufen parallel.
+
+    Gibt (Cluster-Beschreibung, Rollen-ARN) zurück, sobald der Cluster per TCP und SQL erreichbar ist.
+    """
+    missing = [name for name in REQUIRED_PARAMS if not dwh_params.get(name)]
+    if missing:
+        raise ValueError(f"Einige erforderliche Parameter fehlen: {missing}")
+
+    timings = timings or Timings()
+    role_name, port = dwh_params["DWH_IAM_ROLE_NAME"], dwh_params["DWH_PORT"]
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        def ingress():
+            with timings.measure("Sicherheitsgruppe"):
+                return authorize_ingress(ec2, port)
+
+        def policy():
+            with timings.measure("Policy anhängen"):
+                attach_policy(iam, role_name)
+
+        # Die Sicherheitsgruppe hängt von nichts ab, der Cluster nur von der Rollen-ARN
+        ingress_future = pool.submit(ingress)
+        with timings.measure("IAM-Rolle"):
+            role_arn = ensure_role(iam, role_name)
+        policy_future = pool.submit(policy)
+        with timings.measure("Cluster anlegen"):
+            ensure_cluster(redshift, dwh_params, role_arn)
+        policy_future.result()
+        ingress_future.result()
+
+    with timings.measure("Warten auf Cluster"):
+        cluster = wait_for_cluster_available(redshift, dwh_params["DWH_CLUSTER_IDENTIFIER"], sleep=sleep)
+    endpoint = cluster['Endpoint']['Address']
+    logger.info(f"Cluster-Endpoint: {endpoint}")
+
+    with timings.measure("TCP-Bereitschaft"):
+        wait_until(lambda: tcp_probe(endpoint, port) or None, 600, "TCP-Verbindung", base=2, cap=30, sleep=sleep)
+    with timings.measure("SQL-Verbindung"):
+        wait_until(lambda: connect(endpoint, dwh_params), 300, "SQL-Verbindung", base=2, cap=30, sleep=sleep)
+
+    return cluster, role_arn
+
+
+def provision_from_config(config, timings):
+    """Provisioniert mit den Zugangsdaten aus .env und den Parametern aus der bereits gelesenen `config`.
+
+    Schreibt Endpoint und Rollen-ARN in die dwh.cfg und in `config` und gibt
+    (Cluster-Beschreibung, Rollen-ARN, DWH-Parameter) zurück.
+    """
+    import boto3
+    from load_config import load_config
+
+    KEY, SECRET, dwh_params = load_config(config=config)
+    session = boto3.session.Session(aws_access_key_id=KEY, aws_secret_access_key=SECRET, region_name=REGION)
+
+    if config.getboolean('CAPACITY', 'SIZE_FROM_LOAD', fallback=False):
+        from capacity import plan_from_config
+
+        # Knotentyp und -zahl aus der S3-Last statt der festen DWH_NODE_TYPE/DWH_NUM_NODES
+        with timings.measure("Größe schätzen"):
+            plan = plan_from_config(config, session.client('s3'))
+        dwh_params.update(DWH_NODE_TYPE=plan["node_type"], DWH_NUM_NODES=str(plan["nodes"]),
+                          DWH_CLUSTER_TYPE="multi-node" if plan["nodes"] > 1 else "single-node")
+
+    cluster, role_arn = provision(session.client('iam'), session.client('redshift'), session.client('ec2'),
+                                  dwh_params, timings)
+    update_config(cluster['Endpoint']['Address'], role_arn)
+    config.set('CLUSTER', 'HOST', cluster['Endpoint']['Address'])
+    config.set('IAM_ROLE', 'ARN', role_arn)
+    return cluster, role_arn, dwh_params
+
+
+def main():
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+    timings = Timings()
+
+    try:
+        cluster, role_arn, dwh_params = provision_from_config(config, timings)
+    except Exception as e:
+        logger.error(f"Fehler bei der Einrichtung des Redshift-Clusters: {e}")
+        timings.log()
+        raise SystemExit(1)
+
+    timings.log()
+    logger.info("Redshift-Cluster wurde erfolgreich eingerichtet und ist erreichbar!")
+    logger.info(f"Host: {cluster['Endpoint']['Address']}")
+    logger.info(f"Datenbank: {dwh_params['DWH_DB']}")
+    logger.info(f"Benutzer: {dwh_params['DWH_DB_USER']}")
+    logger.info("Führe 'python create_tables.py' aus, um die Tabellen zu erstellen.")
+
+
+if __name__ == "__main__":
+    main()
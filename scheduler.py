@@ -0,0 +1,155 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+
+class Step:
+    """A single SQL statement in the ETL graph and the steps it depends on."""
+
+    def __init__(self, name, query, depends_on=()):
+        self.name = name
+        self.query = query
+        self.depends_on = tuple(depends_on)
+
+    def __repr__(self):
+        return f"Step({self.name!r}, depends_on={list(self.depends_on)})"
+
+
+def topological_order(steps):
+    """Returns the step names in dependency order, validating the graph."""
+    by_name = {step.name: step for step in steps}
+    if len(by_name) != len(steps):
+        raise ValueError("Duplicate step names in ETL graph")
+    for step in steps:
+        unknown = [dep for dep in step.depends_on if dep not in by_name]
+        if unknown:
+            raise ValueError(f"Step {step.name} depends on unknown steps: {unknown}")
+
+    order, done, visiting = [], set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Cycle in ETL graph at step {name}")
+        visiting.add(name)
+        for dep in by_name[name].depends_on:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+        order.append(name)
+
+    for step in steps:
+        visit(step.name)
+    return order
+
+
+def critical_path(steps, durations):
+    """Returns (path, seconds) of the longest dependency chain by measured duration."""
+    by_name = {step.name: step for step in steps}
+    finish, previous = {}, {}
+    for name in topological_order(steps):
+        deps = [dep for dep in by_name[name].depends_on if dep in finish]
+        slowest = max(deps, key=lambda dep: finish[dep], default=None)
+        previous[name] = slowest
+        finish[name] = durations.get(name, 0.0) + (finish[slowest] if slowest else 0.0)
+
+    if not finish:
+        return [], 0.0
+    name = max(finish, key=finish.get)
+    total = finish[name]
+    path = []
+    while name:
+        path.append(name)
+        name = previous[name]
+    return list(reversed(path)), total
+
+
+def execute_step(step, connect):
+    """Executes one step on its own connection and returns (start, end)."""
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        start = time.perf_counter()
+        cur.execute(step.query)
+        conn.commit()
+        return start, time.perf_counter()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def run_dag(steps, connect, max_concurrency=4, run_step=None):
+    """Runs independent steps concurrently, each on a connection from `connect`.
+
+    `run_step(step, connect)` can be passed to replace the default executor
+    (e.g. to add instrumentation); it must return the (start, end) timestamps.
+    Returns a report dict with per-step timings, wall time and the critical path.
+    """
+    run_step = run_step or execute_step
+    max_concurrency = max(1, int(max_concurrency))
+    order = topological_order(steps)
+    by_name = {step.name: step for step in steps}
+    pending = [by_name[name] for name in order]
+    finished, timings = set(), {}
+    running = {}
+    failure = None
+
+    logger.info(f"Running {len(steps)} ETL steps with max concurrency {max_concurrency}")
+    origin = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        while pending or running:
+            if failure is None:
+                for step in list(pending):
+                    if len(running) >= max_concurrency:
+                        break
+                    if all(dep in finished for dep in step.depends_on):
+                        pending.remove(step)
+                        logger.info(f"Starting step {step.name}")
+                        running[pool.submit(run_step, step, connect)] = step
+            elif not running:
+                break
+
+            if not running:
+                raise RuntimeError(f"ETL graph is stuck, pending steps: {[s.name for s in pending]}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                try:
+                    start, end = future.result()
+                except Exception as e:
+                    logger.error(f"Step {step.name} failed: {e}")
+                    if failure is None:
+                        failure = e
+                    continue
+                timings[step.name] = {
+                    "start": round(start - origin, 3),
+                    "end": round(end - origin, 3),
+                    "seconds": round(end - start, 3),
+                }
+                finished.add(step.name)
+                logger.info(f"Finished step {step.name} in {end - start:.2f}s")
+
+    if failure is not None:
+        raise failure
+
+    wall = time.perf_counter() - origin
+    path, path_seconds = critical_path(steps, {name: t["seconds"] for name, t in timings.items()})
+    serial = sum(t["seconds"] for t in timings.values())
+    logger.info(f"ETL graph finished in {wall:.2f}s (serial sum {serial:.2f}s)")
+    logger.info(f"Critical path ({path_seconds:.2f}s): {' -> '.join(path)}")
+
+    return {
+        "steps": timings,
+        "wall_seconds": round(wall, 3),
+        "serial_seconds": round(serial, 3),
+        "critical_path": path,
+        "critical_path_seconds": round(path_seconds, 3),
+    }
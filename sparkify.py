@@ -0,0 +1,147 @@
+import time
+
+# Taken before any other import, so the startup time includes them
+_STARTED = time.perf_counter()
+
+import argparse
+import configparser
+from contextlib import ExitStack, nullcontext
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+STAGES = ["provision", "create", "load", "check", "teardown"]
+DATABASE_STAGES = {"create", "load", "check"}
+
+
+class Pipeline:
+    """Runs pipeline stages in one process: dwh.cfg is read once, every stage imports
+    only what it needs, and the database stages share one warm session."""
+
+    def __init__(self, config, backend=None, reset=False):
+        self.config = config
+        self.backend = backend or config.get('ETL', 'BACKEND', fallback='redshift')
+        self.reset = reset
+        self.timings = {}
+        self._session = None
+        self._remaining = []
+
+    @property
+    def session(self):
+        """The shared session; opened on first use, after provisioning wrote the host."""
+        if self._session is None:
+            from db_session import open_session
+
+            self._session = open_session(self.config, self.backend)
+        return self._session
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+            logger.info("Database connections closed")
+
+    def provision(self):
+        from provisioning import Timings, provision_from_config
+
+        timings = Timings()
+        cluster, _, _ = provision_from_config(self.config, timings)
+        timings.log()
+        logger.info(f"Cluster available at {cluster['Endpoint']['Address']}")
+
+    def create(self):
+        from create_tables import create_or_migrate
+
+        create_or_migrate(self.session, self.config, self.backend, self.reset)
+
+    def load(self):
+        from etl import load
+
+        # A check stage later in the run checks the load; checking inside the load as well runs every check twice
+        load(self.session, self.config, quality="check" not in self._remaining)
+
+    def check(self):
+        from data_quality import check
+
+        results = check(self.session, self.config)
+        failed = [result for result in results if not result["passed"]]
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {len(results)} data quality checks failed")
+
+    def teardown(self):
+        from clean_up_cluster import clean_up_from_config
+
+        self.close()
+        clean_up_from_config(self.config)
+
+    def run(self, stages):
+        """Runs `stages` in the given order; capacity management wraps the database stages as a whole."""
+        for stage in stages:
+            if stage in ("provision", "teardown") and self.backend != "redshift":
+                raise ValueError(f"{stage} manages the Redshift cluster; the {self.backend} backend has none")
+        database_stages = [stage for stage in stages if stage in DATABASE_STAGES]
+        try:
+            with ExitStack() as capacity:
+                for i, stage in enumerate(stages):
+                    if database_stages and stage == database_stages[0]:
+                        capacity.enter_context(self._managed_capacity())
+                    self._remaining = stages[i + 1:]
+                    self._run_stage(stage)
+                    if database_stages and stage == database_stages[-1]:
+                        capacity.close()
+        finally:
+            self.close()
+
+    def _managed_capacity(self):
+        if self.backend != "redshift" or not self.config.getboolean('CAPACITY', 'MANAGE', fallback=False):
+            return nullcontext()
+        from etl import managed_capacity
+
+        return managed_capacity(self.config)
+
+    def _run_stage(self, stage):
+        logger.info(f"Stage {stage}")
+        start = time.perf_counter()
+        try:
+            getattr(self, stage)()
+        finally:
+            self.timings[stage] = time.perf_counter() - start
+            logger.info(f"Stage {stage} took {self.timings[stage]:.2f}s")
+
+    def log(self):
+        logger.info("Timings:")
+        for stage, seconds in self.timings.items():
+            logger.info(f"  {stage:10} {seconds:8.2f}s")
+        logger.info(f"  {'total':10} {time.perf_counter() - _STARTED:8.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Sparkify pipeline stages in one process.")
+    parser.add_argument("stages", nargs="+", choices=STAGES,
+                        help="stages to run, in the given order, e.g. 'create load check'")
+    parser.add_argument("--backend", choices=["redshift", "duckdb"], default=None,
+                        help="database of the create/load/check stages, default [ETL] BACKEND")
+    parser.add_argument("--reset", action="store_true",
+                        help="create: drop and recreate all tables instead of migrating them")
+    args = parser.parse_args()
+
+    import sql_queries
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+    if args.backend:
+        config.set('ETL', 'BACKEND', args.backend)
+    # The queries are built from this config instead of reading dwh.cfg again
+    sql_queries.use_settings(config)
+
+    pipeline = Pipeline(config, args.backend, args.reset)
+    logger.info(f"Startup took {(time.perf_counter() - _STARTED) * 1000:.0f} ms")
+    try:
+        pipeline.run(args.stages)
+    finally:
+        pipeline.log()
+
+
+if __name__ == "__main__":
+    main()
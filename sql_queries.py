@@ -1,9 +1,38 @@
 import configparser
+from functools import lru_cache
 
 
 # CONFIG
-config = configparser.ConfigParser()
-config.read('dwh.cfg')
+# dwh.cfg is read when the first query that depends on it is used (see
+# __getattr__ at the end of this module), so importing has no side effects
+_settings = None
+_LAZY = {}
+
+
+def settings():
+    """The parsed dwh.cfg; read on first use, then shared by all queries of the process."""
+    global _settings
+    if _settings is None:
+        _settings = configparser.ConfigParser()
+        _settings.read('dwh.cfg')
+    return _settings
+
+
+def use_settings(config):
+    """Builds the queries from an already parsed config instead of reading dwh.cfg.
+
+    Queries that were already used keep the settings they were built with.
+    """
+    global _settings
+    _settings = config
+
+
+def _lazy(builder):
+    """Registers `builder` as the module attribute named like it without the leading
+    underscore; the attribute is built on first access and cached."""
+    builder = lru_cache(maxsize=None)(builder)
+    _LAZY[builder.__name__[1:]] = builder
+    return builder
 
 # DROP TABLES
 
@@ -14,6 +43,15 @@ user_table_drop = "DROP TABLE IF EXISTS users;"
 song_table_drop = "DROP TABLE IF EXISTS songs;"
 artist_table_drop = "DROP TABLE IF EXISTS artists;"
 time_table_drop = "DROP TABLE IF EXISTS time;"
+user_history_table_drop = "DROP TABLE IF EXISTS users_history;"
+song_lookup_table_drop = "DROP TABLE IF EXISTS song_lookup;"
+songplay_unmatched_table_drop = "DROP TABLE IF EXISTS songplays_unmatched;"
+pipeline_state_table_drop = "DROP TABLE IF EXISTS pipeline_state;"
+pipeline_loaded_files_table_drop = "DROP TABLE IF EXISTS pipeline_loaded_files;"
+pipeline_partitions_table_drop = "DROP TABLE IF EXISTS pipeline_partitions;"
+agg_song_plays_table_drop = "DROP TABLE IF EXISTS agg_song_plays;"
+agg_user_plays_table_drop = "DROP TABLE IF EXISTS agg_user_plays;"
+agg_hourly_plays_table_drop = "DROP TABLE IF EXISTS agg_hourly_plays;"
 
 # CREATE TABLES
 
@@ -59,13 +97,15 @@ songplay_table_create = ("""
 CREATE TABLE songplays (
     songplay_id INT IDENTITY(0,1) PRIMARY KEY,
     start_time TIMESTAMP NOT NULL,
+    time_key TIMESTAMP NOT NULL,
     user_id INT NOT NULL,
     level VARCHAR,
     song_id VARCHAR,
     artist_id VARCHAR,
     session_id INT,
     location VARCHAR,
-    user_agent VARCHAR
+    user_agent VARCHAR,
+    load_id BIGINT
 );
 """)
 
@@ -79,6 +119,20 @@ CREATE TABLE users (
 );
 """)
 
+# SCD2 history of the users dimension, one row per level change
+user_history_table_create = ("""
+CREATE TABLE users_history (
+    user_id INT NOT NULL,
+    first_name VARCHAR,
+    last_name VARCHAR,
+    gender VARCHAR,
+    level VARCHAR,
+    valid_from TIMESTAMP NOT NULL,
+    valid_to TIMESTAMP,
+    is_current BOOLEAN NOT NULL
+);
+""")
+
 song_table_create = ("""
 CREATE TABLE songs (
     song_id VARCHAR PRIMARY KEY,
@@ -111,45 +165,336 @@ CREATE TABLE time (
 );
 """)
 
+pipeline_state_table_create = ("""
+CREATE TABLE pipeline_state (
+    name VARCHAR PRIMARY KEY,
+    value VARCHAR,
+    updated_at TIMESTAMP
+);
+""")
+
+pipeline_loaded_files_table_create = ("""
+CREATE TABLE pipeline_loaded_files (
+    s3_key VARCHAR PRIMARY KEY,
+    loaded_at TIMESTAMP NOT NULL
+);
+""")
+
+# Checkpoints of backfill.py, one row per completed partition
+pipeline_partitions_table_create = ("""
+CREATE TABLE pipeline_partitions (
+    partition_key VARCHAR PRIMARY KEY,
+    files INT NOT NULL,
+    completed_at TIMESTAMP NOT NULL
+);
+""")
+
+# Play counts for the analytics queries, maintained from the songplays delta
+# of every run (see aggregate_refresh)
+agg_song_plays_table_create = ("""
+CREATE TABLE agg_song_plays (
+    song_id VARCHAR NOT NULL,
+    artist_id VARCHAR NOT NULL,
+    play_count BIGINT NOT NULL
+);
+""")
+
+agg_user_plays_table_create = ("""
+CREATE TABLE agg_user_plays (
+    user_id INT PRIMARY KEY,
+    play_count BIGINT NOT NULL
+);
+""")
+
+agg_hourly_plays_table_create = ("""
+CREATE TABLE agg_hourly_plays (
+    hour INT NOT NULL,
+    weekday INT NOT NULL,
+    play_count BIGINT NOT NULL
+);
+""")
+
+# Normalized fixed-width key of (title, artist[, duration]) for the songplays join
+song_lookup_table_create = ("""
+CREATE TABLE song_lookup (
+    song_key CHAR(32) PRIMARY KEY,
+    song_id VARCHAR NOT NULL,
+    artist_id VARCHAR NOT NULL
+);
+""")
+
+# NextSong events without a matching song, to measure what the join loses
+songplay_unmatched_table_create = ("""
+CREATE TABLE songplays_unmatched (
+    start_time TIMESTAMP NOT NULL,
+    user_id INT,
+    level VARCHAR,
+    session_id INT,
+    location VARCHAR,
+    user_agent VARCHAR,
+    song VARCHAR,
+    artist VARCHAR,
+    length FLOAT,
+    song_key CHAR(32)
+);
+""")
+
+# Kept across drop/create so benchmark runs of different designs can be compared
+schema_profile_table_create = ("""
+CREATE TABLE IF NOT EXISTS schema_profile (
+    profile VARCHAR NOT NULL,
+    applied_at TIMESTAMP NOT NULL
+);
+""")
+
+schema_profile_insert = "INSERT INTO schema_profile (profile, applied_at) VALUES (%s, %s);"
+
+schema_profile_select = "SELECT profile FROM schema_profile ORDER BY applied_at DESC LIMIT 1;"
+
+# History of the statements applied by migrations.py, also kept across resets
+schema_migrations_table_create = ("""
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    migration_id VARCHAR(64) NOT NULL,
+    statement VARCHAR(65535) NOT NULL,
+    applied_at TIMESTAMP NOT NULL
+);
+""")
+
+schema_migrations_insert = "INSERT INTO schema_migrations (migration_id, statement, applied_at) VALUES (%s, %s, %s);"
+
+catalog_columns_select = ("""
+SELECT table_name, column_name, data_type, character_maximum_length
+FROM information_schema.columns
+WHERE table_schema = current_schema();
+""")
+
 # STAGING TABLES
 
-staging_events_copy = ("""
+staging_events_json_copy = ("""
 COPY staging_events
-FROM '{}'
-CREDENTIALS 'aws_iam_role={}'
-FORMAT AS JSON '{}'
-REGION '{}';
-""").format(config.get('S3', 'LOG_DATA'), 
-            config.get('IAM_ROLE', 'ARN'), 
-            config.get('S3', 'LOG_JSONPATH'), 
-            config.get('CLUSTER', 'REGION'))
-
-staging_songs_copy = ("""
+FROM '{source}'
+CREDENTIALS 'aws_iam_role={role}'
+FORMAT AS JSON '{jsonpath}'
+REGION '{region}';
+""")
+
+staging_songs_json_copy = ("""
 COPY staging_songs
-FROM '{}'
-CREDENTIALS 'aws_iam_role={}'
+FROM '{source}'
+CREDENTIALS 'aws_iam_role={role}'
 FORMAT AS JSON 'auto'
-REGION '{}';
-""").format(config.get('S3', 'SONG_DATA'), 
-            config.get('IAM_ROLE', 'ARN'), 
-            config.get('CLUSTER', 'REGION'))
+REGION '{region}';
+""")
+
+# Manifest COPYs load exactly the listed objects (new objects for incremental
+# loads, or the gzip parts written by manifest.py)
+staging_events_manifest_copy = ("""
+COPY staging_events
+FROM '{manifest}'
+CREDENTIALS 'aws_iam_role={role}'
+FORMAT AS JSON '{jsonpath}'
+REGION '{region}'
+MANIFEST {compression};
+""")
+
+staging_songs_manifest_copy = ("""
+COPY staging_songs
+FROM '{manifest}'
+CREDENTIALS 'aws_iam_role={role}'
+FORMAT AS JSON 'auto'
+REGION '{region}'
+MANIFEST {compression};
+""")
+
+# Parquet written by parquet_staging.py, already typed like the staging tables
+staging_events_parquet_copy = ("""
+COPY staging_events
+FROM '{source}'
+CREDENTIALS 'aws_iam_role={role}'
+FORMAT AS PARQUET;
+""")
+
+staging_songs_parquet_copy = ("""
+COPY staging_songs
+FROM '{source}'
+CREDENTIALS 'aws_iam_role={role}'
+FORMAT AS PARQUET;
+""")
+
+
+@_lazy
+def _staging_events_copy():
+    config = settings()
+    staging_format = config.get('ETL', 'STAGING_FORMAT', fallback='json')
+    if staging_format == 'parquet':
+        return staging_events_parquet_copy.format(source=config.get('S3', 'LOG_PARQUET'),
+                                                  role=config.get('IAM_ROLE', 'ARN'))
+    if staging_format == 'manifest':
+        return staging_events_manifest_copy.format(manifest=config.get('S3', 'LOG_MANIFEST'),
+                                                   role=config.get('IAM_ROLE', 'ARN'),
+                                                   jsonpath=config.get('S3', 'LOG_JSONPATH').strip("'\""),
+                                                   region=config.get('CLUSTER', 'REGION'),
+                                                   compression=_compression())
+    return staging_events_json_copy.format(source=config.get('S3', 'LOG_DATA'),
+                                           role=config.get('IAM_ROLE', 'ARN'),
+                                           jsonpath=config.get('S3', 'LOG_JSONPATH'),
+                                           region=config.get('CLUSTER', 'REGION'))
+
+
+@_lazy
+def _staging_songs_copy():
+    config = settings()
+    staging_format = config.get('ETL', 'STAGING_FORMAT', fallback='json')
+    if staging_format == 'parquet':
+        return staging_songs_parquet_copy.format(source=config.get('S3', 'SONG_PARQUET'),
+                                                 role=config.get('IAM_ROLE', 'ARN'))
+    if staging_format == 'manifest':
+        return staging_songs_manifest_copy.format(manifest=config.get('S3', 'SONG_MANIFEST'),
+                                                  role=config.get('IAM_ROLE', 'ARN'),
+                                                  region=config.get('CLUSTER', 'REGION'),
+                                                  compression=_compression())
+    return staging_songs_json_copy.format(source=config.get('S3', 'SONG_DATA'),
+                                          role=config.get('IAM_ROLE', 'ARN'),
+                                          region=config.get('CLUSTER', 'REGION'))
+
+
+def _compression():
+    return 'GZIP' if settings().getboolean('ETL', 'COMPACT', fallback=False) else ''
+
+
+staging_events_clear = "DELETE FROM staging_events;"
+staging_songs_clear = "DELETE FROM staging_songs;"
+
+# Session-private staging table; it takes precedence over the permanent one in
+# the search path, so parallel backfill workers can run the same merges
+staging_events_temp_create = "CREATE TEMP TABLE staging_events (LIKE staging_events);"
 
 # FINAL TABLES
 
-songplay_table_insert = ("""
-INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
-SELECT DISTINCT TIMESTAMP 'epoch' + (se.ts / 1000) * INTERVAL '1 second',
-       se.userId, se.level, ss.song_id, ss.artist_id, se.sessionId, se.location, se.userAgent
-FROM staging_events se
-JOIN staging_songs ss ON se.song = ss.title AND se.artist = ss.artist_name
-WHERE se.page = 'NextSong';
+# Grain of the time dimension: 'second' keeps one row per event timestamp,
+# 'minute'/'hour' truncate it so the time table and its joins get much smaller
+@_lazy
+def _TIME_GRAIN():
+    grain = settings().get('ETL', 'TIME_GRAIN', fallback='second')
+    if grain not in ('second', 'minute', 'hour'):
+        raise ValueError(f"Unknown TIME_GRAIN {grain}, expected second, minute or hour")
+    return grain
+
+
+# Builder of the time rows: 'sql' derives them from the staged events in the load and
+# merge statements, 'calendar' leaves them to time_dimension.py
+@_lazy
+def _TIME_BUILDER():
+    builder = settings().get('ETL', 'TIME_BUILDER', fallback='sql')
+    if builder not in ('sql', 'calendar'):
+        raise ValueError(f"Unknown TIME_BUILDER {builder}, expected sql or calendar")
+    if builder == 'calendar' and _TIME_GRAIN() == 'second':
+        raise ValueError("TIME_BUILDER=calendar needs TIME_GRAIN minute or hour, use the sql builder for seconds")
+    return builder
+
+
+def _time_key(timestamp):
+    """SQL expression of the time dimension key of a timestamp at TIME_GRAIN."""
+    if _TIME_GRAIN() == 'second':
+        return timestamp
+    return f"DATE_TRUNC('{_TIME_GRAIN()}', {timestamp})"
+
+
+def _song_key(title, artist, duration):
+    """SQL expression of the song lookup key, insensitive to case and surrounding whitespace."""
+    parts = [f"UPPER(TRIM({title}))", f"UPPER(TRIM({artist}))"]
+    if settings().getboolean('ETL', 'MATCH_ON_DURATION', fallback=False):
+        parts.append(f"CAST(ROUND({duration}) AS VARCHAR)")
+    return "MD5(" + " || '|' || ".join(parts) + ")"
+
+
+# Keeps the lowest song_id when several songs share a key
+@_lazy
+def _song_lookup_insert():
+    return ("""
+INSERT INTO song_lookup (song_key, song_id, artist_id)
+SELECT song_key, song_id, artist_id
+FROM (SELECT {key} AS song_key, song_id, artist_id,
+             ROW_NUMBER() OVER (PARTITION BY {key} ORDER BY song_id) AS duplicate
+      FROM staging_songs
+      WHERE title IS NOT NULL AND artist_name IS NOT NULL AND song_id IS NOT NULL) k
+WHERE duplicate = 1;
+""").format(key=_song_key('title', 'artist_name', 'duration'))
+
+
+@lru_cache(maxsize=None)
+def _staged_plays():
+    return ("""
+SELECT TIMESTAMP 'epoch' + (ts / 1000) * INTERVAL '1 second' AS start_time,
+       {time_key} AS time_key, {key} AS song_key, *
+FROM staging_events
+WHERE page = 'NextSong'
+""").format(time_key=_time_key("TIMESTAMP 'epoch' + (ts / 1000) * INTERVAL '1 second'"),
+               key=_song_key('song', 'artist', 'length'))
+
+
+# Every statement inserting into songplays tags its rows with the next load id. Writers of
+# songplays are serialized, so unlike the IDENTITY songplay_id the ids grow in commit order
+# and serve as the watermark of aggregate_refresh.
+_next_load_id = "(SELECT COALESCE(MAX(load_id), 0) + 1 FROM songplays)"
+
+
+@_lazy
+def _songplay_table_insert():
+    return ("""
+INSERT INTO songplays (start_time, time_key, user_id, level, song_id, artist_id, session_id, location, user_agent, load_id)
+SELECT DISTINCT n.start_time, n.time_key, n.userId, n.level, sl.song_id, sl.artist_id, n.sessionId, n.location, n.userAgent,
+       """ + _next_load_id + """
+FROM (""" + _staged_plays() + """) n
+JOIN song_lookup sl ON n.song_key = sl.song_key;
+""")
+
+
+@_lazy
+def _songplay_unmatched_insert():
+    return ("""
+INSERT INTO songplays_unmatched (start_time, user_id, level, session_id, location, user_agent, song, artist, length, song_key)
+SELECT n.start_time, n.userId, n.level, n.sessionId, n.location, n.userAgent, n.song, n.artist, n.length, n.song_key
+FROM (""" + _staged_plays() + """) n
+WHERE NOT EXISTS (SELECT 1 FROM song_lookup sl WHERE sl.song_key = n.song_key);
 """)
 
+
+# Both sides count distinct plays by the key the merges use, since songplays is
+# loaded with SELECT DISTINCT while songplays_unmatched keeps repeated events
+song_match_rate_select = ("""
+SELECT (SELECT COUNT(*) FROM (SELECT DISTINCT start_time, user_id, session_id FROM songplays) m),
+       (SELECT COUNT(*) FROM (SELECT DISTINCT start_time, user_id, session_id FROM songplays_unmatched) u);
+""")
+
+# One row per user with the state of the most recent event
 user_table_insert = ("""
 INSERT INTO users
-SELECT DISTINCT userId, firstName, lastName, gender, level
-FROM staging_events
-WHERE userId IS NOT NULL;
+SELECT userId, firstName, lastName, gender, level
+FROM (SELECT userId, firstName, lastName, gender, level,
+             ROW_NUMBER() OVER (PARTITION BY userId ORDER BY ts DESC) AS recency
+      FROM staging_events
+      WHERE userId IS NOT NULL) latest
+WHERE recency = 1;
+""")
+
+# Level change points of all staged events, found in one windowed pass
+_user_level_changes = """
+SELECT userId, firstName, lastName, gender, level, valid_from, previous_level
+FROM (SELECT userId, firstName, lastName, gender, level,
+             TIMESTAMP 'epoch' + (ts / 1000) * INTERVAL '1 second' AS valid_from,
+             LAG(level) OVER (PARTITION BY userId ORDER BY ts) AS previous_level
+      FROM staging_events
+      WHERE userId IS NOT NULL AND ts IS NOT NULL) e
+WHERE previous_level IS NULL OR previous_level <> level
+"""
+
+user_history_insert = ("""
+INSERT INTO users_history (user_id, first_name, last_name, gender, level, valid_from, valid_to, is_current)
+SELECT userId, firstName, lastName, gender, level, valid_from,
+       LEAD(valid_from) OVER (PARTITION BY userId ORDER BY valid_from),
+       LEAD(valid_from) OVER (PARTITION BY userId ORDER BY valid_from) IS NULL
+FROM (""" + _user_level_changes + """) c;
 """)
 
 song_table_insert = ("""
@@ -164,22 +509,473 @@ SELECT DISTINCT artist_id, artist_name, artist_location, artist_latitude, artist
 FROM staging_songs;
 """)
 
-time_table_insert = ("""
+# Adds only the time keys that are not in the dimension yet; the EXTRACTs run
+# once per distinct key instead of once per event
+@_lazy
+def _time_table_insert():
+    return ("""
 INSERT INTO time
-SELECT DISTINCT TIMESTAMP 'epoch' + (ts / 1000) * INTERVAL '1 second' AS start_time,
-       EXTRACT(hour FROM start_time),
-       EXTRACT(day FROM start_time),
-       EXTRACT(week FROM start_time),
-       EXTRACT(month FROM start_time),
-       EXTRACT(year FROM start_time),
-       EXTRACT(weekday FROM start_time)
-FROM staging_events
-WHERE ts IS NOT NULL;
+SELECT n.start_time,
+       EXTRACT(hour FROM n.start_time),
+       EXTRACT(day FROM n.start_time),
+       EXTRACT(week FROM n.start_time),
+       EXTRACT(month FROM n.start_time),
+       EXTRACT(year FROM n.start_time),
+       EXTRACT(weekday FROM n.start_time)
+FROM (SELECT DISTINCT {time_key} AS start_time
+      FROM staging_events
+      WHERE ts IS NOT NULL) n
+WHERE NOT EXISTS (SELECT 1 FROM time t WHERE t.start_time = n.start_time);
+""").format(time_key=_time_key("TIMESTAMP 'epoch' + (ts / 1000) * INTERVAL '1 second'"))
+
+
+# Time dimension key of a staged event; data_quality.py counts the distinct ones
+@_lazy
+def _staged_time_key():
+    return _time_key("TIMESTAMP 'epoch' + (ts / 1000) * INTERVAL '1 second'")
+
+
+# Fills songplays.time_key when migrations.py adds it to an existing table
+@_lazy
+def _songplay_time_key_update():
+    return "UPDATE songplays SET time_key = {} WHERE time_key IS NULL;".format(_time_key('start_time'))
+
+
+# Fills songplays.load_id when migrations.py adds it: plays the aggregates counted under the
+# former songplay_id watermark get load 0, the others load 1, which the next refresh counts
+songplay_load_id_update = ("""
+UPDATE songplays SET load_id = CASE
+    WHEN songplay_id <= COALESCE((SELECT CAST(value AS BIGINT) FROM pipeline_state
+                                  WHERE name = 'agg_songplay_id'), -1) THEN 0
+    ELSE 1 END
+WHERE load_id IS NULL;
+""")
+
+# Used by time_dimension.py to generate the calendar outside the database
+time_range_select = "SELECT MIN(ts), MAX(ts) FROM staging_events WHERE ts IS NOT NULL;"
+time_keys_select = "SELECT start_time FROM time WHERE start_time BETWEEN %s AND %s;"
+time_values_insert = "INSERT INTO time (start_time, hour, day, week, month, year, weekday) VALUES %s;"
+time_row_insert = "INSERT INTO time (start_time, hour, day, week, month, year, weekday) VALUES (%s, %s, %s, %s, %s, %s, %s);"
+
+# INCREMENTAL MERGES
+# Run in one transaction after staging only the new objects; every statement
+# replaces or skips rows that already exist, so a re-run does not duplicate.
+
+song_table_merge = ("""
+DELETE FROM songs USING staging_songs WHERE songs.song_id = staging_songs.song_id;
+INSERT INTO songs
+SELECT DISTINCT song_id, title, artist_id, year, duration
+FROM staging_songs;
+""")
+
+artist_table_merge = ("""
+DELETE FROM artists USING staging_songs WHERE artists.artist_id = staging_songs.artist_id;
+INSERT INTO artists
+SELECT DISTINCT artist_id, artist_name, artist_location, artist_latitude, artist_longitude
+FROM staging_songs;
+""")
+
+# Replaces only the users whose newest staged event is not older than their latest
+# stored play, so a late-arriving older log object cannot overwrite the current level
+user_table_merge = ("""
+DELETE FROM users
+USING (SELECT s.userId
+       FROM (SELECT userId, TIMESTAMP 'epoch' + (last_ts / 1000) * INTERVAL '1 second' AS staged_at
+             FROM (SELECT userId, MAX(ts) AS last_ts
+                   FROM staging_events
+                   WHERE userId IS NOT NULL
+                   GROUP BY userId) m) s
+       LEFT JOIN (SELECT user_id, MAX(start_time) AS stored_at
+                  FROM (SELECT user_id, start_time FROM songplays
+                        UNION ALL
+                        SELECT user_id, start_time FROM songplays_unmatched) p
+                  GROUP BY user_id) p ON p.user_id = s.userId
+       WHERE p.stored_at IS NULL OR s.staged_at >= p.stored_at) newer
+WHERE users.user_id = newer.userId;
+INSERT INTO users
+SELECT userId, firstName, lastName, gender, level
+FROM (SELECT userId, firstName, lastName, gender, level,
+             ROW_NUMBER() OVER (PARTITION BY userId ORDER BY ts DESC) AS recency
+      FROM staging_events
+      WHERE userId IS NOT NULL) latest
+WHERE recency = 1
+  AND NOT EXISTS (SELECT 1 FROM users WHERE users.user_id = latest.userId);
+""")
+
+# Adds the staged change points that differ from the current version, then
+# recomputes the validity intervals of the touched users
+user_history_merge = ("""
+INSERT INTO users_history (user_id, first_name, last_name, gender, level, valid_from, valid_to, is_current)
+SELECT c.userId, c.firstName, c.lastName, c.gender, c.level, c.valid_from, NULL, FALSE
+FROM (""" + _user_level_changes + """) c
+LEFT JOIN users_history h ON h.user_id = c.userId AND h.is_current
+WHERE (c.previous_level IS NOT NULL OR h.level IS NULL OR h.level <> c.level)
+  AND NOT EXISTS (SELECT 1 FROM users_history x WHERE x.user_id = c.userId AND x.valid_from = c.valid_from);
+UPDATE users_history
+SET valid_to = n.next_from, is_current = n.next_from IS NULL
+FROM (SELECT user_id, valid_from,
+             LEAD(valid_from) OVER (PARTITION BY user_id ORDER BY valid_from) AS next_from
+      FROM users_history
+      WHERE user_id IN (SELECT DISTINCT userId FROM staging_events)) n
+WHERE users_history.user_id = n.user_id AND users_history.valid_from = n.valid_from;
+""")
+
+
+@_lazy
+def _time_table_merge():
+    return _time_table_insert()
+
+
+@_lazy
+def _song_lookup_merge():
+    return ("""
+DELETE FROM song_lookup USING staging_songs
+WHERE song_lookup.song_key = {key};
+""").format(key=_song_key('staging_songs.title', 'staging_songs.artist_name', 'staging_songs.duration')) + \
+        _song_lookup_insert()
+
+
+# Plays are matched against song_lookup, which also holds the songs of earlier runs.
+# Previously unmatched plays are matched again, since their song may have arrived now.
+@_lazy
+def _songplay_table_merge():
+    return ("""
+INSERT INTO songplays (start_time, time_key, user_id, level, song_id, artist_id, session_id, location, user_agent, load_id)
+SELECT DISTINCT n.start_time, n.time_key, n.userId, n.level, sl.song_id, sl.artist_id, n.sessionId, n.location, n.userAgent,
+       """ + _next_load_id + """
+FROM (""" + _staged_plays() + """) n
+JOIN song_lookup sl ON n.song_key = sl.song_key
+WHERE NOT EXISTS (SELECT 1 FROM songplays sp
+                  WHERE sp.start_time = n.start_time
+                    AND sp.user_id = n.userId
+                    AND sp.session_id = n.sessionId);
+INSERT INTO songplays_unmatched (start_time, user_id, level, session_id, location, user_agent, song, artist, length, song_key)
+SELECT n.start_time, n.userId, n.level, n.sessionId, n.location, n.userAgent, n.song, n.artist, n.length, n.song_key
+FROM (""" + _staged_plays() + """) n
+WHERE NOT EXISTS (SELECT 1 FROM song_lookup sl WHERE sl.song_key = n.song_key)
+  AND NOT EXISTS (SELECT 1 FROM songplays_unmatched u
+                  WHERE u.start_time = n.start_time
+                    AND u.user_id = n.userId
+                    AND u.session_id = n.sessionId);
+INSERT INTO songplays (start_time, time_key, user_id, level, song_id, artist_id, session_id, location, user_agent, load_id)
+SELECT DISTINCT u.start_time, """ + _time_key('u.start_time') + """, u.user_id, u.level, sl.song_id, sl.artist_id, u.session_id, u.location, u.user_agent,
+       """ + _next_load_id + """
+FROM songplays_unmatched u
+JOIN song_lookup sl ON u.song_key = sl.song_key
+WHERE NOT EXISTS (SELECT 1 FROM songplays sp
+                  WHERE sp.start_time = u.start_time
+                    AND sp.user_id = u.user_id
+                    AND sp.session_id = u.session_id);
+DELETE FROM songplays_unmatched USING song_lookup
+WHERE songplays_unmatched.song_key = song_lookup.song_key;
 """)
 
+
+pipeline_state_select = "SELECT value FROM pipeline_state WHERE name = %s;"
+pipeline_state_upsert = ("""
+DELETE FROM pipeline_state WHERE name = %(name)s;
+INSERT INTO pipeline_state (name, value, updated_at) VALUES (%(name)s, %(value)s, %(updated_at)s);
+""")
+pipeline_loaded_files_select = "SELECT s3_key FROM pipeline_loaded_files;"
+pipeline_loaded_files_insert = "INSERT INTO pipeline_loaded_files (s3_key, loaded_at) VALUES %s;"
+pipeline_partitions_select = "SELECT partition_key FROM pipeline_partitions;"
+pipeline_partitions_upsert = ("""
+DELETE FROM pipeline_partitions WHERE partition_key = %(partition_key)s;
+INSERT INTO pipeline_partitions (partition_key, files, completed_at) VALUES (%(partition_key)s, %(files)s, %(completed_at)s);
+""")
+
+# AGGREGATES
+# Adds the plays of the loads after the last counted load_id to the aggregate
+# tables and moves that watermark, all in the transaction of the load.
+
+AGGREGATE_WATERMARK = "agg_load_id"
+
+_songplays_delta = """
+FROM songplays
+WHERE load_id > COALESCE((SELECT CAST(value AS BIGINT) FROM pipeline_state
+                          WHERE name = '""" + AGGREGATE_WATERMARK + """'), 0)
+"""
+
+aggregate_refresh = ("""
+UPDATE agg_song_plays SET play_count = agg_song_plays.play_count + d.plays
+FROM (SELECT song_id, artist_id, COUNT(*) AS plays""" + _songplays_delta + """GROUP BY song_id, artist_id) d
+WHERE agg_song_plays.song_id = d.song_id AND agg_song_plays.artist_id = d.artist_id;
+INSERT INTO agg_song_plays (song_id, artist_id, play_count)
+SELECT d.song_id, d.artist_id, d.plays
+FROM (SELECT song_id, artist_id, COUNT(*) AS plays""" + _songplays_delta + """GROUP BY song_id, artist_id) d
+WHERE NOT EXISTS (SELECT 1 FROM agg_song_plays g WHERE g.song_id = d.song_id AND g.artist_id = d.artist_id);
+UPDATE agg_user_plays SET play_count = agg_user_plays.play_count + d.plays
+FROM (SELECT user_id, COUNT(*) AS plays""" + _songplays_delta + """GROUP BY user_id) d
+WHERE agg_user_plays.user_id = d.user_id;
+INSERT INTO agg_user_plays (user_id, play_count)
+SELECT d.user_id, d.plays
+FROM (SELECT user_id, COUNT(*) AS plays""" + _songplays_delta + """GROUP BY user_id) d
+WHERE NOT EXISTS (SELECT 1 FROM agg_user_plays g WHERE g.user_id = d.user_id);
+UPDATE agg_hourly_plays SET play_count = agg_hourly_plays.play_count + d.plays
+FROM (SELECT EXTRACT(hour FROM start_time) AS hour, EXTRACT(weekday FROM start_time) AS weekday,
+             COUNT(*) AS plays""" + _songplays_delta + """GROUP BY 1, 2) d
+WHERE agg_hourly_plays.hour = d.hour AND agg_hourly_plays.weekday = d.weekday;
+INSERT INTO agg_hourly_plays (hour, weekday, play_count)
+SELECT d.hour, d.weekday, d.plays
+FROM (SELECT EXTRACT(hour FROM start_time) AS hour, EXTRACT(weekday FROM start_time) AS weekday,
+             COUNT(*) AS plays""" + _songplays_delta + """GROUP BY 1, 2) d
+WHERE NOT EXISTS (SELECT 1 FROM agg_hourly_plays g WHERE g.hour = d.hour AND g.weekday = d.weekday);
+DELETE FROM pipeline_state WHERE name = '""" + AGGREGATE_WATERMARK + """';
+INSERT INTO pipeline_state (name, value, updated_at)
+SELECT '""" + AGGREGATE_WATERMARK + """', CAST(MAX(load_id) AS VARCHAR), GETDATE()
+FROM songplays;
+""")
+
+aggregate_watermark_select = ("""
+SELECT (SELECT CAST(value AS BIGINT) FROM pipeline_state WHERE name = '""" + AGGREGATE_WATERMARK + """'),
+       (SELECT MAX(load_id) FROM songplays);
+""")
+
+# The analytics questions answered from the aggregate tables
+top_songs_agg_select = ("""
+SELECT s.title, a.name as artist, CAST(SUM(g.play_count) AS BIGINT) as play_count
+FROM agg_song_plays g
+JOIN songs s ON g.song_id = s.song_id
+JOIN artists a ON g.artist_id = a.artist_id
+GROUP BY s.title, a.name
+ORDER BY play_count DESC
+LIMIT 10;
+""")
+
+most_active_users_agg_select = ("""
+SELECT u.user_id, u.first_name, u.last_name, g.play_count as song_count
+FROM agg_user_plays g
+JOIN users u ON g.user_id = u.user_id
+ORDER BY song_count DESC
+LIMIT 10;
+""")
+
+plays_by_hour_agg_select = ("""
+SELECT hour, CAST(SUM(play_count) AS BIGINT) as play_count
+FROM agg_hourly_plays
+GROUP BY hour
+ORDER BY play_count DESC;
+""")
+
+plays_by_weekday_agg_select = ("""
+SELECT
+    CASE weekday
+        WHEN 0 THEN 'Sunday'
+        WHEN 1 THEN 'Monday'
+        WHEN 2 THEN 'Tuesday'
+        WHEN 3 THEN 'Wednesday'
+        WHEN 4 THEN 'Thursday'
+        WHEN 5 THEN 'Friday'
+        WHEN 6 THEN 'Saturday'
+    END as day_of_week,
+    CAST(SUM(play_count) AS BIGINT) as play_count
+FROM agg_hourly_plays
+GROUP BY weekday
+ORDER BY play_count DESC;
+""")
+
+plays_by_level_agg_select = ("""
+SELECT u.level, COUNT(*) as user_count, CAST(SUM(g.play_count) AS BIGINT) as play_count
+FROM agg_user_plays g
+JOIN users u ON g.user_id = u.user_id
+GROUP BY u.level;
+""")
+
+# Parameterized variants for analytics.py; a level filter needs songplays,
+# since the aggregates do not split by level
+top_songs_limit_select = top_songs_agg_select.replace("LIMIT 10", "LIMIT %(n)s")
+most_active_users_limit_select = most_active_users_agg_select.replace("LIMIT 10", "LIMIT %(n)s")
+
+plays_by_hour_level_select = ("""
+SELECT t.hour, COUNT(*) as play_count
+FROM songplays sp
+JOIN time t ON sp.time_key = t.start_time
+WHERE sp.level = %(level)s
+GROUP BY t.hour
+ORDER BY play_count DESC;
+""")
+
+plays_by_weekday_level_select = ("""
+SELECT
+    CASE t.weekday
+        WHEN 0 THEN 'Sunday'
+        WHEN 1 THEN 'Monday'
+        WHEN 2 THEN 'Tuesday'
+        WHEN 3 THEN 'Wednesday'
+        WHEN 4 THEN 'Thursday'
+        WHEN 5 THEN 'Friday'
+        WHEN 6 THEN 'Saturday'
+    END as day_of_week,
+    COUNT(*) as play_count
+FROM songplays sp
+JOIN time t ON sp.time_key = t.start_time
+WHERE sp.level = %(level)s
+GROUP BY t.weekday
+ORDER BY play_count DESC;
+""")
+
+# Changes with every load, since each one rewrites the aggregate watermark
+last_load_select = "SELECT MAX(updated_at) FROM pipeline_state;"
+
+# EXPORT (export.py); UNLOAD takes the SELECT as a quoted string literal
+table_unload = ("""
+UNLOAD ('{select}')
+TO '{target}'
+CREDENTIALS 'aws_iam_role={role}'
+FORMAT AS PARQUET
+{partition}
+MAXFILESIZE 256 MB
+ALLOWOVERWRITE;
+""")
+
+unload_count_select = "SELECT pg_last_unload_count();"
+
+# ANALYTICS QUERIES (README examples)
+
+top_songs_select = ("""
+SELECT s.title, a.name as artist, COUNT(*) as play_count
+FROM songplays sp
+JOIN songs s ON sp.song_id = s.song_id
+JOIN artists a ON sp.artist_id = a.artist_id
+GROUP BY s.title, a.name
+ORDER BY play_count DESC
+LIMIT 10;
+""")
+
+most_active_users_select = ("""
+SELECT u.user_id, u.first_name, u.last_name, COUNT(*) as song_count
+FROM songplays sp
+JOIN users u ON sp.user_id = u.user_id
+GROUP BY u.user_id, u.first_name, u.last_name
+ORDER BY song_count DESC
+LIMIT 10;
+""")
+
+plays_by_hour_select = ("""
+SELECT t.hour, COUNT(*) as play_count
+FROM songplays sp
+JOIN time t ON sp.time_key = t.start_time
+GROUP BY t.hour
+ORDER BY play_count DESC;
+""")
+
+plays_by_weekday_select = ("""
+SELECT
+    CASE t.weekday
+        WHEN 0 THEN 'Sunday'
+        WHEN 1 THEN 'Monday'
+        WHEN 2 THEN 'Tuesday'
+        WHEN 3 THEN 'Wednesday'
+        WHEN 4 THEN 'Thursday'
+        WHEN 5 THEN 'Friday'
+        WHEN 6 THEN 'Saturday'
+    END as day_of_week,
+    COUNT(*) as play_count
+FROM songplays sp
+JOIN time t ON sp.time_key = t.start_time
+GROUP BY t.weekday
+ORDER BY play_count DESC;
+""")
+
+plays_by_level_select = ("""
+SELECT u.level, COUNT(DISTINCT u.user_id) as user_count, COUNT(*) as play_count
+FROM songplays sp
+JOIN users u ON sp.user_id = u.user_id
+GROUP BY u.level;
+""")
+
+# Fallbacks of top_songs_limit_select/most_active_users_limit_select while the aggregates are behind
+top_songs_songplays_limit_select = top_songs_select.replace("LIMIT 10", "LIMIT %(n)s")
+most_active_users_songplays_limit_select = most_active_users_select.replace("LIMIT 10", "LIMIT %(n)s")
+
 # QUERY LISTS
 
-create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
-drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
-copy_table_queries = [staging_events_copy, staging_songs_copy]
-insert_table_queries = [songplay_table_insert, user_table_insert, song_table_insert, artist_table_insert, time_table_insert]
+create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create,
+                        user_history_table_create, song_lookup_table_create, songplay_unmatched_table_create,
+                        pipeline_state_table_create, pipeline_loaded_files_table_create, pipeline_partitions_table_create,
+                        agg_song_plays_table_create, agg_user_plays_table_create, agg_hourly_plays_table_create]
+drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop,
+                      user_history_table_drop, song_lookup_table_drop, songplay_unmatched_table_drop,
+                      pipeline_state_table_drop, pipeline_loaded_files_table_drop, pipeline_partitions_table_drop,
+                      agg_song_plays_table_drop, agg_user_plays_table_drop, agg_hourly_plays_table_drop]
+
+# A full load (LOAD_MODE=full) replaces the contents of these tables, so running it
+# again on migrated (not recreated) tables does not append the same rows twice
+full_load_clear_queries = [f"DELETE FROM {table};" for table in (
+    "staging_events", "staging_songs", "song_lookup", "songplays", "songplays_unmatched", "users", "users_history",
+    "songs", "artists", "time", "agg_song_plays", "agg_user_plays", "agg_hourly_plays")] + \
+    ["DELETE FROM pipeline_state WHERE name = '" + AGGREGATE_WATERMARK + "';"]
+
+
+@_lazy
+def _copy_table_queries():
+    return [_staging_events_copy(), _staging_songs_copy()]
+
+
+@_lazy
+def _insert_table_queries():
+    queries = [_song_lookup_insert(), _songplay_table_insert(), _songplay_unmatched_insert(), user_table_insert,
+               song_table_insert, artist_table_insert, _time_table_insert()]
+    if settings().getboolean('ETL', 'USERS_SCD2', fallback=False):
+        queries.append(user_history_insert)
+    # The aggregates count the plays of the statements above, so they come last
+    queries.append(aggregate_refresh)
+    # With the calendar builder, time_dimension.py fills the time table after the inserts
+    if _TIME_BUILDER() == 'calendar':
+        queries.remove(_time_table_insert())
+    return queries
+
+
+@_lazy
+def _song_merge_queries():
+    return [song_table_merge, artist_table_merge, _song_lookup_merge()]
+
+
+@_lazy
+def _event_merge_queries():
+    queries = [user_table_merge, _songplay_table_merge()]
+    # With the calendar builder, incremental.py and backfill.py run time_dimension.py after the merges
+    if _TIME_BUILDER() == 'sql':
+        queries.insert(1, _time_table_merge())
+    if settings().getboolean('ETL', 'USERS_SCD2', fallback=False):
+        queries.append(user_history_merge)
+    queries.append(aggregate_refresh)
+    return queries
+
+
+@_lazy
+def _merge_table_queries():
+    return _song_merge_queries() + _event_merge_queries()
+
+
+@_lazy
+def _config():
+    return settings()
+
+analytics_queries = {
+    "top_songs": top_songs_select,
+    "most_active_users": most_active_users_select,
+    "plays_by_hour": plays_by_hour_select,
+    "plays_by_weekday": plays_by_weekday_select,
+    "plays_by_level": plays_by_level_select,
+}
+
+aggregate_queries = {
+    "top_songs": top_songs_agg_select,
+    "most_active_users": most_active_users_agg_select,
+    "plays_by_hour": plays_by_hour_agg_select,
+    "plays_by_weekday": plays_by_weekday_agg_select,
+    "plays_by_level": plays_by_level_agg_select,
+}
+
+
+def __getattr__(name):
+    """Builds the queries that depend on dwh.cfg on first access (see _lazy)."""
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = globals()[name] = _LAZY[name]()
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
@@ -0,0 +1,98 @@
+import configparser
+import threading
+import time
+
+import pytest
+
+from backfill import UNDATED, Backfill, MergeOrder, partition_key, plan_partitions
+
+LOG = "s3://udacity-dend/log_data"
+
+
+def test_partition_key_by_day_and_month():
+    url = f"{LOG}/2018/11/2018-11-05-events.json"
+    assert partition_key(url) == "2018-11-05"
+    assert partition_key(url, by="month") == "2018-11"
+    assert partition_key(f"{LOG}/2018/11/other.json") == "2018-11"
+    assert partition_key(f"{LOG}/events.json") == UNDATED
+
+
+def test_plan_partitions_orders_by_date():
+    urls = [f"{LOG}/2018/12/2018-12-01-events.json", f"{LOG}/2018/11/2018-11-30-events.json",
+            f"{LOG}/2018/11/2018-11-02-events.json"]
+    assert list(plan_partitions(urls)) == ["2018-11-02", "2018-11-30", "2018-12-01"]
+    by_month = plan_partitions(urls, by="month")
+    assert list(by_month) == ["2018-11", "2018-12"]
+    assert by_month["2018-11"] == [urls[1], urls[2]]
+
+
+def test_merge_order_lets_partitions_merge_in_order():
+    order, merged = MergeOrder(), []
+
+    def merge(index):
+        order.wait(index)
+        merged.append(index)
+        order.done(index)
+
+    # Started in reverse, the workers still merge 0, 1, 2, 3
+    threads = [threading.Thread(target=merge, args=(index,)) for index in reversed(range(4))]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join(timeout=5)
+    assert merged == [0, 1, 2, 3]
+
+
+def test_merge_order_stops_partitions_after_failure():
+    order = MergeOrder()
+    order.done(0)
+    order.fail(1)
+    assert not order.stopped(1)
+    assert order.stopped(2) and order.stopped(5)
+    with pytest.raises(RuntimeError, match="partition 2 failed"):
+        order.wait(2)
+    with pytest.raises(RuntimeError):
+        order.check(3)
+
+
+def test_merge_order_wakes_waiting_partitions_on_failure():
+    order, errors = MergeOrder(), []
+
+    def merge(index):
+        try:
+            order.wait(index)
+        except RuntimeError as e:
+            errors.append(e)
+
+    waiting = threading.Thread(target=merge, args=(2,))
+    waiting.start()
+    order.fail(0)
+    waiting.join(timeout=5)
+    assert not waiting.is_alive() and len(errors) == 1
+
+
+class FailingS3:
+    def put_object(self, **params):
+        raise AssertionError("a stopped partition must not write its manifest")
+
+
+class IdleConnection:
+    def cursor(self):
+        return None
+
+    def rollback(self):
+        pass
+
+
+def test_stopped_partition_is_not_staged():
+    config = configparser.ConfigParser()
+    config.read_dict({"S3": {"LOG_DATA": LOG, "SONG_DATA": "s3://udacity-dend/song_data",
+                             "MANIFEST_PREFIX": "s3://bucket/manifests", "LOG_JSONPATH": "s3://bucket/paths.json"},
+                      "IAM_ROLE": {"ARN": "arn:aws:iam::123456789012:role/r"}, "CLUSTER": {"REGION": "us-west-2"}})
+    backfill = Backfill({}, config, FailingS3())
+    backfill._connection = IdleConnection
+    order = MergeOrder()
+    order.fail(0)
+    with pytest.raises(RuntimeError, match="Stopped"):
+        backfill.load_partition(1, "2018-11-02", [f"{LOG}/2018/11/2018-11-02-events.json"], order)
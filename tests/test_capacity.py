@@ -0,0 +1,162 @@
+import configparser
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from capacity import GB, CapacityManager, choose_size, managed_run
+
+IDENTIFIER = "sparkify-test"
+ROLE_NAME = "dwhRedshiftRole"
+
+
+@pytest.fixture
+def managed_policies(monkeypatch):
+    # Die S3ReadOnlyAccess-Policy gibt es in moto nur mit geladenen AWS-Policies; vor mock_aws setzen
+    monkeypatch.setenv("MOTO_IAM_LOAD_MANAGED_POLICIES", "true")
+
+
+@pytest.fixture
+def redshift():
+    with mock_aws():
+        client = boto3.client("redshift", region_name="us-west-2")
+        client.create_cluster(ClusterIdentifier=IDENTIFIER, ClusterType="multi-node", NodeType="dc2.large",
+                              NumberOfNodes=2, MasterUsername="dwhuser", MasterUserPassword="Passw0rd")
+        yield client
+
+
+@pytest.fixture
+def manager(redshift):
+    return CapacityManager(redshift, IDENTIFIER, sleep=lambda seconds: None)
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    # restore_cluster schreibt Endpoint und Rolle in die dwh.cfg des Arbeitsverzeichnisses
+    monkeypatch.chdir(tmp_path)
+    config = configparser.ConfigParser()
+    config.read_dict({"CLUSTER": {"HOST": ""}, "IAM_ROLE": {"ARN": ""}, "DWH": {"DWH_IAM_ROLE_NAME": ROLE_NAME},
+                      "CAPACITY": {"PAUSE_AFTER_RUN": "true"}})
+    with open("dwh.cfg", "w") as f:
+        config.write(f)
+    return config
+
+
+def test_choose_size_small_load_takes_cheapest_minimum():
+    assert choose_size(1 * GB) == {"node_type": "dc2.large", "nodes": 2, "slices": 4, "hourly_cost": 0.5}
+
+
+def test_choose_size_adds_nodes_for_slices():
+    # 40 GB bei 8 GB pro Slice: 5 Slices, also 3 dc2.large-Knoten mit je 2 Slices
+    plan = choose_size(40 * GB)
+    assert (plan["node_type"], plan["nodes"], plan["slices"]) == ("dc2.large", 3, 6)
+
+
+def test_choose_size_switches_node_type_when_max_nodes_are_too_few():
+    plan = choose_size(500 * GB)
+    assert plan["slices"] * 8 * GB >= 500 * GB
+    assert plan["node_type"] == "dc2.8xlarge" and plan["nodes"] <= 8
+
+
+def test_choose_size_falls_back_to_most_slices():
+    plan = choose_size(5000 * GB)
+    assert (plan["node_type"], plan["nodes"], plan["slices"]) == ("dc2.8xlarge", 8, 128)
+
+
+def test_choose_size_rejects_load_no_cluster_stores():
+    with pytest.raises(ValueError):
+        choose_size(10 ** 6 * GB)
+
+
+def test_pause_and_resume(manager):
+    assert manager.pause()["ClusterStatus"] == "paused"
+    assert manager.describe()["ClusterStatus"] == "paused"
+    assert manager.resume()["ClusterStatus"] == "available"
+    assert set(manager.timings.steps) >= {"Pausieren", "Fortsetzen"}
+    assert manager.costs["Pausieren"] >= 0
+
+
+def test_pause_is_idempotent(manager, redshift):
+    manager.pause()
+    redshift.pause_cluster = None  # ein zweiter Aufruf würde fehlschlagen
+    assert manager.pause()["ClusterStatus"] == "paused"
+
+
+def test_snapshot_is_latest(manager):
+    first = manager.snapshot("sparkify-test-first")
+    assert manager.latest_snapshot() == first
+    second = manager.snapshot()
+    assert second.startswith(f"{IDENTIFIER}-manual-")
+    # moto vergibt die Erstellungszeiten mikrosekundengenau, der zweite Snapshot ist also jünger
+    assert manager.latest_snapshot() == second
+
+
+def test_retire_and_restore(manager):
+    manager.snapshot("sparkify-test-before")
+    final = manager.retire()
+    assert final.startswith(f"{IDENTIFIER}-final-")
+    assert manager.describe() is None
+
+    cluster = manager.restore("sparkify-test-before", iam_roles=["arn:aws:iam::123456789012:role/r"])
+    assert cluster["ClusterStatus"] == "available"
+    assert [role["IamRoleArn"] for role in cluster["IamRoles"]] == ["arn:aws:iam::123456789012:role/r"]
+
+
+def test_restore_without_snapshot_fails(manager, redshift):
+    redshift.delete_cluster(ClusterIdentifier=IDENTIFIER, SkipFinalClusterSnapshot=True)
+    with pytest.raises(RuntimeError):
+        manager.restore()
+
+
+def test_resize_waits_for_target_size(manager, redshift):
+    # moto kennt kein resize_cluster; die neue Größe erscheint erst nach einigen Statusabfragen
+    describe, calls = manager.describe, []
+
+    def delayed_describe():
+        calls.append(None)
+        if len(calls) == 3:
+            redshift.modify_cluster(ClusterIdentifier=IDENTIFIER, ClusterType="multi-node",
+                                    NodeType="ra3.xlplus", NumberOfNodes=4)
+        return describe()
+
+    manager.describe = delayed_describe
+    redshift.resize_cluster = lambda **params: None
+    cluster = manager.resize("ra3.xlplus", 4)
+    assert (cluster["NodeType"], cluster["NumberOfNodes"]) == ("ra3.xlplus", 4)
+    assert len(calls) == 3
+
+
+def test_resize_and_resume_without_cluster_fail(manager, redshift):
+    redshift.delete_cluster(ClusterIdentifier=IDENTIFIER, SkipFinalClusterSnapshot=True)
+    assert manager.pause() is None
+    with pytest.raises(RuntimeError, match="existiert nicht"):
+        manager.resize("dc2.large", 4)
+    with pytest.raises(RuntimeError, match="existiert nicht"):
+        manager.resume()
+
+
+def test_resize_to_current_size_does_nothing(manager, redshift):
+    redshift.resize_cluster = None
+    assert manager.resize("dc2.large", 2)["NumberOfNodes"] == 2
+
+
+def test_managed_run_resumes_and_pauses(manager, config):
+    manager.pause()
+    with managed_run(manager, config) as cluster:
+        assert cluster["ClusterStatus"] == "available"
+    assert manager.describe()["ClusterStatus"] == "paused"
+
+
+def test_managed_run_restores_with_role(managed_policies, manager, config):
+    manager.snapshot()
+    manager.retire()
+    iam = boto3.client("iam", region_name="us-east-1")
+    with managed_run(manager, config, iam=iam) as cluster:
+        role_arn = iam.get_role(RoleName=ROLE_NAME)["Role"]["Arn"]
+        assert [role["IamRoleArn"] for role in cluster["IamRoles"]] == [role_arn]
+    policies = iam.list_attached_role_policies(RoleName=ROLE_NAME)["AttachedPolicies"]
+    assert [policy["PolicyName"] for policy in policies] == ["AmazonS3ReadOnlyAccess"]
+    written = configparser.ConfigParser()
+    written.read("dwh.cfg")
+    assert written.get("IAM_ROLE", "ARN") == config.get("IAM_ROLE", "ARN") == role_arn
+    assert written.get("CLUSTER", "HOST") == cluster["Endpoint"]["Address"]
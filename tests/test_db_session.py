@@ -0,0 +1,39 @@
+import psycopg2
+import pytest
+
+import db_session
+from db_session import Session
+
+
+@pytest.fixture
+def unreachable(monkeypatch):
+    attempts = []
+
+    def connect(**params):
+        attempts.append(params)
+        raise psycopg2.OperationalError("could not connect to server")
+
+    monkeypatch.setattr(db_session.psycopg2, "connect", connect)
+    monkeypatch.setattr(db_session.time, "sleep", lambda seconds: None)
+    return attempts
+
+
+def test_connect_retries_transient_errors(unreachable):
+    session = Session({"host": "nowhere"}, retries=2)
+    with pytest.raises(psycopg2.OperationalError):
+        session.connect()
+    assert len(unreachable) == 3
+
+
+def test_execute_does_not_multiply_retries(unreachable):
+    session = Session({"host": "nowhere"}, retries=2)
+    with pytest.raises(psycopg2.OperationalError):
+        session.execute("SELECT 1;")
+    assert len(unreachable) == 3
+
+
+def test_connect_without_retry_tries_once(unreachable):
+    session = Session({"host": "nowhere"}, retries=2)
+    with pytest.raises(psycopg2.OperationalError):
+        session.connect(retry=False)
+    assert len(unreachable) == 1
@@ -0,0 +1,132 @@
+import configparser
+import os
+
+import pytest
+
+import data_quality
+import sql_queries
+from analytics import Analytics
+from create_tables import create_or_migrate
+from duckdb_backend import DuckDBSession, _same_but_ties
+from etl import load
+from generate_data import generate
+from sparkify import Pipeline
+from sql_queries import aggregate_queries, analytics_queries
+
+REPO_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dwh.cfg")
+TABLES = ("staging_events", "staging_songs", "songplays", "songplays_unmatched", "users", "songs", "artists", "time")
+
+
+@pytest.fixture(scope="module")
+def data(tmp_path_factory):
+    return generate(str(tmp_path_factory.mktemp("data")), scale=0.05, seed=7)
+
+
+@pytest.fixture
+def config(data, tmp_path):
+    # The [S3] sources stay as in dwh.cfg; DuckDBSession maps them onto the generated [LOCAL] files
+    config = configparser.ConfigParser()
+    config.read(REPO_CONFIG)
+    config.read_dict({
+        "ETL": {"BACKEND": "duckdb", "MAX_CONCURRENCY": "1", "REPORT_DIR": str(tmp_path / "reports")},
+        "DUCKDB": {"DATABASE": str(tmp_path / "sparkify.duckdb")},
+        "LOCAL": {"LOG_DATA": os.path.join(data, "log_data"), "SONG_DATA": os.path.join(data, "song_data"),
+                  "LOG_JSONPATH": os.path.join(data, "log_json_path.json")},
+    })
+    sql_queries.use_settings(config)
+    return config
+
+
+@pytest.fixture
+def session(config):
+    session = DuckDBSession.from_config(config)
+    yield session
+    session.close()
+
+
+def counts(session):
+    return {table: session.execute(f"SELECT COUNT(*) FROM {table};", fetch=True)[0][0] for table in TABLES}
+
+
+def source_records(path):
+    records = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            with open(os.path.join(root, name)) as f:
+                records += sum(1 for line in f if line.strip())
+    return records
+
+
+def test_full_load_fills_every_table(config, session, data):
+    create_or_migrate(session, config, "duckdb")
+    recorder = load(session, config)
+    assert recorder.report()["success"]
+
+    loaded = counts(session)
+    assert loaded["staging_events"] == source_records(os.path.join(data, "log_data"))
+    assert loaded["staging_songs"] == source_records(os.path.join(data, "song_data"))
+    next_songs = session.execute("SELECT COUNT(*) FROM staging_events WHERE page = 'NextSong';", fetch=True)[0][0]
+    assert 0 < loaded["songplays"] and loaded["songplays"] + loaded["songplays_unmatched"] <= next_songs
+    assert all(loaded[table] > 0 for table in ("users", "songs", "artists", "time"))
+    rows = {statement["name"]: statement["rows"] for statement in recorder.report()["statements"]}
+    assert rows["copy staging_events"] == loaded["staging_events"]
+    assert rows["insert songplays"] == loaded["songplays"]
+
+
+def test_second_full_load_does_not_duplicate(config, session):
+    create_or_migrate(session, config, "duckdb")
+    load(session, config)
+    first = counts(session)
+    create_or_migrate(session, config, "duckdb")
+    load(session, config)
+    assert counts(session) == first
+    duplicates = session.execute("SELECT COUNT(*) FROM (SELECT start_time, user_id, session_id FROM songplays "
+                                 "GROUP BY 1, 2, 3 HAVING COUNT(*) > 1) d;", fetch=True)[0][0]
+    assert duplicates == 0
+
+
+def test_analytics_match_aggregates(config, session):
+    create_or_migrate(session, config, "duckdb")
+    load(session, config)
+    songplays = counts(session)["songplays"]
+
+    by_level = session.execute(analytics_queries["plays_by_level"], fetch=True)
+    assert sum(row[-1] for row in by_level) == songplays
+    by_hour = session.execute(analytics_queries["plays_by_hour"], fetch=True)
+    assert sum(row[-1] for row in by_hour) == songplays and all(0 <= row[0] < 24 for row in by_hour)
+    # The top-10 queries may pick different rows among those tied at the cut
+    for name, query in analytics_queries.items():
+        raw, aggregated = session.execute(query, fetch=True), session.execute(aggregate_queries[name], fetch=True)
+        assert sorted(raw) == sorted(aggregated) or _same_but_ties(raw, aggregated), name
+
+
+def test_analytics_fall_back_while_aggregates_are_behind(config, session):
+    create_or_migrate(session, config, "duckdb")
+    load(session, config)
+    analytics = Analytics.from_config(session, config)
+    assert analytics.dialect == "duckdb"
+    assert analytics.plays_by_level() == session.execute(aggregate_queries["plays_by_level"], fetch=True)
+
+    # A play added by hand carries a newer load_id than the aggregates counted
+    session.execute("INSERT INTO songplays (start_time, time_key, user_id, level, song_id, artist_id, session_id, "
+                    "load_id) SELECT start_time, time_key, user_id, level, song_id, artist_id, session_id + 1000, "
+                    "load_id + 1 FROM songplays LIMIT 1;")
+    plays = Analytics.from_config(session, config).plays_by_level()
+    assert sum(row[-1] for row in plays) == counts(session)["songplays"]
+    aggregated = session.execute(aggregate_queries["plays_by_level"], fetch=True)
+    assert sum(row[-1] for row in aggregated) == counts(session)["songplays"] - 1
+
+
+def test_pipeline_checks_once_when_a_check_stage_follows(config, monkeypatch):
+    runs = []
+    run_checks = data_quality.run_checks
+
+    def counted(*args, **kwargs):
+        runs.append(args)
+        return run_checks(*args, **kwargs)
+
+    monkeypatch.setattr(data_quality, "run_checks", counted)
+    Pipeline(config).run(["create", "load", "check"])
+    assert len(runs) == 1
+    Pipeline(config).run(["load"])
+    assert len(runs) == 2
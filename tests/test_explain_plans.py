@@ -0,0 +1,93 @@
+import copy
+
+from explain_plans import compare, parse_plan, split_statements, summarize
+
+REDSHIFT_PLAN = """\
+XN Merge  (cost=1000000000157.81..1000000000158.31 rows=200 width=40)
+  Merge Key: count(*)
+  ->  XN Network  (cost=1000000000157.81..1000000000158.31 rows=200 width=40)
+        Send to leader
+        ->  XN Sort  (cost=1000000000157.81..1000000000158.31 rows=200 width=40)
+              Sort Key: count(*)
+              ->  XN HashAggregate  (cost=149.16..150.16 rows=200 width=40)
+                    ->  XN Hash Join DS_BCAST_INNER  (cost=2.50..139.16 rows=2000 width=40)
+                          Hash Cond: (("outer".song_id)::text = ("inner".song_id)::text)
+                          ->  XN Seq Scan on songplays sp  (cost=0.00..20.00 rows=2000 width=20)
+                          ->  XN Hash  (cost=2.00..2.00 rows=200 width=40)
+                                ->  XN Seq Scan on songs s  (cost=0.00..2.00 rows=200 width=40)
+----- Tables missing statistics: songs -----
+----- Update statistics by running the ANALYZE command on these tables -----
+""".splitlines()
+
+POSTGRES_PLAN = """\
+Sort  (cost=45.12..45.62 rows=200 width=16)
+  Sort Key: (count(*)) DESC
+  ->  HashAggregate  (cost=35.48..37.48 rows=200 width=16)
+        Group Key: sp.user_id
+        ->  Hash Join  (cost=1.07..30.48 rows=1000 width=8)
+              Hash Cond: (sp.user_id = u.user_id)
+              ->  Seq Scan on songplays sp  (cost=0.00..20.00 rows=1000 width=4)
+              ->  Hash  (cost=1.03..1.03 rows=3 width=4)
+                    ->  Seq Scan on users u  (cost=0.00..1.03 rows=3 width=4)
+""".splitlines()
+
+
+def test_parse_redshift_plan():
+    plan = parse_plan(REDSHIFT_PLAN)
+    nodes = plan["nodes"]
+    assert [(node["depth"], node["operation"]) for node in nodes] == [
+        (0, "Merge"), (1, "Network"), (2, "Sort"), (3, "HashAggregate"), (4, "Hash Join"),
+        (5, "Seq Scan"), (5, "Hash"), (6, "Seq Scan")]
+    join = nodes[4]
+    assert join["distribution"] == "DS_BCAST_INNER"
+    assert (join["startup_cost"], join["total_cost"], join["rows"], join["width"]) == (2.5, 139.16, 2000, 40)
+    assert join["details"] == ['Hash Cond: (("outer".song_id)::text = ("inner".song_id)::text)']
+    assert [node["relation"] for node in nodes if node["relation"]] == ["songplays", "songs"]
+    assert nodes[1]["details"] == ["Send to leader"]
+    assert plan["warnings"][0] == "Tables missing statistics: songs"
+
+
+def test_parse_postgres_plan():
+    plan = summarize(parse_plan(POSTGRES_PLAN))
+    assert [(node["depth"], node["operation"]) for node in plan["nodes"]] == [
+        (0, "Sort"), (1, "HashAggregate"), (2, "Hash Join"), (3, "Seq Scan"), (3, "Hash"), (4, "Seq Scan")]
+    assert all(node["distribution"] is None for node in plan["nodes"])
+    assert (plan["total_cost"], plan["rows"]) == (45.62, 200)
+    assert plan["joins"] == [{"operation": "Hash Join", "distribution": None}]
+    assert plan["redistributions"] == [] and plan["warnings"] == []
+
+
+def test_compare_reports_new_redistribution():
+    plan = summarize(parse_plan(REDSHIFT_PLAN))
+    before = copy.deepcopy(plan)
+    before["redistributions"] = []
+    before["joins"] = [{"operation": "Hash Join", "distribution": "DS_DIST_NONE"}]
+    regressions = compare({"query top_songs": plan}, {"plans": {"query top_songs": before}}, tolerance=0.5)
+    assert regressions == {"query top_songs": ["new DS_BCAST_INNER step"]}
+
+
+def test_compare_reports_new_join_strategy():
+    plan = summarize(parse_plan(POSTGRES_PLAN))
+    before = copy.deepcopy(plan)
+    before["joins"] = [{"operation": "Merge Join", "distribution": None}]
+    assert compare({"q": plan}, {"plans": {"q": before}}, tolerance=0.5) == {"q": ["new Hash Join"]}
+
+
+def test_compare_cost_threshold():
+    plan = summarize(parse_plan(POSTGRES_PLAN))
+    cheaper = dict(copy.deepcopy(plan), total_cost=30.0)
+    # 45.62 is 52% above 30.0 and 14% above 40.0
+    assert compare({"q": plan}, {"plans": {"q": cheaper}}, tolerance=0.5) == {"q": ["cost 30.00 -> 45.62 (+52%)"]}
+    assert compare({"q": plan}, {"plans": {"q": cheaper}}, tolerance=0.6) == {}
+    assert compare({"q": plan}, {"plans": {"q": dict(cheaper, total_cost=40.0)}}, tolerance=0.5) == {}
+
+
+def test_compare_skips_errors_and_new_statements():
+    plan = summarize(parse_plan(POSTGRES_PLAN))
+    baseline = {"plans": {"failed": {"error": "relation does not exist"}}}
+    assert compare({"failed": plan, "new": plan}, baseline, tolerance=0.0) == {}
+
+
+def test_split_statements():
+    assert split_statements("DELETE FROM a;\nINSERT INTO a SELECT 1;\n") == ["DELETE FROM a;",
+                                                                            "INSERT INTO a SELECT 1;"]
@@ -0,0 +1,95 @@
+import gzip
+import json
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from manifest import build_manifest, cluster_slices, list_objects, plan_parts
+
+BUCKET = "sparkify-test"
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def put(s3, key, records):
+    body = "\n".join(json.dumps(record) for record in records).encode("utf-8")
+    s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+    return len(body)
+
+
+def read_manifest(s3, uri):
+    key = uri[len(f"s3://{BUCKET}/"):]
+    return json.loads(s3.get_object(Bucket=BUCKET, Key=key)["Body"].read())["entries"]
+
+
+def read_part(s3, url):
+    body = s3.get_object(Bucket=BUCKET, Key=url[len(f"s3://{BUCKET}/"):])["Body"].read()
+    return [json.loads(line) for line in gzip.decompress(body).decode("utf-8").splitlines()]
+
+
+def test_list_objects_filters_suffix_and_start_after(s3):
+    put(s3, "log_data/2018/11/2018-11-01-events.json", [{"ts": 1}])
+    put(s3, "log_data/2018/11/2018-11-02-events.json", [{"ts": 2}])
+    s3.put_object(Bucket=BUCKET, Key="log_data/readme.txt", Body=b"")
+    urls = [url for url, _ in list_objects(s3, f"'s3://{BUCKET}/log_data'")]
+    assert urls == [f"s3://{BUCKET}/log_data/2018/11/2018-11-01-events.json",
+                    f"s3://{BUCKET}/log_data/2018/11/2018-11-02-events.json"]
+    later = list_objects(s3, f"s3://{BUCKET}/log_data", start_after="log_data/2018/11/2018-11-01-events.json")
+    assert [url for url, _ in later] == urls[1:]
+
+
+def test_plan_parts_uses_multiple_of_slices():
+    objects = [(f"s3://b/{i}.json", 10) for i in range(20)]
+    parts = plan_parts(objects, slices=4, target_part_bytes=100)
+    assert len(parts) == 4
+    assert sorted(url for part in parts for url in part) == sorted(url for url, _ in objects)
+
+    # 200 bytes at 25 bytes per slice and part take two rounds of parts
+    assert len(plan_parts(objects, slices=4, target_part_bytes=25)) == 8
+
+
+def test_cluster_slices():
+    assert cluster_slices("dc2.large", 4) == 8
+    with pytest.raises(ValueError):
+        cluster_slices("x1.huge", 1)
+
+
+def test_build_manifest_without_compaction_lists_objects(s3):
+    size = put(s3, "song_data/A/a.json", [{"song_id": "a"}])
+    manifest = build_manifest(s3, f"s3://{BUCKET}/song_data", f"s3://{BUCKET}/manifests/song_data.manifest")
+    assert read_manifest(s3, manifest) == [{"url": f"s3://{BUCKET}/song_data/A/a.json", "mandatory": True,
+                                            "meta": {"content_length": size}}]
+
+
+def test_build_manifest_compacts_into_gzip_parts(s3):
+    for i in range(10):
+        put(s3, f"song_data/A/{i}.json", [{"song_id": str(i)}])
+    big = [{"song_id": f"big{i}", "title": "x" * 50} for i in range(20)]
+    put(s3, "song_data/B/big.json", big)
+
+    manifest = build_manifest(s3, f"s3://{BUCKET}/song_data", f"s3://{BUCKET}/manifests/song_data.manifest",
+                              compact_prefix=f"s3://{BUCKET}/compacted/song_data", slices=2,
+                              target_part_bytes=1000)
+    entries = read_manifest(s3, manifest)
+    urls = [entry["url"] for entry in entries]
+    # The ten small objects fill one part per slice; the large one is compressed on its own
+    assert urls == [f"s3://{BUCKET}/compacted/song_data/part-{i:05d}.json.gz" for i in range(3)]
+    for entry in entries:
+        head = s3.head_object(Bucket=BUCKET, Key=entry["url"][len(f"s3://{BUCKET}/"):])
+        assert entry["meta"]["content_length"] == head["ContentLength"]
+
+    small = read_part(s3, urls[0]) + read_part(s3, urls[1])
+    assert sorted(record["song_id"] for record in small) == [str(i) for i in range(10)]
+    assert read_part(s3, urls[2]) == big
+
+
+def test_build_manifest_without_objects_fails(s3):
+    with pytest.raises(ValueError):
+        build_manifest(s3, f"s3://{BUCKET}/missing", f"s3://{BUCKET}/manifests/none.manifest")
@@ -0,0 +1,156 @@
+import configparser
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import provisioning
+from sparkify import Pipeline
+from provisioning import (S3_READ_ONLY_POLICY, Timings, attach_policy, authorize_ingress, backoff_delays,
+                          ensure_role, provision, update_config, wait_until)
+
+ROLE_NAME = "dwhRedshiftRole"
+DWH_PARAMS = {
+    "DWH_CLUSTER_TYPE": "multi-node",
+    "DWH_NODE_TYPE": "dc2.large",
+    "DWH_NUM_NODES": "2",
+    "DWH_DB": "dwh",
+    "DWH_CLUSTER_IDENTIFIER": "sparkify-test",
+    "DWH_DB_USER": "dwhuser",
+    "DWH_DB_PASSWORD": "Passw0rd",
+    "DWH_PORT": "5439",
+    "DWH_IAM_ROLE_NAME": ROLE_NAME,
+}
+
+
+@pytest.fixture
+def managed_policies(monkeypatch):
+    # Die S3ReadOnlyAccess-Policy gibt es in moto nur mit geladenen AWS-Policies; vor mock_aws setzen
+    monkeypatch.setenv("MOTO_IAM_LOAD_MANAGED_POLICIES", "true")
+
+
+@pytest.fixture
+def aws(managed_policies):
+    with mock_aws():
+        yield {name: boto3.client(name, region_name="us-west-2") for name in ("iam", "redshift", "ec2")}
+
+
+@pytest.fixture
+def reachable(monkeypatch):
+    # Der moto-Endpoint existiert nicht; TCP- und SQL-Prüfung gelten als erfolgreich
+    monkeypatch.setattr(provisioning, "tcp_probe", lambda host, port: True)
+    return lambda host, dwh_params: True
+
+
+def ingress_ports(ec2, group_id):
+    group = ec2.describe_security_groups(GroupIds=[group_id])["SecurityGroups"][0]
+    return [(rule["FromPort"], rule["IpRanges"][0]["CidrIp"]) for rule in group["IpPermissions"]
+            if rule.get("FromPort") == 5439]
+
+
+def test_backoff_delays_grow_up_to_cap():
+    delays = backoff_delays(base=2, cap=10)
+    first, second, third, fourth, fifth = (next(delays) for _ in range(5))
+    assert 1 <= first <= 2 and 2 <= second <= 4 and 4 <= third <= 8
+    assert 5 <= fourth <= 10 and 5 <= fifth <= 10
+
+
+def test_wait_until_retries_with_backoff():
+    results, sleeps = iter([None, None, "bereit"]), []
+    assert wait_until(lambda: next(results), 60, "Test", base=2, cap=60, sleep=sleeps.append) == "bereit"
+    assert len(sleeps) == 2
+    assert 1 <= sleeps[0] <= 2 and 2 <= sleeps[1] <= 4
+
+
+def test_wait_until_times_out():
+    sleeps = []
+    with pytest.raises(TimeoutError, match="Test"):
+        wait_until(lambda: None, 0, "Test", sleep=sleeps.append)
+    assert sleeps == []
+
+
+def test_ensure_role_is_idempotent(aws):
+    arn = ensure_role(aws["iam"], ROLE_NAME)
+    assert arn.endswith(f":role/{ROLE_NAME}")
+    assert ensure_role(aws["iam"], ROLE_NAME) == arn
+    assert len(aws["iam"].list_roles()["Roles"]) == 1
+
+
+def test_attach_policy_twice(aws):
+    ensure_role(aws["iam"], ROLE_NAME)
+    attach_policy(aws["iam"], ROLE_NAME)
+    attach_policy(aws["iam"], ROLE_NAME)
+    policies = aws["iam"].list_attached_role_policies(RoleName=ROLE_NAME)["AttachedPolicies"]
+    assert [policy["PolicyArn"] for policy in policies] == [S3_READ_ONLY_POLICY]
+
+
+def test_authorize_ingress_opens_port_once(aws):
+    group_id = authorize_ingress(aws["ec2"], 5439)
+    assert authorize_ingress(aws["ec2"], 5439) == group_id
+    assert ingress_ports(aws["ec2"], group_id) == [(5439, "0.0.0.0/0")]
+
+
+def test_authorize_ingress_without_vpc_fails(aws):
+    with pytest.raises(RuntimeError):
+        authorize_ingress(aws["ec2"], 5439, vpc_id="vpc-00000000")
+
+
+def test_provision_creates_cluster_with_role(aws, reachable):
+    timings = Timings()
+    cluster, role_arn = provision(aws["iam"], aws["redshift"], aws["ec2"], DWH_PARAMS, timings,
+                                  sleep=lambda seconds: None, connect=reachable)
+    assert cluster["ClusterStatus"] == "available"
+    assert (cluster["NodeType"], cluster["NumberOfNodes"]) == ("dc2.large", 2)
+    assert [role["IamRoleArn"] for role in cluster["IamRoles"]] == [role_arn]
+    assert set(timings.steps) >= {"IAM-Rolle", "Policy anhängen", "Sicherheitsgruppe", "Cluster anlegen",
+                                  "Warten auf Cluster", "TCP-Bereitschaft", "SQL-Verbindung"}
+
+
+def test_provision_rerun_reuses_resources(aws, reachable):
+    first, role_arn = provision(aws["iam"], aws["redshift"], aws["ec2"], DWH_PARAMS,
+                                sleep=lambda seconds: None, connect=reachable)
+    aws["redshift"].create_cluster = None  # ein zweites Anlegen würde fehlschlagen
+    second, second_arn = provision(aws["iam"], aws["redshift"], aws["ec2"], DWH_PARAMS,
+                                   sleep=lambda seconds: None, connect=reachable)
+    assert second_arn == role_arn
+    assert second["Endpoint"] == first["Endpoint"]
+    assert len(aws["redshift"].describe_clusters()["Clusters"]) == 1
+
+
+def test_provision_waits_for_sql_connection(aws, reachable):
+    answers, sleeps = iter([None, None, True]), []
+    provision(aws["iam"], aws["redshift"], aws["ec2"], DWH_PARAMS, sleep=sleeps.append,
+              connect=lambda host, dwh_params: next(answers))
+    assert len(sleeps) == 2
+
+
+def test_provision_rejects_missing_params(aws):
+    with pytest.raises(ValueError, match="DWH_DB_PASSWORD"):
+        provision(aws["iam"], aws["redshift"], aws["ec2"], dict(DWH_PARAMS, DWH_DB_PASSWORD=""))
+
+
+def test_teardown_uses_pipeline_config(aws, reachable, tmp_path, monkeypatch):
+    provision(aws["iam"], aws["redshift"], aws["ec2"], DWH_PARAMS, sleep=lambda seconds: None, connect=reachable)
+    config = configparser.ConfigParser()
+    config.read_dict({"DWH": DWH_PARAMS, "ETL": {"BACKEND": "redshift"}})
+    # Ohne dwh.cfg im Arbeitsverzeichnis: der Abbau darf nur die übergebene Konfiguration lesen
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    Pipeline(config).teardown()
+    assert aws["redshift"].describe_clusters()["Clusters"] == []
+    assert aws["iam"].list_roles()["Roles"] == []
+
+
+def test_update_config_writes_endpoint_and_role(tmp_path):
+    path = tmp_path / "dwh.cfg"
+    config = configparser.ConfigParser()
+    config.read_dict({"CLUSTER": {"HOST": ""}, "IAM_ROLE": {"ARN": ""}})
+    with open(path, "w") as f:
+        config.write(f)
+    update_config("host.example", "arn:aws:iam::123456789012:role/r", path=path)
+    written = configparser.ConfigParser()
+    written.read(path)
+    assert written.get("CLUSTER", "HOST") == "host.example"
+    assert written.get("CLUSTER", "REGION") == "us-west-2"
+    assert written.get("IAM_ROLE", "ARN") == "arn:aws:iam::123456789012:role/r"
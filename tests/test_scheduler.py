@@ -0,0 +1,76 @@
+import pytest
+
+from duckdb_backend import DuckDBSession
+from scheduler import Step, critical_path, execute_step, run_dag, topological_order
+
+
+@pytest.fixture
+def session():
+    session = DuckDBSession()
+    yield session
+    session.close()
+
+
+def count(session, table):
+    return session.execute(f"SELECT COUNT(*) FROM {table};", fetch=True)[0][0]
+
+
+def test_topological_order_puts_dependencies_first():
+    steps = [Step("insert", "", depends_on=["stage_a", "stage_b"]), Step("stage_a", ""), Step("stage_b", ""),
+             Step("aggregate", "", depends_on=["insert"])]
+    order = topological_order(steps)
+    assert order.index("insert") > max(order.index("stage_a"), order.index("stage_b"))
+    assert order[-1] == "aggregate"
+
+
+def test_topological_order_rejects_cycles():
+    steps = [Step("a", "", depends_on=["c"]), Step("b", "", depends_on=["a"]), Step("c", "", depends_on=["b"])]
+    with pytest.raises(ValueError, match="Cycle"):
+        topological_order(steps)
+
+
+def test_topological_order_rejects_unknown_and_duplicate_steps():
+    with pytest.raises(ValueError, match="unknown"):
+        topological_order([Step("a", "", depends_on=["missing"])])
+    with pytest.raises(ValueError, match="Duplicate"):
+        topological_order([Step("a", ""), Step("a", "")])
+
+
+def test_critical_path_follows_slowest_chain():
+    steps = [Step("events", ""), Step("songs", ""), Step("songplays", "", depends_on=["events", "songs"]),
+             Step("users", "", depends_on=["events"])]
+    path, seconds = critical_path(steps, {"events": 1.0, "songs": 3.0, "songplays": 2.0, "users": 0.5})
+    assert path == ["songs", "songplays"]
+    assert seconds == pytest.approx(5.0)
+
+
+def test_critical_path_of_no_steps():
+    assert critical_path([], {}) == ([], 0.0)
+
+
+def test_run_dag_runs_every_step(session):
+    session.execute("CREATE TABLE source (id INT);")
+    steps = [Step("fill", "INSERT INTO source VALUES (1), (2), (3);"),
+             Step("copy_a", "CREATE TABLE copy_a AS SELECT * FROM source;", depends_on=["fill"]),
+             Step("copy_b", "CREATE TABLE copy_b AS SELECT * FROM source;", depends_on=["fill"])]
+    report = run_dag(steps, session.connect, max_concurrency=2)
+    assert set(report["steps"]) == {"fill", "copy_a", "copy_b"}
+    assert report["critical_path"][0] == "fill"
+    assert count(session, "copy_a") == count(session, "copy_b") == 3
+
+
+def test_run_dag_stops_dependents_of_failed_step(session):
+    session.execute("CREATE TABLE target (id INT);")
+    started = []
+
+    def run_step(step, connect):
+        started.append(step.name)
+        return execute_step(step, connect)
+
+    steps = [Step("broken", "INSERT INTO missing_table VALUES (1);"),
+             Step("dependent", "INSERT INTO target VALUES (1);", depends_on=["broken"]),
+             Step("transitive", "INSERT INTO target VALUES (2);", depends_on=["dependent"])]
+    with pytest.raises(Exception, match="missing_table"):
+        run_dag(steps, session.connect, max_concurrency=2, run_step=run_step)
+    assert started == ["broken"]
+    assert count(session, "target") == 0
@@ -0,0 +1,96 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from generate_data import write_jsonpaths
+from local_ingest import load_jsonpaths
+from sql_queries import staging_events_table_create, staging_songs_table_create
+from validation import Validator
+
+
+def epoch_ms(day):
+    return int(datetime.fromisoformat(day).replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+TS = epoch_ms("2018-11-01")
+
+
+def event(**values):
+    record = {"artist": "Artist", "auth": "Logged In", "firstName": "Ann", "gender": "F", "itemInSession": 0,
+              "lastName": "Lee", "length": 200.5, "level": "free", "location": "Here", "method": "PUT",
+              "page": "NextSong", "registration": 1540000000000, "sessionId": 1, "song": "Song", "status": 200,
+              "ts": TS, "userAgent": "agent", "userId": 1}
+    record.update(values)
+    return record
+
+
+def write_records(directory, records):
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / "records.json", "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    return str(directory)
+
+
+def read_rejects(path):
+    with open(path) as f:
+        return {entry["line"]: entry["reasons"] for entry in map(json.loads, f)}
+
+
+@pytest.fixture
+def validator(tmp_path):
+    return Validator(reject_path=str(tmp_path / "rejects.ndjson"),
+                     ts_bounds=(epoch_ms("2000-01-01"), epoch_ms("2030-01-01")))
+
+
+@pytest.fixture
+def jsonpaths(tmp_path):
+    write_jsonpaths(str(tmp_path / "log_json_path.json"))
+    return load_jsonpaths(str(tmp_path / "log_json_path.json"))
+
+
+def test_events_are_checked_against_ranges(tmp_path, validator, jsonpaths):
+    records = [
+        event(),                                      # 1 clean
+        event(sessionId=-2 ** 31, status=2 ** 31 - 1),  # 2 INT minimum and maximum
+        event(sessionId=2 ** 31),                     # 3 above the INT range
+        event(sessionId=-2 ** 31 - 1),                # 4 below the INT range
+        event(userId=1.5),                            # 5 not an integer
+        event(itemInSession="x"),                     # 6 not a number
+        event(ts=epoch_ms("1999-12-31")),             # 7 before TS_MIN
+        event(ts=epoch_ms("2031-01-01")),             # 8 after TS_MAX
+        event(length=0),                              # 9 not positive
+        event(length=-1.5, status=2 ** 31),           # 10 two reasons
+        event(userId=2.0, length=None),               # 11 integral float, missing length
+    ]
+    root = write_records(tmp_path / "log_data", records)
+    rows = list(validator.rows(root, staging_events_table_create, jsonpaths))
+
+    assert validator.stats["staging_events"]["rows"] == 11
+    assert validator.stats["staging_events"]["rejected"] == 8
+    assert read_rejects(validator.reject_path) == {
+        3: ["sessionId out of INT range"],
+        4: ["sessionId out of INT range"],
+        5: ["userId is not an integer"],
+        6: ["itemInSession is not a number"],
+        7: ["ts out of range"],
+        8: ["ts out of range"],
+        9: ["length not positive"],
+        10: ["status out of INT range", "length not positive"],
+    }
+    assert len(rows) == 3
+    assert (rows[1][12], rows[1][14]) == (-2 ** 31, 2 ** 31 - 1)
+    assert rows[2][17] == 2 and rows[2][6] is None
+
+
+def test_songs_reject_non_positive_duration(tmp_path, validator):
+    song = {"num_songs": 1, "artist_id": "AR1", "artist_latitude": 1.5, "artist_longitude": None,
+            "artist_location": "", "artist_name": "Artist", "song_id": "SO1", "title": "Title",
+            "duration": 180.0, "year": 2000}
+    root = write_records(tmp_path / "song_data", [song, dict(song, duration=0), dict(song, year=2000.5),
+                                                  dict(song, title="é" * 129)])
+    rows = list(validator.rows(root, staging_songs_table_create))
+    assert len(rows) == 1 and rows[0][2] == 1.5
+    assert read_rejects(validator.reject_path) == {2: ["duration not positive"], 3: ["year is not an integer"],
+                                                   4: ["title longer than 256 bytes"]}
@@ -0,0 +1,117 @@
+import argparse
+import configparser
+import pandas as pd
+from psycopg2.extensions import cursor as psycopg2_cursor
+from psycopg2.extras import execute_values
+from local_ingest import copy_rows
+import sql_queries
+from sql_queries import time_range_select, time_keys_select, time_values_insert, time_row_insert
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+FREQUENCIES = {"second": "s", "minute": "min", "hour": "h"}
+COLUMNS = ["start_time", "hour", "day", "week", "month", "year", "weekday"]
+
+
+def calendar(start, end, grain="hour"):
+    """Returns the time rows from `start` to `end` at `grain`, computed column-wise with pandas."""
+    freq = FREQUENCIES[grain]
+    index = pd.date_range(pd.Timestamp(start).floor(freq), pd.Timestamp(end).floor(freq), freq=freq)
+    return pd.DataFrame({
+        "start_time": index,
+        "hour": index.hour,
+        "day": index.day,
+        "week": index.isocalendar().week.to_numpy(dtype="int64"),
+        "month": index.month,
+        "year": index.year,
+        # pandas counts from Monday = 0, Redshift's EXTRACT(weekday) from Sunday = 0
+        "weekday": (index.dayofweek + 1) % 7,
+    })
+
+
+def staged_range(cur):
+    """Returns the (first, last) event timestamp in staging_events, or None if it is empty.
+
+    In incremental runs staging only holds the objects after the watermark, so
+    this is also the range the new events can add.
+    """
+    cur.execute(time_range_select)
+    first, last = cur.fetchone()
+    if first is None:
+        return None
+    return pd.to_datetime(first, unit="ms"), pd.to_datetime(last, unit="ms")
+
+
+def missing_rows(cur, start, end, grain):
+    """Returns the calendar rows between `start` and `end` that are not in the time table yet."""
+    frame = calendar(start, end, grain)
+    if frame.empty:
+        return frame
+    cur.execute(time_keys_select, (frame.start_time.iloc[0].to_pydatetime(),
+                                   frame.start_time.iloc[-1].to_pydatetime()))
+    existing = pd.DatetimeIndex([row[0] for row in cur.fetchall()])
+    return frame[~frame.start_time.isin(existing)]
+
+
+def _rows(frame):
+    # psycopg2 cannot adapt numpy scalars, hand over plain Python values
+    return list(zip(frame.start_time.dt.to_pydatetime(), *(frame[name].tolist() for name in COLUMNS[1:])))
+
+
+def build_time_dimension(cur, grain=None, start=None, end=None, use_copy=False, page_size=1000):
+    """Generates the missing time rows for the staged events (or `start`..`end`) and loads them.
+
+    Uses COPY FROM STDIN on PostgreSQL (`use_copy`) and multi-row INSERTs on
+    Redshift, which does not support COPY from the client; other cursors (DuckDB)
+    get executemany. Returns the number of added rows; the caller commits.
+    """
+    grain = grain or sql_queries.TIME_GRAIN
+    if grain == "second":
+        raise ValueError("The calendar builder needs TIME_GRAIN minute or hour, use the SQL builder for seconds")
+    if start is None or end is None:
+        staged = staged_range(cur)
+        if staged is None:
+            logger.info("No staged events, time dimension unchanged")
+            return 0
+        start = staged[0] if start is None else start
+        end = staged[1] if end is None else end
+
+    frame = missing_rows(cur, start, end, grain)
+    if frame.empty:
+        logger.info("Time dimension already complete")
+        return 0
+    rows = _rows(frame)
+    if use_copy:
+        copy_rows(cur, "time", COLUMNS, rows)
+    elif not isinstance(cur, psycopg2_cursor):
+        cur.executemany(time_row_insert, rows)
+    else:
+        execute_values(cur, time_values_insert, rows, page_size=page_size)
+    logger.info(f"Added {len(rows)} {grain} rows from {frame.start_time.iloc[0]} to {frame.start_time.iloc[-1]}")
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill the time dimension at the configured TIME_GRAIN.")
+    parser.add_argument("--start", default=None, help="first timestamp, default the first staged event")
+    parser.add_argument("--end", default=None, help="last timestamp, default the last staged event")
+    args = parser.parse_args()
+
+    from db_session import Session
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    session = Session.from_config(config)
+    try:
+        with session.connection() as conn:
+            build_time_dimension(conn.cursor(), start=args.start, end=args.end)
+            conn.commit()
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
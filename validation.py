@@ -0,0 +1,180 @@
+import argparse
+import configparser
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+from ddl import FLOAT_TYPES, parse_create_table, base_type
+from local_ingest import iter_json_files, iter_records, extract_jsonpaths, extract_auto, load_jsonpaths
+from sql_queries import staging_events_table_create, staging_songs_table_create
+from logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Redshift stores a VARCHAR without length as VARCHAR(256)
+DEFAULT_VARCHAR_LENGTH = 256
+INT_LIMITS = {"SMALLINT": 2 ** 15, "INT": 2 ** 31, "INTEGER": 2 ** 31, "BIGINT": 2 ** 63}
+TEXT_TYPES = {"VARCHAR", "CHAR", "TEXT"}
+
+
+def _epoch_ms(value):
+    moment = pd.Timestamp(value)
+    if moment.tzinfo is None:
+        moment = moment.tz_localize("UTC")
+    return int(moment.timestamp() * 1000)
+
+
+def text_length(column_type):
+    """Returns the maximum length in bytes of a VARCHAR/CHAR column type."""
+    size = column_type.partition("(")[2].rstrip(")").strip()
+    return int(size) if size.isdigit() else DEFAULT_VARCHAR_LENGTH
+
+
+def record_chunks(root, names, jsonpaths=None, chunk_size=10000):
+    """Yields DataFrames of up to `chunk_size` raw records, with their source file and line."""
+    rows, sources = [], []
+    for path in iter_json_files(root):
+        for line, record in enumerate(iter_records(path), 1):
+            rows.append(extract_jsonpaths(record, jsonpaths) if jsonpaths else extract_auto(record, names))
+            sources.append((path, line))
+            if len(rows) >= chunk_size:
+                yield pd.DataFrame(rows, columns=names, dtype=object), sources
+                rows, sources = [], []
+    if rows:
+        yield pd.DataFrame(rows, columns=names, dtype=object), sources
+
+
+class Validator:
+    """Type- and range-checks staging records column-wise before they are loaded.
+
+    Records failing a check are appended to `reject_path` as JSON lines with the
+    reasons; only the clean rows are passed on, converted for COPY.
+    """
+
+    def __init__(self, reject_path=None, ts_bounds=None, chunk_size=10000):
+        self.reject_path = reject_path
+        self.ts_bounds = ts_bounds or (_epoch_ms("2000-01-01"),
+                                       _epoch_ms(datetime.now(timezone.utc) + timedelta(days=1)))
+        self.chunk_size = chunk_size
+        self.stats = {}
+
+    @classmethod
+    def from_config(cls, config):
+        """Creates a validator from the [VALIDATION] section of dwh.cfg."""
+        ts_max = config.get('VALIDATION', 'TS_MAX', fallback='')
+        return cls(reject_path=config.get('VALIDATION', 'REJECT_FILE', fallback='') or None,
+                   ts_bounds=(_epoch_ms(config.get('VALIDATION', 'TS_MIN', fallback='2000-01-01')),
+                              _epoch_ms(ts_max) if ts_max else
+                              _epoch_ms(datetime.now(timezone.utc) + timedelta(days=1))),
+                   chunk_size=config.getint('VALIDATION', 'CHUNK_SIZE', fallback=10000))
+
+    def check(self, frame, columns):
+        """Returns the COPY-ready columns and a Series of reasons ('' for clean rows)."""
+        reasons = pd.Series("", index=frame.index, dtype=object)
+        values = {}
+
+        def reject(mask, reason):
+            if mask.any():
+                reasons[mask] += reason + "; "
+
+        for column in columns:
+            name, kind = column["name"], base_type(column["type"])
+            raw = frame[name]
+            present = raw.notna() & (raw.astype(str) != "")
+            if kind in INT_LIMITS or kind in FLOAT_TYPES:
+                numeric = pd.to_numeric(raw.where(present), errors="coerce")
+                reject(present & numeric.isna(), f"{name} is not a number")
+                if kind in INT_LIMITS:
+                    reject(present & numeric.notna() & (numeric % 1 != 0), f"{name} is not an integer")
+                    # Two's complement: -limit is the smallest value, limit - 1 the largest
+                    limit = INT_LIMITS[kind]
+                    out_of_range = (numeric < -limit) | (numeric >= limit)
+                    reject(out_of_range, f"{name} out of {kind} range")
+                    integral = numeric.where((numeric % 1 == 0) & ~out_of_range)
+                    values[name] = integral.astype("Int64").astype(object)
+                else:
+                    values[name] = numeric.astype(object)
+            elif kind in TEXT_TYPES:
+                lengths = raw.where(present, "").astype(str).str.encode("utf-8").str.len()
+                reject(lengths > text_length(column["type"]), f"{name} longer than {text_length(column['type'])} bytes")
+                values[name] = raw
+            else:
+                values[name] = raw
+            values[name] = values[name].where(values[name].notna(), None)
+
+        # Value ranges beyond the column types
+        if "ts" in values:
+            ts = pd.to_numeric(values["ts"], errors="coerce")
+            low, high = self.ts_bounds
+            reject(ts.notna() & ((ts < low) | (ts > high)), "ts out of range")
+        for name in ("length", "duration"):
+            if name in values:
+                number = pd.to_numeric(values[name], errors="coerce")
+                reject(number.notna() & (number <= 0), f"{name} not positive")
+        return values, reasons
+
+    def _write_rejects(self, table, frame, sources, reasons, bad):
+        if not self.reject_path:
+            return
+        directory = os.path.dirname(self.reject_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.reject_path, "a") as f:
+            for position in bad.to_numpy().nonzero()[0]:
+                path, line = sources[position]
+                f.write(json.dumps({"table": table, "file": path, "line": line,
+                                    "reasons": reasons.iloc[position].rstrip("; ").split("; "),
+                                    "record": frame.iloc[position].to_dict()}, default=str) + "\n")
+
+    def rows(self, root, create_query, jsonpaths=None):
+        """Yields the clean rows of all JSON files below `root`, like local_ingest.staging_rows."""
+        table, columns = parse_create_table(create_query)
+        names = [column["name"] for column in columns]
+        if jsonpaths is not None and len(jsonpaths) != len(columns):
+            raise ValueError(f"jsonpaths file has {len(jsonpaths)} entries, table has {len(columns)} columns")
+
+        total = rejected = 0
+        seconds = 0.0
+        start = time.perf_counter()
+        for frame, sources in record_chunks(root, names, jsonpaths, self.chunk_size):
+            values, reasons = self.check(frame, columns)
+            bad = reasons != ""
+            self._write_rejects(table, frame, sources, reasons, bad)
+            clean = list(zip(*(values[name][~bad].tolist() for name in names)))
+            seconds += time.perf_counter() - start
+            total += len(frame)
+            rejected += int(bad.sum())
+            # Time spent downstream while consuming the rows does not count as validation
+            yield from clean
+            start = time.perf_counter()
+
+        self.stats[table] = {"rows": total, "rejected": rejected, "seconds": round(seconds, 3),
+                             "rows_per_second": round(total / seconds) if seconds else None}
+        logger.info(f"Validated {total} rows for {table}, rejected {rejected} "
+                    f"({total / max(seconds, 1e-9):.0f} rows/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate the local log and song data against the staging DDL.")
+    parser.add_argument("--rejects", default=None, help="reject file, default [VALIDATION] REJECT_FILE")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    validator = Validator.from_config(config)
+    if args.rejects:
+        validator.reject_path = args.rejects
+    for _ in validator.rows(config.get('LOCAL', 'LOG_DATA'), staging_events_table_create,
+                            load_jsonpaths(config.get('LOCAL', 'LOG_JSONPATH'))):
+        pass
+    for _ in validator.rows(config.get('LOCAL', 'SONG_DATA'), staging_songs_table_create):
+        pass
+    if any(stats["rejected"] for stats in validator.stats.values()):
+        raise SystemExit(f"Rejected records written to {validator.reject_path}")
+
+
+if __name__ == "__main__":
+    main()